@@ -1,31 +1,36 @@
 #!/usr/bin/env python3
+import time
+STARTED = time.perf_counter()  # before any other import, for --startup-report
+
 import tkinter as tk
-from tkinter import ttk, scrolledtext, filedialog, messagebox, Menu
-import subprocess
+from tkinter import ttk, scrolledtext, messagebox, filedialog, simpledialog, Menu
 import threading
 import os
 import sys
-import concurrent.futures
+import io
 import json
 import queue
-import ctypes
-import shlex 
-from pathlib import Path
 
-# --- Configuration ---
-APP_NAME = "gallery-dl-gui"
-if sys.platform == 'win32':
-    CONFIG_DIR = os.path.join(os.environ.get('APPDATA', os.path.expanduser('~')), APP_NAME)
-else:
-    CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".config", APP_NAME)
-
-if not os.path.exists(CONFIG_DIR):
-    try:
-        os.makedirs(CONFIG_DIR)
-    except OSError:
-        CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+from gallery_dl_config import APP_NAME, CONFIG_DIR, JOURNAL_FILE, MAX_WORKERS_LIMIT, SETTINGS_FILE
+from gallery_dl_urls import URL_PATTERN, UrlQueue, extract_urls, iter_file_urls, unique_urls
+# The rest (the engine and its asyncio machinery, the journal, dedup,
+# subscriptions, tkinterdnd2, ...) is imported where it is first used, so
+# the window is up before any of it has to load. The dialogs cost ~2 ms and
+# stay above.
 
-SETTINGS_FILE = os.path.join(CONFIG_DIR, "settings.json")
+# --- Configuration ---
+LOG_FILE = os.path.join(CONFIG_DIR, "gallery-dl-gui.log")
+# gallery-dl's path and version, reused while the executable's path, size
+# and mtime stay the same, so launching doesn't start a second Python.
+PROBE_CACHE_FILE = os.path.join(CONFIG_DIR, "gallery-dl-probe.json")
+LOG_TICK_MS = 100
+LOG_TICK_BUDGET = 0.05  # seconds per tick spent draining the log queue
+QUEUE_RESYNC_MS = 400  # re-index the URL box this long after the user stops typing
+IMPORT_CHUNK = 500  # URLs handed from the import thread to the URL box at a time
+SUBSCRIPTION_FIRST_CHECK_MS = 60000  # first look for due subscriptions, well after the resume prompt
+# Keys that can't change the URL box's text.
+NAVIGATION_KEYS = frozenset(("Up", "Down", "Left", "Right", "Home", "End", "Prior", "Next", "Escape",
+                             "Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R"))
 DEFAULT_SETTINGS = {
     "save_dir": os.path.dirname(os.path.abspath(__file__)),
     "cookies_path": "",
@@ -34,23 +39,84 @@ DEFAULT_SETTINGS = {
     "window_height": 900,
     "flatten_folder": True,
     "use_archive": False,
-    "extra_args": ""
+    "extra_args": "",
+    # Politeness: parallel downloads per host (0 = no cap), seconds between
+    # starts on one host, and per-domain overrides such as
+    # {"pixiv.net": {"workers": 1, "delay": 2.0}}.
+    "per_host_workers": 2,
+    "host_delay": 0.0,
+    "host_limits": {},
+    # Treat the worker counts as ceilings and back off/ramp up per host.
+    "adaptive_workers": False,
+    # Transient failures (timeouts, 5xx, throttling) are retried automatically
+    # after retry_delay, 2x retry_delay, ... seconds (with jitter).
+    "max_retries": 3,
+    "retry_delay": 5.0,
+    # URLs queued ahead of the workers; the rest of a batch stays unread.
+    "queue_window": 1000,
+    # Run URLs in long-lived Python workers that import gallery-dl once
+    # (needs gallery-dl installed for this Python); each worker is replaced
+    # after recycle_jobs URLs or once it uses more than recycle_mb MB.
+    "persistent_workers": False,
+    "recycle_jobs": 200,
+    "recycle_mb": 512,
+    # With Track History on, URLs that completed within this many hours are
+    # left out of a batch without starting gallery-dl (0 = always run).
+    "skip_fresh_hours": 24.0,
+    # "deferred": each gallery-dl run writes its archive entries in one go
+    # when it ends, so workers don't wait on each other; "shared": per file.
+    "archive_mode": "deferred",
+    # Live counters (files/s, MB/s, ETA, slowest job) are written here every
+    # second while a batch runs: JSON for *.json, else Prometheus text format.
+    "metrics_file": "",
+    # Bandwidth budget for all downloads together, e.g. "4M" (bytes/s; empty
+    # = unlimited), and time-of-day overrides such as
+    # [{"from": "08:00", "to": "18:00", "limit": "1M", "days": ["mon", "tue", "wed", "thu", "fri"]}].
+    "bandwidth_limit": "",
+    "bandwidth_schedule": [],
+    # Download into a staging folder next to the save folder (or staging_dir)
+    # and move finished files in batches, logged in .library-manifest.jsonl.
+    "staged_publish": False,
+    "staging_dir": "",
+    # Wallpaper Copies: every downloaded image is also saved downscaled for
+    # each of derivative_sizes (empty = this screen), e.g. ["3840x2160",
+    # "2560x1440"], plus a thumbnail_size px thumbnail, in derivative_dir
+    # (default: "<save folder>.derivatives"). Needs Pillow.
+    "derivatives": False,
+    "derivative_sizes": [],
+    "thumbnail_size": 320,
+    "derivative_dir": "",
+    "derivative_format": "jpg",
+    # Hash every finished download into the save folder's duplicate index
+    # (kept in the config folder) and log exact duplicates and images within
+    # dedup_distance bits of perceptual hash (0 = exact only). File > Find
+    # Duplicates moves them.
+    "dedup_index": False,
+    "dedup_distance": 6,
+    # Subscriptions menu: due subscriptions are synced while nothing else
+    # runs, checked every subscription_check_minutes (0 = only on demand).
+    # A sync stops walking a gallery after subscription_abort_after files in
+    # a row that were downloaded before.
+    "subscription_check_minutes": 15,
+    "subscription_abort_after": 5,
+    # Profiling: time every URL's phases and the console refreshes and save
+    # them here as a Chrome/Perfetto trace when the batch ends.
+    "trace_file": "",
+    # The console keeps only the newest log_max_lines lines; with log_to_file
+    # everything also goes to gallery-dl-gui.log (rotated at log_file_mb).
+    "log_max_lines": 5000,
+    "log_to_file": False,
+    "log_file_mb": 5
 }
 
 # --- High DPI Fix (Windows) ---
 if sys.platform == 'win32':
     try:
+        import ctypes
         ctypes.windll.shcore.SetProcessDpiAwareness(1)
     except Exception:
         pass
 
-# --- Drag & Drop Import Check ---
-try:
-    from tkinterdnd2 import DND_FILES, DND_TEXT, TkinterDnD
-    HAS_DND = True
-except ImportError:
-    HAS_DND = False
-
 class CreateToolTip(object):
     """
     Lightweight Tooltip class for UI hints.
@@ -116,11 +182,85 @@ class CreateToolTip(object):
         self.tw= None
         if tw: tw.destroy()
 
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600: return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def format_metrics(m):
+    """Status bar text for a "metrics" event."""
+    more = "+" if m["more"] else ""
+    parts = [f"Progress: {m['urls_completed']}/{m['urls_total']}{more}",
+             f"{m['files_per_sec']:.1f} files/s", f"{m['bytes_per_sec'] / 1e6:.1f} MB/s"]
+    if m["eta"] is not None: parts.append(f"ETA {format_duration(m['eta'])}")
+    slowest = m["slowest"]
+    if slowest and slowest["running"] >= 60:
+        parts.append(f"Slowest: {slowest['worker']} {format_duration(slowest['running'])} "
+                     f"(idle {format_duration(slowest['idle'])})")
+    return " | ".join(parts)
+
+
+class StartupTimer:
+    """Milestones of a launch; --startup-report logs how long each step took."""
+    def __init__(self, started=None, report=False):
+        self.started = time.perf_counter() if started is None else started
+        self.report = report
+        self.marks = []
+
+    def mark(self, step):
+        self.marks.append((step, time.perf_counter()))
+
+    def format(self):
+        lines, last = [], self.started
+        for step, at in self.marks:
+            lines.append(f"{step:<18} {(at - last) * 1000:7.1f} ms  (at {(at - self.started) * 1000:7.1f} ms)")
+            last = at
+        return lines
+
+
+def probe_gallery_dl():
+    """
+    gallery-dl's path and version, or None if it isn't on the PATH.
+
+    `gallery-dl --version` costs a whole Python start-up, so its answer is
+    kept in PROBE_CACHE_FILE and reused as long as the executable's path,
+    size and mtime are the same (updating gallery-dl rewrites it).
+    """
+    import shutil
+    path = shutil.which("gallery-dl")
+    if path is None: return None
+    st = os.stat(path)
+    key = [path, st.st_size, st.st_mtime_ns]
+    try:
+        with open(PROBE_CACHE_FILE, "r") as f: cached = json.load(f)
+        if cached["key"] == key: return path, cached["version"]
+    except (OSError, ValueError, KeyError, TypeError): pass
+    import subprocess
+    from gallery_dl_engine import get_startup_info
+    output = subprocess.check_output([path, "--version"], stderr=subprocess.STDOUT, startupinfo=get_startup_info())
+    version = output.decode(errors="replace").strip().splitlines()[-1:] or ["?"]
+    try:
+        with open(PROBE_CACHE_FILE, "w") as f: json.dump({"key": key, "version": version[0]}, f)
+    except OSError: pass
+    return path, version[0]
+
+
+def open_journal():
+    """Opens the job journal; gallery_dl_journal (and sqlite3) is loaded on first use."""
+    from gallery_dl_journal import JobJournal
+    return JobJournal(JOURNAL_FILE)
+
+
 class GalleryDLGUI:
-    def __init__(self, root):
+    def __init__(self, root, startup=None):
         self.root = root
+        self.startup = startup or StartupTimer()
+        self.has_dnd = False
         self.settings = self.load_settings()
-        
+        self.startup.mark("settings")
+
         self.root.title("gallery-dl GUI")
         self.apply_dark_title_bar()
         
@@ -133,6 +273,7 @@ class GalleryDLGUI:
         # Shortcuts
         self.root.bind('<Control-Return>', lambda e: self.start_batch_processing())
         self.root.bind('<Escape>', lambda e: self.stop_batch())
+        self.root.bind('<Shift-Escape>', lambda e: self.stop_batch(hard=True))
 
         self.root.columnconfigure(1, weight=1)
         self.root.rowconfigure(6, weight=1) 
@@ -143,15 +284,26 @@ class GalleryDLGUI:
         # --- Menu Bar ---
         menubar = Menu(root)
         filemenu = Menu(menubar, tearoff=0)
+        filemenu.add_command(label="Import URLs...", command=self.import_files_dialog)
+        filemenu.add_command(label="Download URL List...", command=self.start_from_file)
+        filemenu.add_command(label="Find Duplicates...", command=self.find_duplicates)
         filemenu.add_command(label="Open Config File", command=self.open_config_file)
         filemenu.add_separator()
         filemenu.add_command(label="Update gallery-dl", command=lambda: self.install_package("gallery-dl"))
         filemenu.add_separator()
         filemenu.add_command(label="Exit", command=self.on_close)
         menubar.add_cascade(label="File", menu=filemenu)
+
+        submenu = Menu(menubar, tearoff=0)
+        submenu.add_command(label="Subscribe to URLs in Box...", command=self.subscribe_urls)
+        submenu.add_command(label="Sync Due Now", command=self.sync_subscriptions)
+        submenu.add_command(label="Sync All Now", command=lambda: self.sync_subscriptions(everything=True))
+        submenu.add_command(label="Show Subscriptions", command=self.show_subscriptions)
+        menubar.add_cascade(label="Subscriptions", menu=submenu)
         
         helpmenu = Menu(menubar, tearoff=0)
         helpmenu.add_command(label="Install Drag & Drop Support", command=lambda: self.install_package("tkinterdnd2"))
+        helpmenu.add_command(label="Install Image Support (Pillow)", command=lambda: self.install_package("pillow"))
         menubar.add_cascade(label="Help", menu=helpmenu)
         root.config(menu=menubar)
 
@@ -168,9 +320,13 @@ class GalleryDLGUI:
         
         self.url_input = scrolledtext.ScrolledText(root, height=8, width=40)
         self.url_input.grid(row=0, column=1, padx=5, pady=10, sticky="ew")
-        CreateToolTip(self.url_input, "Paste URLs here.\nDuplicates are removed automatically.\nShortcuts: Ctrl+Enter to Start, Esc to Stop.")
+        CreateToolTip(self.url_input, "Paste URLs here.\nDuplicates are removed automatically.\nShortcuts: Ctrl+Enter to Start, Esc to Stop (Shift+Esc kills downloads at once).")
         
-        self.url_input.bind('<KeyRelease>', self.update_queue_counter)
+        self.url_queue = UrlQueue()
+        self.resync_job = None
+        self.import_queue = None
+        self.dedup_running = False
+        self.url_input.bind('<KeyRelease>', self.on_url_key)
         self.url_input.focus_set()
 
         self.context_menu = Menu(self.root, tearoff=0)
@@ -179,10 +335,6 @@ class GalleryDLGUI:
         self.context_menu.add_command(label="Paste", command=lambda: self.paste_from_clipboard()) 
         self.url_input.bind("<Button-3>", self.show_context_menu)
 
-        if HAS_DND:
-            self.url_input.drop_target_register(DND_TEXT, DND_FILES)
-            self.url_input.dnd_bind('<<Drop>>', self.on_drop)
-
         btn_frame = ttk.Frame(root)
         btn_frame.grid(row=0, column=2, padx=10, pady=10, sticky="n")
         
@@ -215,13 +367,34 @@ class GalleryDLGUI:
         self.archive_var = tk.BooleanVar(value=self.settings.get("use_archive", False))
         self.chk_archive = ttk.Checkbutton(adv_frame, text="Track History (Archive)", variable=self.archive_var)
         self.chk_archive.pack(side=tk.LEFT, padx=10, pady=5)
-        CreateToolTip(self.chk_archive, "Creates a database file.\nPrevents re-downloading files you already have.")
+        CreateToolTip(self.chk_archive, "Creates a database file.\nPrevents re-downloading files you already have.\n"
+                                        f"URLs completed in the last {self.settings.get('skip_fresh_hours', 24.0):g} hours are skipped outright.")
 
         self.flatten_var = tk.BooleanVar(value=self.settings.get("flatten_folder", True))
         self.chk_flatten = ttk.Checkbutton(adv_frame, text="Flatten Folder", variable=self.flatten_var)
         self.chk_flatten.pack(side=tk.LEFT, padx=10, pady=5)
         CreateToolTip(self.chk_flatten, "Checked: Files go to 'Save to' folder.\nUnchecked: Creates subfolders.")
         
+        self.adaptive_var = tk.BooleanVar(value=self.settings.get("adaptive_workers", False))
+        self.chk_adaptive = ttk.Checkbutton(adv_frame, text="Adaptive Workers", variable=self.adaptive_var)
+        self.chk_adaptive.pack(side=tk.LEFT, padx=10, pady=5)
+        CreateToolTip(self.chk_adaptive, "Workers / Per Host become upper limits.\nConcurrency per site ramps up while downloads succeed\nand is halved when the site throttles (429/503).")
+
+        self.persistent_var = tk.BooleanVar(value=self.settings.get("persistent_workers", False))
+        self.chk_persistent = ttk.Checkbutton(adv_frame, text="Persistent Workers", variable=self.persistent_var)
+        self.chk_persistent.pack(side=tk.LEFT, padx=10, pady=5)
+        CreateToolTip(self.chk_persistent, "Keeps gallery-dl loaded between URLs instead of starting it for each one.\nMuch faster for many small galleries. Needs 'pip install gallery-dl'\nfor this Python; falls back to the gallery-dl command otherwise.")
+
+        self.staged_var = tk.BooleanVar(value=self.settings.get("staged_publish", False))
+        self.chk_staged = ttk.Checkbutton(adv_frame, text="Staged Publish", variable=self.staged_var)
+        self.chk_staged.pack(side=tk.LEFT, padx=10, pady=5)
+        CreateToolTip(self.chk_staged, "Downloads go to a staging folder next to 'Save to' and are moved in\nin batches, so a folder watcher (WallpaperRotator) never sees half-written\nfiles. Every move is logged in .library-manifest.jsonl. Uses the archive.")
+
+        self.derivatives_var = tk.BooleanVar(value=self.settings.get("derivatives", False))
+        self.chk_derivatives = ttk.Checkbutton(adv_frame, text="Wallpaper Copies", variable=self.derivatives_var)
+        self.chk_derivatives.pack(side=tk.LEFT, padx=10, pady=5)
+        CreateToolTip(self.chk_derivatives, "Also saves every downloaded image downscaled to your screen size, plus a\nthumbnail, in '<Save to>.derivatives' (sizes: derivative_sizes in the config).\nRuns on all cores in the background. Needs Pillow (Help menu).")
+
         ttk.Label(adv_frame, text="Extra Args:").pack(side=tk.LEFT, padx=(20, 5))
         self.extra_args_var = tk.StringVar(value=self.settings.get("extra_args", ""))
         self.entry_args = ttk.Entry(adv_frame, textvariable=self.extra_args_var, width=30)
@@ -233,10 +406,17 @@ class GalleryDLGUI:
         self.action_frame.grid(row=4, column=0, columnspan=3, pady=15)
         
         ttk.Label(self.action_frame, text="Workers:").pack(side=tk.LEFT, padx=5)
-        self.worker_count = tk.Spinbox(self.action_frame, from_=1, to=16, width=5)
+        self.worker_count = tk.Spinbox(self.action_frame, from_=1, to=MAX_WORKERS_LIMIT, width=5)
         self.worker_count.pack(side=tk.LEFT, padx=5)
         self.worker_count.delete(0, "end")
         self.worker_count.insert(0, self.settings.get("max_workers", 4))
+
+        ttk.Label(self.action_frame, text="Per Host:").pack(side=tk.LEFT, padx=5)
+        self.per_host_count = tk.Spinbox(self.action_frame, from_=0, to=MAX_WORKERS_LIMIT, width=4)
+        self.per_host_count.pack(side=tk.LEFT, padx=5)
+        self.per_host_count.delete(0, "end")
+        self.per_host_count.insert(0, self.settings.get("per_host_workers", 2))
+        CreateToolTip(self.per_host_count, "Max parallel downloads against one site (0 = no limit).\nPer-site limits and delays: 'host_limits' in settings.json.")
         
         self.btn_download = ttk.Button(self.action_frame, text="Start (Ctrl+Enter)", command=self.start_batch_processing)
         self.btn_download.pack(side=tk.LEFT, padx=(15, 5))
@@ -246,6 +426,7 @@ class GalleryDLGUI:
 
         self.btn_stop = ttk.Button(self.action_frame, text="Stop (Esc)", command=self.stop_batch, state='disabled')
         self.btn_stop.pack(side=tk.LEFT, padx=5)
+        CreateToolTip(self.btn_stop, "Terminates running downloads; they are killed if still busy after 10s.\nPress again to kill them at once. Interrupted URLs run again on resume.")
         
         self.btn_open_dir = ttk.Button(self.action_frame, text="Open Folder", command=self.open_directory)
         self.btn_open_dir.pack(side=tk.LEFT, padx=(20, 5))
@@ -275,41 +456,70 @@ class GalleryDLGUI:
         self.status_bar.grid(row=7, column=0, columnspan=3, sticky="ew")
 
         self.is_downloading = False
-        self.stop_requested = False
+        self.engine = None
+        self.batch_thread = None
+        self.sync = None  # SyncRun while a subscription sync runs
         self.failed_urls = []
         self.log_queue = queue.Queue()
+        self.log_max_lines = max(100, int(self.settings.get("log_max_lines", 5000)))
+        self.file_log = self.open_log_file() if self.settings.get("log_to_file") else None
         self.check_log_queue()
         
         # Init Watch Variables
         self.last_clipboard_content = ""
         self.root.after(1000, self.clipboard_watcher_loop)
         
-        # Run startup checks
-        self.root.after(500, self.check_system_health)
+        # Startup checks and optional extras wait until the window is drawn.
+        self.startup.mark("widgets")
+        self.root.after_idle(self.after_first_paint)
+        self.root.after(SUBSCRIPTION_FIRST_CHECK_MS, self.check_subscriptions)
+
+    def after_first_paint(self):
+        self.startup.mark("first paint")
+        self.has_dnd = self.load_drag_and_drop()
+        self.startup.mark("drag & drop")
+        self.check_system_health()
+        self.root.after(200, self.check_unfinished_batch)
+
+    def load_drag_and_drop(self):
+        """Loads tkinterdnd2's Tcl extension into the running interpreter; False without it."""
+        try:
+            from tkinterdnd2 import DND_FILES, DND_TEXT, TkinterDnD
+            # require() is public in newer tkinterdnd2 releases, _require() in older ones.
+            (getattr(TkinterDnD, "require", None) or TkinterDnD._require)(self.root)
+            self.url_input.drop_target_register(DND_TEXT, DND_FILES)
+            self.url_input.dnd_bind('<<Drop>>', self.on_drop)
+        except (ImportError, AttributeError, RuntimeError, tk.TclError):
+            return False
+        return True
 
     # --- Aesthetics ---
     def apply_dark_title_bar(self):
+        if sys.platform != 'win32': return
         try:
-            self.root.update()
-            set_window_attribute = ctypes.windll.dwmapi.DwmSetWindowAttribute
-            get_parent = ctypes.windll.user32.GetParent
-            hwnd = get_parent(self.root.winfo_id())
-            value = ctypes.c_int(2) 
-            set_window_attribute(hwnd, 20, ctypes.byref(value), ctypes.sizeof(value))
+            import ctypes
+            self.root.update_idletasks()  # creates the frame window without drawing the (still empty) window
+            hwnd = int(self.root.wm_frame(), 16)
+            value = ctypes.c_int(2)
+            ctypes.windll.dwmapi.DwmSetWindowAttribute(hwnd, 20, ctypes.byref(value), ctypes.sizeof(value))
         except: pass
 
     # --- Settings ---
     def load_settings(self):
+        settings = DEFAULT_SETTINGS.copy()
         if os.path.exists(SETTINGS_FILE):
             try:
-                with open(SETTINGS_FILE, "r") as f: return json.load(f)
-            except: return DEFAULT_SETTINGS.copy()
-        return DEFAULT_SETTINGS.copy()
+                with open(SETTINGS_FILE, "r") as f: settings.update(json.load(f))
+            except: pass
+        return settings
 
     def save_settings(self):
         try: mw = int(self.worker_count.get())
         except: mw = 4
-        data = {
+        try: ph = int(self.per_host_count.get())
+        except: ph = 2
+        data = dict(self.settings)
+        data.update({
             "save_dir": self.dir_var.get(),
             "cookies_path": self.cookies_var.get(),
             "max_workers": mw,
@@ -317,13 +527,22 @@ class GalleryDLGUI:
             "window_height": self.root.winfo_height(),
             "flatten_folder": self.flatten_var.get(),
             "use_archive": self.archive_var.get(),
-            "extra_args": self.extra_args_var.get()
-        }
+            "extra_args": self.extra_args_var.get(),
+            "per_host_workers": ph,
+            "adaptive_workers": self.adaptive_var.get(),
+            "persistent_workers": self.persistent_var.get(),
+            "staged_publish": self.staged_var.get(),
+            "derivatives": self.derivatives_var.get()
+        })
         with open(SETTINGS_FILE, "w") as f:
             json.dump(data, f)
 
     def on_close(self):
         self.save_settings()
+        if self.is_downloading and self.engine is not None:
+            # Don't leave orphaned gallery-dl processes behind.
+            self.engine.stop(hard=True)
+            if self.batch_thread is not None: self.batch_thread.join(timeout=5)
         self.root.destroy()
 
     # --- Clipboard Watcher ---
@@ -337,87 +556,346 @@ class GalleryDLGUI:
                 content = self.root.clipboard_get()
                 if content != self.last_clipboard_content:
                     self.last_clipboard_content = content
-                    if content.startswith("http"):
-                        added = self.append_url_text(content)
+                    if URL_PATTERN.search(content):
+                        added = self.append_urls(extract_urls(content))
                         if added: self.url_input.see(tk.END)
             except: pass
         self.root.after(1000, self.clipboard_watcher_loop)
 
     # --- System Checks ---
     def check_system_health(self):
-        if not HAS_DND:
+        if not self.has_dnd:
             self.log("Tip: Install 'tkinterdnd2' via Help menu for drag-and-drop.", "SYSTEM")
+        if self.derivatives_var.get():
+            import importlib.util  # finds Pillow without importing it
+            if importlib.util.find_spec("PIL") is None:
+                self.log("Wallpaper Copies need Pillow: install it via the Help menu.", "ERROR")
         def run_check():
             try:
-                subprocess.check_output(["gallery-dl", "--version"], stderr=subprocess.STDOUT, startupinfo=self.get_startup_info())
-                self.log("System Check: gallery-dl found.", "SYSTEM")
-            except FileNotFoundError:
-                self.log("CRITICAL ERROR: 'gallery-dl' not found in PATH!", "ERROR")
-                self.root.after(0, lambda: messagebox.showerror("Missing Dependency", "gallery-dl was not found.\nPlease install it."))
+                found = probe_gallery_dl()
+                if found is None:
+                    self.log("CRITICAL ERROR: 'gallery-dl' not found in PATH!", "ERROR")
+                    self.root.after(0, lambda: messagebox.showerror("Missing Dependency", "gallery-dl was not found.\nPlease install it."))
+                else:
+                    self.log(f"System Check: gallery-dl {found[1]} found ({found[0]}).", "SYSTEM")
+            except Exception as e:
+                self.log(f"System Check: 'gallery-dl --version' failed: {e}", "ERROR")
+            self.startup.mark("gallery-dl probe")
+            if self.startup.report: self.root.after(0, self.report_startup)
         threading.Thread(target=run_check, daemon=True).start()
 
-    def get_startup_info(self):
-        if sys.platform == 'win32':
-            si = subprocess.STARTUPINFO()
-            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            return si
-        return None
+    def report_startup(self):
+        lines = ["--- Startup ---"] + self.startup.format()
+        for line in lines: self.log(line, "SYSTEM")
+        print("\n".join(lines), file=sys.stderr)
 
     # --- UI Interactions ---
     def show_context_menu(self, event):
         self.context_menu.tk_popup(event.x_root, event.y_root)
 
     def update_queue_counter(self, event=None):
-        raw_text = self.url_input.get("1.0", tk.END)
-        lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
         if not self.is_downloading:
-            self.status_var.set(f"Queue: {len(lines)} URLs ready")
+            self.status_var.set(f"Queue: {len(self.url_queue)} URLs ready")
+
+    def on_url_key(self, event):
+        """Typing can change any line, so re-index the box once the user pauses."""
+        if event.keysym in NAVIGATION_KEYS: return
+        if self.resync_job is not None: self.root.after_cancel(self.resync_job)
+        self.resync_job = self.root.after(QUEUE_RESYNC_MS, self.resync_url_queue)
+
+    def resync_url_queue(self):
+        if self.resync_job is not None: self.root.after_cancel(self.resync_job)
+        self.resync_job = None
+        self.url_queue.reset(self.url_input.get("1.0", tk.END))
+        self.update_queue_counter()
 
     def append_url_text(self, text):
-        text = text.strip()
-        if not text: return False
-        
-        current_content = self.url_input.get("1.0", tk.END).strip()
-        existing_lines = set(line.strip() for line in current_content.splitlines() if line.strip())
-        
-        new_lines = []
-        for line in text.splitlines():
-            clean = line.strip()
-            if clean and clean not in existing_lines:
-                new_lines.append(clean)
-                existing_lines.add(clean)
-        
-        if not new_lines: return False 
-            
-        if len(current_content) > 0:
-            self.url_input.insert(tk.END, "\n")
-            
-        for line in new_lines:
-            self.url_input.insert(tk.END, line + "\n")
-            
+        return self.append_urls(text.splitlines()) > 0
+
+    def append_urls(self, lines):
+        """
+        Adds the URLs that aren't queued yet (in any spelling) with a single
+        insert. Returns how many were added.
+        """
+        if self.resync_job is not None: self.resync_url_queue()
+        new_lines = self.url_queue.add(lines)
+        if not new_lines: return 0
+
+        last_char = self.url_input.get("end-2c")
+        prefix = "\n" if last_char and last_char != "\n" else ""
+        self.url_input.insert(tk.END, prefix + "\n".join(new_lines) + "\n")
         self.update_queue_counter()
-        return True
+        return len(new_lines)
+
+    # --- Bulk Import ---
+    def import_files_dialog(self):
+        paths = filedialog.askopenfilenames(filetypes=[
+            ("URL lists, bookmarks, pages", "*.txt *.html *.htm *.json *.csv *.url"), ("All", "*.*")])
+        if paths: self.import_sources(paths=paths)
+
+    def import_sources(self, paths=(), text=None):
+        """
+        Pulls every URL out of files and/or text on a background thread and
+        adds them to the URL box in chunks, skipping URLs that are already
+        queued or were downloaded before (per the job journal).
+        """
+        if self.import_queue is not None:
+            self.log("An import is already running.", "SYSTEM")
+            return
+        # Bounded, so a huge file is read only as fast as the box takes it.
+        self.import_queue = queue.Queue(maxsize=4)
+        self.import_stats = {"found": 0, "added": 0, "done": 0}
+        threading.Thread(target=self.run_import, args=(list(paths), text, self.import_queue), daemon=True).start()
+        self.root.after(LOG_TICK_MS, self.drain_import)
+
+    def run_import(self, paths, text, out):
+        try:
+            journal = open_journal()
+        except Exception:
+            journal = None
+        chunk = []
+
+        def hand_over():
+            done = journal.completed_among(chunk) if journal is not None else set()
+            out.put(("urls", [url for url in chunk if url not in done], len(chunk), len(done)))
+            chunk.clear()
+
+        try:
+            sources = [(path, iter_file_urls(path)) for path in paths]
+            if text: sources.append((None, extract_urls(text)))
+            for path, urls in sources:
+                if path is not None: self.log(f"Importing URLs from {path}", "SYSTEM")
+                try:
+                    for url in urls:
+                        chunk.append(url)
+                        if len(chunk) >= IMPORT_CHUNK: hand_over()
+                except (OSError, UnicodeError) as e:
+                    out.put(("error", f"Could not read {path}: {e}"))
+            if chunk: hand_over()
+        finally:
+            if journal is not None: journal.close()
+            out.put(("finished",))
+
+    def drain_import(self):
+        """Adds imported chunks to the URL box within the per-tick time budget."""
+        deadline = time.monotonic() + LOG_TICK_BUDGET
+        stats = self.import_stats
+        while time.monotonic() < deadline:
+            try:
+                item = self.import_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] == "urls":
+                _, urls, found, done = item
+                stats["found"] += found
+                stats["done"] += done
+                stats["added"] += self.append_urls(urls)
+            elif item[0] == "error":
+                self.log(item[1], "ERROR")
+            else:
+                self.import_queue = None
+                skipped = stats["found"] - stats["added"] - stats["done"]
+                self.log(f"Import finished: {stats['added']} URLs added ({skipped} already queued, "
+                         f"{stats['done']} downloaded before).", "SUCCESS")
+                return
+        self.root.after(LOG_TICK_MS, self.drain_import)
+
+    # --- Duplicates ---
+    def find_duplicates(self):
+        """Indexes the save folder in the background, logs a dry-run report and offers to move duplicates aside."""
+        from gallery_dl_dedup import DEFAULT_DISTANCE, HAS_PIL, MOVE, LibraryIndex, format_plan, plan
+        library = self.dir_var.get().strip()
+        if not library or not os.path.isdir(library):
+            messagebox.showerror("Error", "Choose an existing save folder first.")
+            return
+        if self.dedup_running: return
+        self.dedup_running = True
+        distance = self.settings.get("dedup_distance", DEFAULT_DISTANCE) if HAS_PIL else 0
+        if not HAS_PIL: self.log("Pillow is not installed: only exact duplicates can be found.", "SYSTEM")
+
+        def run():
+            steps = None
+            try:
+                index = LibraryIndex(library)
+                try:
+                    self.log(f"Indexing {library}...", "SYSTEM")
+                    indexed, removed = index.scan(progress=lambda n, total: self.log(f"Hashed {n}/{total} files"))
+                    steps = plan(index.duplicate_groups(distance), MOVE)
+                finally:
+                    index.close()
+                self.log(f"Index updated ({indexed} new or changed files). Dry run:", "SYSTEM")
+                for line in format_plan(steps): self.log(line)
+            except Exception as e:
+                self.log(f"Finding duplicates failed: {e}", "ERROR")
+            self.root.after(0, self.confirm_duplicates, library, steps)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def confirm_duplicates(self, library, steps):
+        from gallery_dl_dedup import LibraryIndex, apply_plan, default_aside_dir
+        if not steps:
+            self.dedup_running = False
+            if steps is not None: self.log("No duplicates found.", "SUCCESS")
+            return
+        aside = default_aside_dir(library)
+        if not messagebox.askyesno("Duplicates", f"{len(steps)} duplicates found (listed in the log).\n"
+                                                 f"Move them to {aside}?\nThe best copy of each stays."):
+            self.dedup_running = False
+            return
+
+        def run():
+            try:
+                index = LibraryIndex(library)
+                try:
+                    moved, size = apply_plan(index, steps, aside)
+                finally:
+                    index.close()
+                self.log(f"Moved {moved} duplicates ({size / 1048576:.1f} MB) to {aside}", "SUCCESS")
+            except Exception as e:
+                self.log(f"Moving duplicates failed: {e}", "ERROR")
+            finally:
+                self.dedup_running = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # --- Subscriptions ---
+    def subscribe_urls(self):
+        """Adds the URLs in the box to a subscription list, asking for the list's name and interval."""
+        from gallery_dl_subscriptions import DEFAULT_INTERVAL, DEFAULT_LIST, SubscriptionStore
+        urls = list(unique_urls(io.StringIO(self.url_input.get("1.0", tk.END))))
+        if not urls:
+            messagebox.showwarning("Subscribe", "Put the gallery URLs to subscribe to in the URL box first.")
+            return
+        name = simpledialog.askstring("Subscribe", f"Add {len(urls)} URLs to which list?",
+                                      initialvalue=DEFAULT_LIST, parent=self.root)
+        if not name or not name.strip(): return
+        name = name.strip()
+        try:
+            store = SubscriptionStore()
+            try:
+                hours = simpledialog.askfloat("Subscribe", f"Sync '{name}' every how many hours?",
+                                              initialvalue=store.interval(name) or DEFAULT_INTERVAL,
+                                              minvalue=0.25, parent=self.root)
+                if hours is None: return
+                added = store.add(name, urls, hours)
+            finally:
+                store.close()
+        except Exception as e:
+            self.log(f"Could not save subscriptions: {e}", "ERROR")
+            return
+        self.log(f"Subscribed to {added} new URLs in '{name}' ({len(urls) - added} were already subscribed); "
+                 f"synced every {hours:g}h.", "SUCCESS")
+
+    def show_subscriptions(self):
+        from gallery_dl_subscriptions import SubscriptionStore, format_rows, format_when
+        try:
+            store = SubscriptionStore()
+            try:
+                lists, rows, next_due = store.lists(), store.rows(), store.next_due()
+            finally:
+                store.close()
+        except Exception as e:
+            self.log(f"Could not read subscriptions: {e}", "ERROR")
+            return
+        if not lists:
+            self.log("No subscriptions yet: put gallery URLs in the box and use Subscriptions > Subscribe.", "SYSTEM")
+            return
+        for name, interval, count, due in lists:
+            self.log(f"--- {name}: {count} subscriptions, every {interval:g}h, {due} due ---", "INFO")
+        for line in format_rows(rows): self.log(line)
+        self.log(f"Next sync: {format_when(next_due)}", "SYSTEM")
+
+    def check_subscriptions(self):
+        """Periodic: syncs due subscriptions when the GUI is idle."""
+        minutes = self.settings.get("subscription_check_minutes", 15)
+        if minutes <= 0: return
+        self.sync_subscriptions(scheduled=True)
+        self.root.after(int(minutes * 60000), self.check_subscriptions)
+
+    def sync_subscriptions(self, everything=False, scheduled=False):
+        """Runs the due (or all) subscriptions as an incremental batch."""
+        from gallery_dl_subscriptions import DEFAULT_ABORT_AFTER, SubscriptionStore, SyncRun, sync_options
+        if self.is_downloading or self.import_queue is not None: return
+        options = self.current_options()
+        if not options.dest:
+            if not scheduled: messagebox.showerror("Error", "Choose a save folder first.")
+            return
+        try:
+            if scheduled:
+                journal = open_journal()
+                try: pending = journal.unfinished_batch()
+                finally: journal.close()
+                if pending is not None: return  # resuming it is up to the user
+            store = SubscriptionStore()
+            try: urls = store.due(by=float("inf") if everything else None)
+            finally: store.close()
+        except Exception as e:
+            self.log(f"Could not read subscriptions: {e}", "ERROR")
+            return
+        if not urls:
+            if not scheduled: self.log("No subscriptions are due.", "SYSTEM")
+            return
+        self.log(f"--- Syncing {len(urls)} subscriptions ---", "INFO")
+        abort_after = self.settings.get("subscription_abort_after", DEFAULT_ABORT_AFTER)
+        self.launch_batch(sync_options(options, abort_after), urls, sync=SyncRun(urls))
+
+    def finish_sync(self, sync, summary):
+        from gallery_dl_journal import ABANDONED
+        from gallery_dl_subscriptions import SubscriptionStore, format_when
+        try:
+            synced, changed, files = sync.finish(summary)
+            store = SubscriptionStore()
+            try: next_due = store.next_due()
+            finally: store.close()
+        except Exception as e:
+            self.log(f"Could not save sync results: {e}", "ERROR")
+            return
+        self.log(f"Synced {synced} subscriptions: {changed} had {files} new files, {synced - changed} unchanged. "
+                 f"Next sync {format_when(next_due)}.", "SUCCESS")
+        if summary["stopped"] and summary.get("batch_id") is not None:
+            # Whatever didn't run is still due and syncs next time; no need to offer a resume.
+            try:
+                journal = open_journal()
+                try: journal.finish_batch(summary["batch_id"], ABANDONED)
+                finally: journal.close()
+            except Exception as e:
+                self.log(f"Could not update job journal: {e}", "ERROR")
 
     def paste_from_clipboard(self):
         try:
             text = self.root.clipboard_get()
-            self.append_url_text(text)
+            self.append_urls(extract_urls(text))
         except tk.TclError: pass 
 
     def on_drop(self, event):
-        if event.data:
-            clean_data = event.data.strip('{}')
-            self.append_url_text(clean_data)
+        """Dropped files are imported (lists, bookmarks, pages); dropped text is scanned for URLs."""
+        if not event.data: return
+        try:
+            items = self.root.tk.splitlist(event.data)
+        except tk.TclError:
+            items = ()
+        paths = [item for item in items if os.path.isfile(item)]
+        if paths and len(paths) == len(items):
+            self.import_sources(paths=paths)
+        else:
+            self.import_sources(text=event.data)
 
     def clear_urls(self):
         self.url_input.delete("1.0", tk.END)
+        self.url_queue.clear()
         self.update_queue_counter()
 
     def retry_failed(self):
-        if not self.failed_urls: return
+        try:
+            journal = open_journal()
+            try: failed = journal.failed_urls()
+            finally: journal.close()
+        except Exception as e:
+            self.log(f"Could not read job journal: {e}", "ERROR")
+            failed = self.failed_urls
+        if not failed: return
         self.clear_urls()
-        for url in self.failed_urls:
-            self.append_url_text(url)
+        self.append_url_text("\n".join(failed))
         self.failed_urls = [] 
         self.btn_retry.config(state='disabled')
         self.log("Failed URLs re-queued. Click Start to try again.", "INFO")
@@ -431,6 +909,7 @@ class GalleryDLGUI:
         if f: self.cookies_var.set(f)
 
     def open_directory(self):
+        import subprocess
         path = self.dir_var.get()
         if os.path.exists(path):
             if sys.platform == 'win32': os.startfile(path)
@@ -438,6 +917,8 @@ class GalleryDLGUI:
             else: subprocess.Popen(['xdg-open', path])
 
     def open_config_file(self):
+        import subprocess
+        from pathlib import Path
         home = Path.home()
         if sys.platform == 'win32': config_path = home / "gallery-dl.conf"
         else: config_path = home / "/etc/gallery-dl.conf"
@@ -452,9 +933,11 @@ class GalleryDLGUI:
     def install_package(self, package_name):
         self.log(f"Installing/Updating {package_name}...", "SYSTEM")
         def run_install():
+            import subprocess
+            from gallery_dl_engine import get_startup_info
             try:
                 cmd = [sys.executable, "-m", "pip", "install", "--upgrade", package_name]
-                subprocess.check_call(cmd, startupinfo=self.get_startup_info())
+                subprocess.check_call(cmd, startupinfo=get_startup_info())
                 self.log(f"{package_name} installed successfully! Restart App.", "SUCCESS")
                 self.root.after(0, lambda: messagebox.showinfo("Success", f"{package_name} installed.\nPlease restart the app."))
             except Exception as e:
@@ -465,14 +948,57 @@ class GalleryDLGUI:
     def log(self, message, tag=None):
         self.log_queue.put((message, tag))
 
+    def open_log_file(self):
+        import logging
+        from logging.handlers import RotatingFileHandler
+        try:
+            handler = RotatingFileHandler(LOG_FILE, encoding="utf-8", backupCount=3,
+                                          maxBytes=int(self.settings.get("log_file_mb", 5)) * 1024 * 1024)
+        except OSError:
+            return None
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger = logging.getLogger(APP_NAME)
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        return logger
+
     def check_log_queue(self):
-        while not self.log_queue.empty():
-            msg, tag = self.log_queue.get()
-            self.output_text.config(state='normal')
-            self.output_text.insert(tk.END, msg + "\n", tag)
-            self.output_text.see(tk.END)
-            self.output_text.config(state='disabled')
-        self.root.after(100, self.check_log_queue)
+        """Moves queued messages to the console in one insert per tick, within a time budget."""
+        deadline = time.monotonic() + LOG_TICK_BUDGET
+        batch = []
+        try:
+            while time.monotonic() < deadline:
+                batch.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if batch:
+            trace = self.engine.trace if self.engine is not None else None
+            started = trace.clock() if trace is not None else 0
+            self.render_log(batch)
+            if trace is not None: trace.span("log pump", "GUI", started, trace.clock(), lines=len(batch))
+        self.root.after(LOG_TICK_MS, self.check_log_queue)
+
+    def render_log(self, batch):
+        if self.file_log is not None:
+            for msg, tag in batch: self.file_log.info(msg)
+
+        # Lines beyond the cap would be trimmed right away; don't insert them.
+        segments = []
+        for msg, tag in batch[-self.log_max_lines:]:
+            if segments and segments[-1][1] == tag: segments[-1][0].append(msg)
+            else: segments.append(([msg], tag))
+        args = []
+        for lines, tag in segments:
+            args += ["\n".join(lines) + "\n", tag or ()]
+
+        at_bottom = self.output_text.yview()[1] >= 0.999  # don't yank the view while the user scrolls back
+        self.output_text.config(state='normal')
+        self.output_text.insert(tk.END, *args)
+        excess = int(self.output_text.index("end-1c").split(".")[0]) - 1 - self.log_max_lines
+        if excess > 0: self.output_text.delete("1.0", f"{excess + 1}.0")
+        self.output_text.config(state='disabled')
+        if at_bottom: self.output_text.see(tk.END)
 
     def clear_log(self):
         self.output_text.config(state='normal')
@@ -480,75 +1006,224 @@ class GalleryDLGUI:
         self.output_text.config(state='disabled')
 
     # --- Core Logic ---
-    def stop_batch(self):
-        if self.is_downloading:
-            self.stop_requested = True
-            self.btn_stop.config(state='disabled', text="Stopping...")
-            self.log("--- Stop Requested: Finishing active downloads... ---", "ERROR")
+    def stop_batch(self, hard=False):
+        """First press stops gracefully; pressing again (or Shift+Esc) kills running downloads."""
+        if not self.is_downloading or self.engine is None: return
+        if hard or self.engine.stop_requested:
+            self.btn_stop.config(state='disabled', text="Killing...")
+            self.engine.stop(hard=True)
+        else:
+            self.btn_stop.config(text="Force Stop")
+            self.engine.stop()
 
     def start_batch_processing(self):
         if self.is_downloading: return
 
         raw_text = self.url_input.get("1.0", tk.END)
-        urls = [line.strip() for line in raw_text.splitlines() if line.strip()]
-        dest = self.dir_var.get().strip()
-        cookies = self.cookies_var.get().strip()
-        flatten = self.flatten_var.get()
-        use_archive = self.archive_var.get()
-        extra_args = self.extra_args_var.get().strip()
-        
-        if not urls:
+        if not raw_text.strip():
             messagebox.showwarning("Input Error", "Please enter at least one URL.")
             return
 
+        self.launch_batch(self.current_options(), unique_urls(io.StringIO(raw_text)))
+
+    def start_from_file(self):
+        """Streams a URL list straight from disk, without loading it into the URL box."""
+        from gallery_dl_engine import iter_url_file
+        if self.is_downloading: return
+        path = filedialog.askopenfilename(filetypes=[("Text Files", "*.txt"), ("All", "*.*")])
+        if not path: return
+        self.log(f"Reading URLs from {path}", "SYSTEM")
+        self.launch_batch(self.current_options(), iter_url_file(path))
+
+    def current_options(self):
+        from gallery_dl_dedup import DEFAULT_DISTANCE
+        from gallery_dl_engine import BatchOptions
         try: max_workers = int(self.worker_count.get())
         except ValueError: max_workers = 4
+        try: per_host = int(self.per_host_count.get())
+        except ValueError: per_host = 2
+
+        return BatchOptions(
+            dest=self.dir_var.get().strip(),
+            cookies=self.cookies_var.get().strip(),
+            flatten=self.flatten_var.get(),
+            use_archive=self.archive_var.get(),
+            extra_args=self.extra_args_var.get().strip(),
+            max_workers=max_workers,
+            per_host_workers=per_host,
+            host_delay=self.settings.get("host_delay", 0.0),
+            host_limits=self.settings.get("host_limits", {}),
+            adaptive=self.adaptive_var.get(),
+            max_retries=self.settings.get("max_retries", 3),
+            retry_delay=self.settings.get("retry_delay", 5.0),
+            window=self.settings.get("queue_window", 1000),
+            persistent=self.persistent_var.get(),
+            recycle_jobs=self.settings.get("recycle_jobs", 200),
+            recycle_mb=self.settings.get("recycle_mb", 512),
+            skip_fresh=self.settings.get("skip_fresh_hours", 24.0) if self.archive_var.get() else 0.0,
+            archive_mode=self.settings.get("archive_mode", "deferred"),
+            structured_output=self.settings.get("structured_output", True),
+            metrics_file=self.settings.get("metrics_file", ""),
+            trace_file=self.settings.get("trace_file", ""),
+            bandwidth_limit=self.settings.get("bandwidth_limit", ""),
+            bandwidth_schedule=self.settings.get("bandwidth_schedule", []),
+            staging=self.staged_var.get(),
+            staging_dir=self.settings.get("staging_dir", ""),
+            derivatives=self.derivatives_var.get(),
+            derivative_sizes=self.settings.get("derivative_sizes") or
+                             [f"{self.root.winfo_screenwidth()}x{self.root.winfo_screenheight()}"],
+            thumbnail_size=self.settings.get("thumbnail_size", 320),
+            derivative_dir=self.settings.get("derivative_dir", ""),
+            derivative_format=self.settings.get("derivative_format", "jpg"),
+            dedup=self.settings.get("dedup_index", False),
+            dedup_distance=self.settings.get("dedup_distance", DEFAULT_DISTANCE),
+        )
+
+    def launch_batch(self, options, urls=(), resume=None, sync=None):
+        from gallery_dl_engine import BatchEngine
+        self.engine = BatchEngine(options, on_event=self.on_engine_event, journal_path=JOURNAL_FILE)
+        self.sync = sync
 
         self.is_downloading = True
-        self.stop_requested = False
         self.failed_urls = [] 
         self.btn_retry.config(state='disabled')
         
         self.btn_download.config(state='disabled', text="Running...")
         self.btn_stop.config(state='normal', text="Stop")
-        self.status_var.set(f"Queue: {len(urls)} | Workers: {max_workers}")
+        queued = "resumed batch" if resume is not None else "starting"
+        self.status_var.set(f"Queue: {queued} | Workers: {options.max_workers}")
         self.progress_var.set(0)
-        self.log(f"--- Starting Batch ({len(urls)} URLs) ---", "INFO")
         
-        threading.Thread(target=self.run_thread_pool, args=(urls, dest, cookies, flatten, use_archive, extra_args, max_workers), daemon=True).start()
+        self.batch_thread = threading.Thread(target=self.run_batch, args=(self.engine, urls, resume), daemon=True)
+        self.batch_thread.start()
 
-    def run_thread_pool(self, urls, dest, cookies, flatten, use_archive, extra_args, max_workers):
-        total = len(urls)
-        completed = 0
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(self.download_single_url, url, dest, cookies, flatten, use_archive, extra_args): url for url in urls}
-            
-            for future in concurrent.futures.as_completed(futures):
-                url = futures[future]
-                completed += 1
-                perc = (completed / total) * 100
-                self.root.after(0, lambda p=perc: self.progress_var.set(p))
-                self.root.after(0, lambda c=completed, t=total: self.status_var.set(f"Progress: {c}/{t}"))
-                
-                try:
-                    if not future.result(): self.failed_urls.append(url)
-                except Exception as e:
-                    self.log(f"Exception for {url}: {e}", "ERROR")
-                    self.failed_urls.append(url)
-                    
-                if self.stop_requested: break 
-
-        if self.stop_requested:
+    def run_batch(self, engine, urls, resume=None):
+        try:
+            engine.run(urls, resume=resume)
+        except Exception as e:
+            self.log(f"Batch crashed: {e}", "ERROR")
+            self.root.after(0, self.on_batch_finished, {"failed": [], "stopped": True})
+
+    def check_unfinished_batch(self):
+        """Offers to resume a batch that was stopped or interrupted by a crash."""
+        from gallery_dl_engine import BatchOptions
+        from gallery_dl_journal import ABANDONED, QUEUED, RUNNING
+        if self.is_downloading: return
+        try:
+            journal = open_journal()
+            try:
+                batch_id = journal.unfinished_batch()
+                if batch_id is None:
+                    if journal.failed_urls(): self.btn_retry.config(state='normal')
+                    return
+                counts = journal.counts(batch_id)
+                remaining = counts.get(QUEUED, 0) + counts.get(RUNNING, 0)
+                stored = journal.batch_options(batch_id)
+                if not messagebox.askyesno("Resume Batch", f"The last batch did not finish ({remaining} URLs left).\nResume it now?"):
+                    journal.finish_batch(batch_id, ABANDONED)
+                    return
+            finally:
+                journal.close()
+        except Exception as e:
+            self.log(f"Could not read job journal: {e}", "ERROR")
+            return
+        self.launch_batch(BatchOptions(**stored), resume=batch_id)
+
+    # --- Engine Events (called from the engine thread) ---
+    def on_engine_event(self, event):
+        kind = event["event"]
+        worker = event.get("worker", "")
+        if self.sync is not None: self.sync.on_event(event)
+
+        if kind == "batch_started":
+            if event["resumed"]:
+                self.log(f"--- Resuming Batch ({event['completed']}/{event['total']} URLs already done) ---", "INFO")
+            else:
+                self.log("--- Starting Batch ---", "INFO")
+        elif kind == "input_finished":
+            self.log(f"--- All {event['total']} URLs queued ---", "INFO")
+        elif kind == "url_started":
+            self.log(f"[{worker}] Starting: {event['url']}", "THREAD")
+        elif kind == "output":
+            line = event["line"]
+            if line.startswith("#"): self.log(f"[{worker}] {line}")
+            elif "http" in line or "File" in line: pass
+            else: self.log(f"[{worker}] {line}")
+        elif kind == "url_finished":
+            if event["ok"]: self.log(f"[{worker}] Finished", "SUCCESS")
+            elif event.get("rebalanced"): pass  # logged with url_requeued
+            elif event.get("message"): self.log(f"[{worker}] Critical Error: {event['message']}", "ERROR")
+            else: self.log(f"[{worker}] Error ({event['returncode']})", "ERROR")
+        elif kind == "url_retry":
+            self.log(f"Retrying in {event['delay']}s (attempt {event['attempt'] + 1}): {event['url']}", "SYSTEM")
+        elif kind == "urls_skipped":
+            self.log(f"Skipped {event['count']} URLs completed within the last {event['hours']:g}h "
+                     f"({event['skipped']} so far)", "SYSTEM")
+        elif kind == "url_parked":
+            self.log(f"Skipped (permanent error {event['returncode']}): {event['url']}", "ERROR")
+        elif kind == "error":
+            self.log(event["message"], "ERROR")
+        elif kind == "concurrency":
+            reason = "throttled" if event["throttled"] else "ramping up"
+            self.log(f"[{event['host']}] Concurrency {event['limit']}/{event['ceiling']} ({reason})", "SYSTEM")
+        elif kind == "url_interrupted":
+            self.log(f"[{worker}] Interrupted: {event['url']}", "ERROR")
+        elif kind == "url_requeued":
+            self.log(f"[{worker}] Restarting under the lower bandwidth limit: {event['url']}", "SYSTEM")
+        elif kind == "stop_requested":
+            if event["hard"]:
+                self.log(f"--- Killing {event['running']} active downloads ---", "ERROR")
+            else:
+                self.log(f"--- Stop Requested: Terminating {event['running']} active downloads "
+                         "(Esc again to kill) ---", "ERROR")
+        elif kind == "file_skipped":
+            self.log(f"[{worker}] # {event['path']}")
+        elif kind == "progress":
+            c, t = event["completed"], event["total"]
+            if t: self.root.after(0, lambda p=(c / t) * 100: self.progress_var.set(p))
+        elif kind == "metrics":
+            self.root.after(0, self.status_var.set, format_metrics(event))
+        elif kind == "duplicate":
+            same = event["exact"][0] if event["exact"] else event["near"][0]["path"]
+            self.log(f"Duplicate: {os.path.basename(event['path'])} == {same}", "SYSTEM")
+        elif kind == "published":
+            self.log(f"Published {event['count']} files to the library ({event['total']} this batch)", "SUCCESS")
+        elif kind == "bandwidth":
+            limit = f"{event['limit'] / 1048576:.2f} MB/s" if event["limit"] else "unlimited"
+            self.log(f"--- Bandwidth limit: {limit} ---", "SYSTEM")
+        elif kind == "trace_summary":
+            self.log(f"--- Timing trace written to {event['path']} ---", "SYSTEM")
+            from gallery_dl_trace import format_summary  # already loaded by the engine
+            for line in format_summary(event["rows"]): self.log(line, "SYSTEM")
+        elif kind == "batch_finished":
+            self.root.after(0, self.on_batch_finished, event)
+
+    def on_batch_finished(self, summary):
+        self.failed_urls = list(summary["failed"])
+        sync, self.sync = self.sync, None
+        if sync is not None: self.finish_sync(sync, summary)
+
+        if summary.get("skipped"):
+            self.log(f"{summary['skipped']} recently completed URLs were skipped.", "SYSTEM")
+        if summary.get("derived"):
+            self.log(f"Made wallpaper copies of {summary['derived']} images "
+                     f"({summary['derivatives_cached']} were up to date).", "SYSTEM")
+        if summary["stopped"]:
+            interrupted = len(summary.get("interrupted", []))
+            if interrupted:
+                self.log(f"{interrupted} interrupted URLs will run again when the batch is resumed.", "SYSTEM")
             self.log("--- Batch Stopped by User ---", "ERROR")
         else:
             self.log("-" * 40)
+            parked = len(summary.get("parked", []))
+            if parked:
+                self.log(f"{parked} URLs failed permanently (not found / unsupported) and were not retried.", "ERROR")
             if self.failed_urls:
                 self.log(f"--- Finished with {len(self.failed_urls)} Errors ---", "ERROR")
-                self.root.after(0, lambda: self.btn_retry.config(state='normal'))
+                self.btn_retry.config(state='normal')
             else:
                 self.log("--- All Downloads Finished Successfully ---", "SUCCESS")
-                self.root.after(0, lambda: self.progress_var.set(100))
+                self.progress_var.set(100)
             
             if sys.platform == 'win32':
                 try:
@@ -556,70 +1231,16 @@ class GalleryDLGUI:
                     winsound.MessageBeep(winsound.MB_ICONASTERISK)
                 except: pass
         
-        self.root.after(0, lambda: self.status_var.set("Ready"))
-        self.root.after(0, lambda: self.btn_download.config(state='normal', text="Start"))
-        self.root.after(0, lambda: self.btn_stop.config(state='disabled', text="Stop"))
+        self.status_var.set("Ready")
+        self.btn_download.config(state='normal', text="Start")
+        self.btn_stop.config(state='disabled', text="Stop")
         self.is_downloading = False
-
-    def download_single_url(self, url, dest, cookies, flatten, use_archive, extra_args):
-        if self.stop_requested: return False
-
-        cmd = ["gallery-dl", "--dest", dest]
-        if flatten: cmd.extend(["--directory", "."])
-        if cookies and os.path.exists(cookies): cmd.extend(["--cookies", cookies])
-        
-        if use_archive:
-            archive_path = os.path.join(dest, "archive.sqlite")
-            cmd.extend(["--download-archive", archive_path])
-
-        if extra_args:
-            try: cmd.extend(shlex.split(extra_args))
-            except ValueError:
-                self.log(f"Error: Invalid Extra Args syntax (mismatched quotes?)", "ERROR")
-                return False
-
-        cmd.append(url)
-        
-        t_name = threading.current_thread().name
-        short_name = t_name.replace("Thread", "W") 
-        
-        self.log(f"[{short_name}] Starting: {url}", "THREAD")
-        
-        try:
-            process = subprocess.Popen(
-                cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.STDOUT, 
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-                startupinfo=self.get_startup_info()
-            )
-
-            for line in process.stdout:
-                line = line.strip()
-                if line:
-                    if line.startswith("#"): self.log(f"[{short_name}] {line}")
-                    elif "http" in line or "File" in line: pass 
-                    else: self.log(f"[{short_name}] {line}")
-            
-            process.wait()
-            
-            if process.returncode == 0:
-                self.log(f"[{short_name}] Finished", "SUCCESS")
-                return True
-            else:
-                self.log(f"[{short_name}] Error ({process.returncode})", "ERROR")
-                return False
-
-        except Exception as e:
-            self.log(f"[{short_name}] Critical Error: {str(e)}", "ERROR")
-            return False
+        self.engine = None
 
 if __name__ == "__main__":
-    if HAS_DND:
-        root = TkinterDnD.Tk()
-    else:
-        root = tk.Tk()
-    app = GalleryDLGUI(root)
+    startup = StartupTimer(STARTED, report="--startup-report" in sys.argv[1:])
+    startup.mark("imports")
+    root = tk.Tk()
+    startup.mark("Tk")
+    app = GalleryDLGUI(root, startup)
     root.mainloop()
\ No newline at end of file
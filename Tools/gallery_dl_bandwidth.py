@@ -0,0 +1,147 @@
+"""
+Global bandwidth budget for a batch.
+
+gallery-dl's --limit-rate is per process and read once when a download
+starts, so a total cap has to be split up front: BandwidthShaper gives each
+job a share of the current limit when it starts (the limit divided by the
+number of jobs expected to run alongside it) and holds new jobs back while
+the shares of the running ones already use up the budget. When the
+schedule lowers the limit below what the running jobs were given,
+over_budget() names the ones above an even share of it; the engine
+restarts those with a new share (gallery-dl skips the files it already
+has). A raised limit is picked up as jobs start.
+
+The limit may follow a schedule:
+
+    [{"from": "08:00", "to": "18:00", "limit": "2M", "days": ["mon", "fri"]},
+     {"from": "22:00", "to": "06:00", "limit": ""}]
+
+The first rule covering the current local time wins ("to" before "from"
+wraps past midnight, "days" is optional, an empty limit means unlimited);
+outside all rules the default limit applies.
+"""
+import datetime
+import re
+
+# Shares below this are not worth starting a download for.
+MIN_RATE = 16 * 1024
+# A running job is restarted under a lowered limit only above this many even shares.
+REBALANCE_SLACK = 1.25
+RATE_PATTERN = re.compile(r"^\s*([0-9]*\.?[0-9]+)\s*([bkmgt]?)(?:i?b?)(?:/s)?\s*$", re.IGNORECASE)
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+def parse_rate(text):
+    """Bytes per second for "500k", "2.5M", "1 MB/s", ... (1024-based like gallery-dl); None if empty."""
+    if text is None or str(text).strip() in ("", "0"): return None
+    match = RATE_PATTERN.match(str(text))
+    if not match: raise ValueError(f"invalid rate '{text}'")
+    return round(float(match.group(1)) * 1024 ** "bkmgt".index(match.group(2).lower() or "b"))
+
+
+def parse_time(text):
+    hours, _, minutes = str(text).strip().partition(":")
+    value = datetime.time(int(hours) % 24, int(minutes or 0))
+    return value.hour * 60 + value.minute
+
+
+class BandwidthSchedule:
+    """A default limit plus time-of-day rules (see the module docstring)."""
+    def __init__(self, default=None, rules=()):
+        self.default = parse_rate(default)
+        self.rules = []
+        for rule in rules:
+            days = [day.strip().lower()[:3] for day in rule.get("days", ())]
+            for day in days:
+                if day not in DAYS: raise ValueError(f"invalid day '{day}' in bandwidth schedule")
+            self.rules.append((parse_time(rule["from"]), parse_time(rule["to"]),
+                               parse_rate(rule.get("limit")), {DAYS.index(day) for day in days}))
+
+    def __bool__(self):
+        return self.default is not None or any(rule[2] is not None for rule in self.rules)
+
+    def limit_at(self, when=None):
+        """Bytes per second allowed at `when` (default: now), None for unlimited."""
+        when = when or datetime.datetime.now()
+        minute = when.hour * 60 + when.minute
+        for start, end, limit, days in self.rules:
+            # A rule that wraps past midnight belongs to the day it started on.
+            weekday = when.weekday() if start <= end or minute >= start else (when.weekday() - 1) % 7
+            if days and weekday not in days: continue
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return limit
+        return self.default
+
+
+def parse_schedule_specs(specs):
+    """Schedule rules from command line specs like "mon-fri@08:00-18:00=2M" or "22:00-06:00=0"."""
+    rules = []
+    for spec in specs:
+        span, sep, limit = spec.rpartition("=")
+        if not sep: raise ValueError(f"invalid schedule '{spec}'")
+        days, _, span = span.rpartition("@")
+        start, sep, end = span.partition("-")
+        if not sep: raise ValueError(f"invalid schedule '{spec}'")
+        rule = {"from": start, "to": end, "limit": limit}
+        if days: rule["days"] = _expand_days(days)
+        rules.append(rule)
+    return rules
+
+
+def _expand_days(text):
+    """"mon-fri,sun" -> ["mon", "tue", "wed", "thu", "fri", "sun"]"""
+    days = []
+    for part in text.lower().split(","):
+        first, _, last = part.partition("-")
+        if first[:3] not in DAYS or (last and last[:3] not in DAYS): raise ValueError(f"invalid days '{text}'")
+        i, j = DAYS.index(first[:3]), DAYS.index((last or first)[:3])
+        days += [DAYS[k % 7] for k in range(i, (j if j >= i else j + 7) + 1)]
+    return days
+
+
+class BandwidthShaper:
+    """Hands out per-job rate limits. Only used from the event loop thread."""
+    def __init__(self, schedule, max_workers):
+        self.schedule = schedule
+        self.max_workers = max_workers
+        self.rates = {}  # job key (its URL) -> bytes/s it was started with (None = unlimited)
+        self.limit = schedule.limit_at()
+
+    def update(self):
+        """Re-reads the schedule; returns True if the limit changed."""
+        limit = self.schedule.limit_at()
+        changed, self.limit = limit != self.limit, limit
+        return changed
+
+    def acquire(self, key, expected):
+        """
+        Returns the rate for a job about to start alongside `expected` others
+        (running or queued), None for unlimited, or False if it has to wait
+        until running jobs free up bandwidth.
+        """
+        limit = self.limit
+        if limit is None:
+            self.rates[key] = None
+            return None
+        in_use = sum(limit if rate is None else rate for rate in self.rates.values())
+        available = limit - in_use
+        share = min(available, limit / max(1, min(self.max_workers, expected)))
+        if share < min(MIN_RATE, limit) and self.rates: return False
+        share = max(int(share), min(MIN_RATE, limit))
+        self.rates[key] = share
+        return share
+
+    def release(self, key):
+        self.rates.pop(key, None)
+
+    def over_budget(self):
+        """
+        Keys of running jobs to restart because the limit dropped below what
+        they use together: the unlimited ones and those above
+        REBALANCE_SLACK even shares of the limit. Empty while they fit.
+        """
+        limit = self.limit
+        if limit is None: return []
+        if sum(limit if rate is None else rate for rate in self.rates.values()) <= limit: return []
+        share = limit / max(1, min(self.max_workers, len(self.rates)))
+        return [key for key, rate in self.rates.items() if rate is None or rate > share * REBALANCE_SLACK]
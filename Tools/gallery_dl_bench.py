@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmarks for the batch engine, without touching real sites.
+
+Every scenario runs the real BatchEngine (or, for "gui", the real GUI)
+against gallery_dl_fake in a fresh process of its own, so peak memory is
+per scenario, and reports what it measured as JSON:
+
+    python gallery_dl_bench.py                         # all scenarios
+    python gallery_dl_bench.py tiny failures --scale 0.1 -o before.json
+    python gallery_dl_bench.py tiny failures --scale 0.1 --compare before.json
+
+--compare prints the change of every figure against an earlier report and
+exits with status 1 when one got worse by more than --threshold percent.
+The URL lists are generated from --seed, so two runs do the same work.
+"""
+import argparse
+import collections
+import datetime
+import http.server
+import importlib.util
+import json
+import os
+import platform
+import queue
+import random
+import shutil
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE = os.path.join(TOOLS_DIR, "gallery_dl_fake.py")
+GUI = os.path.join(TOOLS_DIR, "gallery-dl-gui.py")
+REPORT_VERSION = 1
+HOSTS = 16
+PROBE_MS = 20  # how often the GUI scenario checks how late the Tk event loop runs
+
+SCENARIOS = {
+    "tiny": {"description": "10k galleries of one small file: bound by per-URL overhead",
+             "urls": 10000, "query": {"files": 1, "size": 4096}},
+    "huge": {"description": "4 galleries of 2500 files, 64 KiB each over local HTTP",
+             "urls": 4, "query": {"files": 2500, "size": 65536}, "serve": True, "workers": 4},
+    "chatty": {"description": "500 galleries of 10 files logging 20 lines per file",
+               "urls": 500, "query": {"files": 10, "chatter": 20}},
+    "failures": {"description": "2000 galleries, 30% failing: 404s, persistent 5xx, 429 once",
+                 "urls": 2000, "query": {"files": 1}, "mix": {"missing": 0.1, "fail": 0.1, "throttle": 0.1},
+                 "retries": 2},
+    "stop": {"description": "slow galleries, stopped after 2 s: how long until run() returns",
+             "urls": 200, "query": {"files": 100, "delay": 0.05}, "stop_after": 2.0},
+    "gui": {"description": "'chatty' through the real GUI: log and event loop lag (needs a display)",
+            "urls": 300, "query": {"files": 10, "chatter": 20}, "gui": True},
+}
+# Which way is better, for --compare.
+HIGHER_IS_BETTER = {"urls_per_sec", "files_per_sec"}
+LOWER_IS_BETTER = {"elapsed", "stop_latency", "peak_rss_mb", "peak_child_rss_mb", "cpu_seconds",
+                   "log_lag_p50", "log_lag_p95", "log_lag_max", "ui_lag_p95", "ui_lag_max"}
+# Changes smaller than this (seconds, MB, ...) are noise, whatever the percentage.
+MIN_DELTA = 0.05
+
+
+# --- Workload ---
+def make_urls(spec, scale, seed):
+    """The scenario's URL list; `mix` assigns failure kinds to a seeded random share of it."""
+    rng = random.Random(seed)
+    count = max(1, round(spec["urls"] * scale))
+    base = "&".join(f"{key}={value}" for key, value in spec["query"].items())
+    urls = []
+    for n in range(count):
+        query = base
+        roll = rng.random()
+        for kind, share in spec.get("mix", {}).items():
+            if roll < share:
+                query += f"&{kind}=1"
+                break
+            roll -= share
+        urls.append(f"http://h{n % HOSTS}.fake.invalid/g/{n}?{query}")
+    return urls
+
+
+def make_launcher(folder):
+    """A gallery-dl "executable" running the fake with this interpreter."""
+    if sys.platform == 'win32':
+        path = os.path.join(folder, "gallery-dl.cmd")
+        with open(path, "w") as f:
+            f.write(f'@"{sys.executable}" "{FAKE}" %*\n')
+    else:
+        path = os.path.join(folder, "gallery-dl")
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+
+def make_shim(folder):
+    """A `gallery_dl` module for persistent workers, backed by the fake."""
+    shim = os.path.join(folder, "shim")
+    os.makedirs(shim)
+    with open(os.path.join(shim, "gallery_dl.py"), "w") as f:
+        f.write("from gallery_dl_fake import __version__, config, main, version\n")
+    return os.pathsep.join([shim, TOOLS_DIR])
+
+
+class _PayloadHandler(http.server.BaseHTTPRequestHandler):
+    """GET /bytes/N answers N generated bytes."""
+    block = bytes(range(256)) * 256
+
+    def do_GET(self):
+        try:
+            size = int(self.path.rsplit("/", 1)[-1])
+        except ValueError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        while size > 0:
+            chunk = self.block[:min(size, len(self.block))]
+            self.wfile.write(chunk)
+            size -= len(chunk)
+
+    def log_message(self, *args):
+        pass
+
+
+class PayloadServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values: return None
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 4)
+
+
+def peak_child_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows doesn't keep a peak for finished children
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round((maxrss if sys.platform == 'darwin' else maxrss * 1024) / 1048576, 1)
+
+
+# --- Scenarios (each in its own process) ---
+def bench_options(spec, args, folder):
+    from gallery_dl_engine import BatchOptions
+    return BatchOptions(
+        dest=os.path.join(folder, "dest"), executable=make_launcher(folder),
+        max_workers=args.workers or spec.get("workers", 8), per_host_workers=0,
+        max_retries=spec.get("retries", 0), retry_delay=0.05, retry_max_delay=0.2,
+        persistent=args.persistent, python=sys.executable)
+
+
+def run_engine(spec, args, folder):
+    from gallery_dl_engine import BatchEngine
+    from gallery_dl_worker import rss_bytes
+
+    urls = make_urls(spec, args.scale, args.seed)
+    events = collections.Counter()
+    engine = BatchEngine(bench_options(spec, args, folder), on_event=lambda e: events.update([e["event"]]),
+                         journal_path=os.path.join(folder, "journal.sqlite"))
+    stopped_at = []
+    if spec.get("stop_after"):
+        def stop():
+            stopped_at.append(time.perf_counter())
+            engine.stop()
+        timer = threading.Timer(spec["stop_after"], stop)
+        timer.start()
+
+    cpu = os.times()
+    started = time.perf_counter()
+    summary = engine.run(iter(urls))
+    finished = time.perf_counter()
+    cpu_after = os.times()
+    elapsed = finished - started
+    done = summary["completed"] - len(summary["failed"]) - len(summary["parked"])
+    result = {
+        "urls": len(urls),
+        "completed": summary["completed"],
+        "failed": len(summary["failed"]),
+        "parked": len(summary["parked"]),
+        "retries": events["url_retry"],
+        "files": engine.metrics.files,
+        "bytes": engine.metrics.bytes,
+        "events": sum(events.values()),
+        "elapsed": round(elapsed, 3),
+        "urls_per_sec": round(done / elapsed, 2),
+        "files_per_sec": round(engine.metrics.files / elapsed, 2),
+        "cpu_seconds": round(cpu_after.user + cpu_after.system - cpu.user - cpu.system, 3),
+        "peak_rss_mb": round(rss_bytes(peak=True) / 1048576, 1),
+        "peak_child_rss_mb": peak_child_rss_mb(),
+    }
+    if stopped_at:
+        result["stop_latency"] = round(finished - stopped_at[0], 3)
+        result["interrupted"] = len(summary["interrupted"])
+    return result
+
+
+class TimedQueue(queue.Queue):
+    """The GUI's log queue, recording how long each message waited to be shown."""
+    def __init__(self):
+        super().__init__()
+        self.lags = []
+
+    def put(self, item, block=True, timeout=None):
+        super().put((time.perf_counter(), item), block, timeout)
+
+    def get_nowait(self):
+        queued, item = super().get_nowait()
+        self.lags.append(time.perf_counter() - queued)
+        return item
+
+
+def run_gui(spec, args, folder):
+    from gallery_dl_worker import rss_bytes
+
+    module_spec = importlib.util.spec_from_file_location("gallery_dl_gui", GUI)
+    gui = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(gui)
+    try:
+        root = gui.tk.Tk()  # as the GUI's own __main__ does
+    except gui.tk.TclError as e:
+        return {"skipped": f"no display ({e})"}
+    # Keep the user's settings and job journal out of it.
+    gui.SETTINGS_FILE = os.path.join(folder, "settings.json")
+    gui.JOURNAL_FILE = os.path.join(folder, "journal.sqlite")
+    gui.PROBE_CACHE_FILE = os.path.join(folder, "gallery-dl-probe.json")
+    app = gui.GalleryDLGUI(root)
+    app.log_queue = TimedQueue()
+
+    ui_lags = []
+    expected = [time.perf_counter() + PROBE_MS / 1000]
+
+    def probe():
+        now = time.perf_counter()
+        ui_lags.append(max(0.0, now - expected[0]))
+        expected[0] = now + PROBE_MS / 1000
+        root.after(PROBE_MS, probe)
+
+    def wait_for_batch():
+        if app.is_downloading:
+            root.after(100, wait_for_batch)
+        else:
+            root.after(500, root.quit)  # let the last lines through
+
+    urls = make_urls(spec, args.scale, args.seed)
+    started = time.perf_counter()
+    app.launch_batch(bench_options(spec, args, folder), iter(urls))
+    root.after(PROBE_MS, probe)
+    root.after(100, wait_for_batch)
+    root.mainloop()
+    elapsed = time.perf_counter() - started - 0.5
+    lags = app.log_queue.lags
+    root.destroy()
+    return {
+        "urls": len(urls),
+        "elapsed": round(elapsed, 3),
+        "urls_per_sec": round(len(urls) / elapsed, 2),
+        "lines": len(lags),
+        "log_lag_p50": percentile(lags, 0.5),
+        "log_lag_p95": percentile(lags, 0.95),
+        "log_lag_max": percentile(lags, 1.0),
+        "ui_lag_p95": percentile(ui_lags, 0.95),
+        "ui_lag_max": percentile(ui_lags, 1.0),
+        "peak_rss_mb": round(rss_bytes(peak=True) / 1048576, 1),
+    }
+
+
+def run_child(name, args):
+    spec = SCENARIOS[name]
+    folder = tempfile.mkdtemp(prefix=f"gallery-dl-bench-{name}-")
+    try:
+        if args.persistent: os.environ["PYTHONPATH"] = make_shim(folder)
+        result = run_gui(spec, args, folder) if spec.get("gui") else run_engine(spec, args, folder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    print(json.dumps(result))
+    return 0
+
+
+# --- Driver ---
+def run_scenario(name, args, server):
+    """Runs one scenario in a child process; returns its result dict."""
+    env = dict(os.environ, GALLERY_DL_FAKE_STARTUP=str(args.startup))
+    if server is not None and SCENARIOS[name].get("serve"):
+        env["GALLERY_DL_FAKE_SERVER"] = f"http://127.0.0.1:{server.server_address[1]}"
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", name, "--scale", str(args.scale),
+           "--seed", str(args.seed), "--startup", str(args.startup), "--workers", str(args.workers)]
+    if args.persistent: cmd.append("--persistent")
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode or not lines:
+        return {"error": (proc.stderr.strip().splitlines() or [f"exit status {proc.returncode}"])[-1]}
+    return json.loads(lines[-1])
+
+
+def compare(old, new, threshold):
+    """Lines describing each figure's change, and whether any got worse than `threshold` percent."""
+    lines, regressed = [], False
+    for name, result in new["scenarios"].items():
+        before = old.get("scenarios", {}).get(name)
+        if not before: continue
+        for key, value in result.items():
+            was = before.get(key)
+            if not isinstance(value, (int, float)) or not isinstance(was, (int, float)) or not was: continue
+            change = (value - was) / was * 100
+            worse = abs(value - was) >= MIN_DELTA and (
+                (key in HIGHER_IS_BETTER and change < -threshold) or (key in LOWER_IS_BETTER and change > threshold))
+            regressed |= worse
+            if key in HIGHER_IS_BETTER or key in LOWER_IS_BETTER:
+                lines.append(f"{name:<9} {key:<18} {was:>12g} -> {value:<12g} {change:+7.1f}%"
+                             + ("  REGRESSION" if worse else ""))
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the batch engine against a simulated gallery-dl. Prints a JSON report.")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"scenarios to run (default: all): {', '.join(SCENARIOS)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every scenario's URL count (default: 1)")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the generated workloads (default: 1)")
+    parser.add_argument("--workers", type=int, default=0, help="override the scenarios' worker counts")
+    parser.add_argument("--persistent", action="store_true", help="use persistent workers")
+    parser.add_argument("--startup", type=float, default=0.05, metavar="SECONDS",
+                        help="simulated gallery-dl startup per process (default: 0.05)")
+    parser.add_argument("-o", "--output", default="", metavar="FILE", help="also write the report to FILE")
+    parser.add_argument("--compare", default="", metavar="FILE", help="compare with an earlier report")
+    parser.add_argument("--threshold", type=float, default=10.0, metavar="PERCENT",
+                        help="change that counts as a regression for --compare (default: 10)")
+    parser.add_argument("--list", action="store_true", help="list the scenarios and exit")
+    parser.add_argument("--child", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child: return run_child(args.child, args)
+    if args.list:
+        for name, spec in SCENARIOS.items(): print(f"{name:<9} {spec['description']}")
+        return 0
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown: parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    server = None
+    if any(SCENARIOS[name].get("serve") for name in names):
+        server = PayloadServer(("127.0.0.1", 0), _PayloadHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    report = {
+        "version": REPORT_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {"scale": args.scale, "seed": args.seed, "workers": args.workers or None,
+                     "persistent": args.persistent, "startup": args.startup},
+        "scenarios": {},
+    }
+    try:
+        for name in names:
+            print(f"{name}: {SCENARIOS[name]['description']}...", file=sys.stderr)
+            result = report["scenarios"][name] = run_scenario(name, args, server)
+            print("  " + ", ".join(f"{k}={v}" for k, v in result.items()), file=sys.stderr)
+    finally:
+        if server is not None: server.shutdown()
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    if baseline is not None:
+        lines, regressed = compare(baseline, report, args.threshold)
+        for line in lines: print(line, file=sys.stderr)
+        if regressed: return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
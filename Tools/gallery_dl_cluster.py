@@ -0,0 +1,658 @@
+#!/usr/bin/env python3
+"""
+Sharded batches: one coordinator, workers on several machines.
+
+The coordinator owns the batch. It reads the input, journals every URL like
+the engine does, and hands URLs out as leases over a small JSON-over-HTTP
+protocol. Each worker runs an ordinary BatchEngine, with its own gallery-dl
+processes, per-host limits, disk and network, that pulls URLs through
+leases and reports every result back:
+
+    POST /join       {"worker"}                          -> {"ttl", "options"}
+    POST /lease      {"worker", "count"}                 -> {"leases": [{"id", "url"}], "done", "wait"}
+    POST /heartbeat  {"worker", "leases", "results",     -> {"expired", "stop"}
+                      "metrics", "leaving"}
+    GET  /status                                         -> counts and every worker's metrics
+
+A lease lasts `ttl` seconds and every heartbeat (about ttl/4 apart) renews
+all of a worker's leases. When a worker dies, its leases expire and their
+URLs go back to the front of the queue. A URL never runs on two hosts at
+once. The coordinator only hands it out again after the lease expired, and
+a worker that could not renew its leases for FENCE x ttl kills its
+downloads first, on a timer of its own that no hung request can hold up. A
+URL whose lease expired MAX_EXPIRED times (it keeps killing workers) is
+failed instead.
+
+`per_host` caps how many URLs of one host are leased across the whole
+cluster, on top of each worker's own limits. The batch options that must
+agree across workers (archive, folders, extra args, retries) come from the
+coordinator; paths, worker counts and the gallery-dl to run are local.
+
+    python gallery_dl_cluster.py coordinator -i urls.txt --bind 0.0.0.0 --token SECRET --archive
+    python gallery_dl_cluster.py worker http://coordinator:8470 --token SECRET -d D:\\Wallpapers -w 8
+"""
+import argparse
+import asyncio
+import collections
+import hmac
+import http.server
+import itertools
+import json
+import os
+import secrets
+import signal
+import socket
+import sys
+import time
+import urllib.request
+
+from gallery_dl_engine import (GALLERY_DL, METRICS_INTERVAL, MAX_WORKERS_LIMIT, BatchEngine, BatchOptions, host_of,
+                               iter_urls)
+from gallery_dl_journal import (DONE, FAILED, FINISHED, JOURNAL_FILE, PARKED, STOPPED, JobJournal)
+
+DEFAULT_PORT = 8470
+LEASE_TTL = 60.0  # seconds a lease lasts without a heartbeat
+MIN_TTL = 10.0  # shorter leases leave too little time to fence before they expire
+FENCE = 0.75  # a worker kills its downloads after FENCE x ttl without a successful heartbeat
+REQUEST_TIMEOUT = 0.125  # x ttl: a hung request must not outlast a heartbeat interval (ttl/4)
+MAX_EXPIRED = 3  # leases of one URL that may expire before it is failed
+WINDOW = 1000  # URLs read from the input ahead of the leases
+PREFETCH = 2  # URLs a worker leases beyond its running downloads
+IDLE_WAIT = 2.0  # seconds a worker waits when nothing can be leased right now
+CONNECTION_TIMEOUT = 2.0  # seconds the coordinator waits on one worker's request before dropping it
+LINGER = 5.0  # seconds the coordinator keeps answering after the batch, so workers learn it is done
+TOKEN_HEADER = "X-Cluster-Token"
+RELEASED = "released"  # result state: the worker gave the URL back without running it to the end
+# Options the coordinator hands to every worker; the rest are each worker's own.
+SHARED_OPTIONS = ("flatten", "use_archive", "archive_mode", "extra_args", "max_retries", "retry_delay",
+                  "abort_after", "structured_output")
+
+
+class Lease:
+    __slots__ = ("id", "url", "worker", "expires")
+
+    def __init__(self, lease_id, url, worker, expires):
+        self.id = lease_id
+        self.url = url
+        self.worker = worker
+        self.expires = expires
+
+
+# --- Coordinator ---
+class Coordinator:
+    """
+    The queue and the leases. Not thread-safe: the HTTP server calls it on
+    the one thread that also runs housekeeping(). Events go to `on_event`
+    like the engine's, e.g. {"event": "url_done", "url": ..., "state": "done"}.
+    """
+    def __init__(self, urls=(), options=None, ttl=LEASE_TTL, per_host=0, journal_path=None, resume=None,
+                 on_event=None):
+        self.options = {key: value for key, value in (options or {}).items() if key in SHARED_OPTIONS}
+        self.ttl = max(MIN_TTL, float(ttl))
+        self.per_host = max(0, int(per_host))
+        self.on_event = on_event
+        self.queue = collections.deque()
+        self.leases = {}  # id -> Lease
+        self.leased = {}  # url -> Lease; one at a time
+        self.host_load = collections.Counter()
+        self.expired = collections.Counter()  # url -> leases that ran out
+        self.workers = {}  # name -> {"seen", "leases", "done", "metrics"}
+        self.counts = collections.Counter()
+        self.failed = []
+        self.parked = []
+        self.total = 0
+        self.stopping = False
+        self.session = secrets.token_hex(4)
+        self._ids = itertools.count(1)
+        self._seen = set()
+        self._input_done = False
+        self._started = time.time()
+        self._next_metrics = 0.0
+        self._next_flush = 0.0
+
+        self.journal = JobJournal(journal_path) if journal_path else None
+        self.batch_id = resume
+        if self.journal is not None:
+            if resume is not None:
+                counts = self.journal.counts(resume)
+                self.total = sum(counts.values())
+                for state in (DONE, FAILED, PARKED): self.counts[state] = counts.get(state, 0)
+                self.failed, self.parked = self.journal.failed_urls(resume), self.journal.parked_urls(resume)
+                urls = self.journal.iter_pending_urls(resume)
+            else:
+                self.batch_id = self.journal.create_batch((), dict(self.options, cluster=True))
+        self._input = iter(urls)
+        self._resumed = resume is not None
+        self.emit("batch_started", batch_id=self.batch_id, resumed=self._resumed, ttl=self.ttl,
+                  completed=self.completed)
+        self._refill()
+
+    def emit(self, kind, **fields):
+        if self.on_event is None: return
+        event = {"event": kind, "ts": round(time.time(), 3)}
+        event.update(fields)
+        try:
+            self.on_event(event)
+        except Exception:
+            pass
+
+    @property
+    def completed(self):
+        return self.counts[DONE] + self.counts[FAILED] + self.counts[PARKED]
+
+    @property
+    def finished(self):
+        """All input read and every URL done, or stopped with nothing leased any more."""
+        if self.stopping: return not self.leases
+        return self._input_done and not self.queue and not self.leases
+
+    def _refill(self):
+        while not self._input_done and len(self.queue) < WINDOW:
+            chunk = list(itertools.islice(self._input, 500))
+            if not chunk:
+                self._input_done = True
+                self.emit("input_finished", total=self.total)
+                return
+            if not self._resumed:  # resumed URLs are journaled and counted already
+                if self.journal is not None:
+                    chunk = self.journal.add_jobs(self.batch_id, chunk)
+                else:
+                    chunk = [url for url in dict.fromkeys(chunk) if url not in self._seen]
+                    self._seen.update(chunk)
+                self.total += len(chunk)
+            self.queue.extend(chunk)
+
+    def _touch(self, worker):
+        state = self.workers.get(worker)
+        if state is None:
+            state = self.workers[worker] = {"seen": 0.0, "leases": 0, "done": 0, "metrics": {}}
+            self.emit("worker_joined", worker=worker)
+        state["seen"] = time.monotonic()
+        return state
+
+    # --- Requests ---
+    def join(self, request):
+        self._touch(request["worker"])
+        return {"ttl": self.ttl, "options": self.options, "batch_id": self.batch_id}
+
+    def lease(self, request):
+        worker, count = request["worker"], max(0, int(request["count"]))
+        state = self._touch(worker)
+        granted = []
+        if not self.stopping:
+            self._refill()
+            now = time.monotonic()
+            for _ in range(len(self.queue)):
+                if len(granted) >= count: break
+                url = self.queue.popleft()
+                host = host_of(url)
+                if self.per_host and self.host_load[host] >= self.per_host:
+                    self.queue.append(url)  # that host is busy cluster-wide; try the next URL
+                    continue
+                lease = Lease(f"{self.session}-{next(self._ids)}", url, worker, now + self.ttl)
+                self.leases[lease.id] = self.leased[url] = lease
+                self.host_load[host] += 1
+                state["leases"] += 1
+                if self.journal is not None: self.journal.mark_running(self.batch_id, url)
+                granted.append({"id": lease.id, "url": url})
+        return {"leases": granted, "done": self.finished, "wait": 0 if granted else min(IDLE_WAIT, self.ttl / 4)}
+
+    def heartbeat(self, request):
+        worker = request["worker"]
+        state = self._touch(worker)
+        if request.get("metrics"): state["metrics"] = request["metrics"]
+        for result in request.get("results", ()):
+            lease = self.leases.get(result["lease"])
+            if lease is None or lease.worker != worker: continue  # expired meanwhile; the URL runs elsewhere
+            self._end_lease(lease)
+            if result["state"] == RELEASED:
+                self._requeue(lease.url)
+            else:
+                self._record(lease.url, worker, result)
+                state["done"] += 1
+        expired = []
+        deadline = time.monotonic() + self.ttl
+        for lease_id in request.get("leases", ()):
+            lease = self.leases.get(lease_id)
+            if lease is None or lease.worker != worker: expired.append(lease_id)
+            else: lease.expires = deadline
+        if request.get("leaving"):
+            self.workers.pop(worker, None)
+            self.emit("worker_left", worker=worker)
+        return {"expired": expired, "stop": self.stopping}
+
+    def status(self):
+        now = time.monotonic()
+        return {
+            "batch_id": self.batch_id, "total": self.total, "more": not self._input_done,
+            "completed": self.completed, "queued": len(self.queue), "leased": len(self.leases),
+            "states": {state: self.counts[state] for state in (DONE, FAILED, PARKED)},
+            "stopping": self.stopping, "elapsed": round(time.time() - self._started, 1),
+            "workers": {name: dict(state, seen=round(now - state["seen"], 1)) for name, state in self.workers.items()},
+        }
+
+    # --- Bookkeeping ---
+    def _end_lease(self, lease):
+        del self.leases[lease.id]
+        del self.leased[lease.url]
+        host = host_of(lease.url)
+        self.host_load[host] -= 1
+        if not self.host_load[host]: del self.host_load[host]
+
+    def _requeue(self, url):
+        self.queue.appendleft(url)
+        if self.journal is not None: self.journal.mark_queued(self.batch_id, url)
+
+    def _record(self, url, worker, result):
+        state = result["state"] if result["state"] in (DONE, FAILED, PARKED) else FAILED
+        self.counts[state] += 1
+        if state == FAILED: self.failed.append(url)
+        elif state == PARKED: self.parked.append(url)
+        if self.journal is not None:
+            self.journal.mark_finished(self.batch_id, url, state, result.get("returncode"), result.get("message"),
+                                       result.get("files", 0))
+        self.emit("url_done", url=url, worker=worker, state=state, returncode=result.get("returncode"),
+                  files=result.get("files", 0))
+        self.emit("progress", completed=self.completed, total=self.total, more=not self._input_done)
+
+    def housekeeping(self):
+        """Expires leases, notices lost workers, flushes the journal and reports metrics."""
+        now = time.monotonic()
+        for lease in [lease for lease in self.leases.values() if lease.expires <= now]:
+            self._end_lease(lease)
+            self.expired[lease.url] += 1
+            self.emit("lease_expired", url=lease.url, worker=lease.worker, times=self.expired[lease.url])
+            if self.expired[lease.url] >= MAX_EXPIRED:
+                self._record(lease.url, lease.worker, {"state": FAILED, "message": "lease expired repeatedly"})
+            elif self.stopping:
+                if self.journal is not None: self.journal.mark_queued(self.batch_id, lease.url)
+            else:
+                self._requeue(lease.url)
+        for name, state in list(self.workers.items()):
+            if now - state["seen"] > self.ttl:
+                del self.workers[name]
+                self.emit("worker_lost", worker=name)
+        if self.journal is not None and now >= self._next_flush:
+            self._next_flush = now + 1.0
+            self.journal.flush()
+        if now >= self._next_metrics:
+            self._next_metrics = now + METRICS_INTERVAL
+            self.emit("metrics", **self.metrics())
+
+    def metrics(self):
+        """The workers' latest counters, summed."""
+        totals = collections.Counter()
+        for state in self.workers.values():
+            for key in ("files", "bytes", "files_per_sec", "bytes_per_sec"):
+                totals[key] += state["metrics"].get(key, 0)
+        return dict(totals, workers=len(self.workers), leased=len(self.leases), queued=len(self.queue),
+                    urls_completed=self.completed, urls_total=self.total, more=not self._input_done)
+
+    def stop(self):
+        """Stops leasing; workers are told to stop and give back what they hold."""
+        if not self.stopping:
+            self.stopping = True
+            self.emit("stop_requested", leased=len(self.leases))
+
+    def close(self):
+        """Ends the batch in the journal; returns a summary like the engine's."""
+        stopped = self.stopping and not (self._input_done and not self.queue and self.completed >= self.total)
+        if self.journal is not None:
+            self.journal.finish_batch(self.batch_id, STOPPED if stopped else FINISHED)
+            self.journal.close()
+        summary = {"batch_id": self.batch_id, "total": self.total, "completed": self.completed,
+                   "failed": list(self.failed), "parked": list(self.parked), "stopped": stopped,
+                   "elapsed": round(time.time() - self._started, 3)}
+        self.emit("batch_finished", **summary)
+        return summary
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    server_version = "gallery-dl-cluster"
+    timeout = CONNECTION_TIMEOUT  # one stalled worker must not hold up the single-threaded server
+
+    def do_GET(self):
+        if not self._authorized(): return
+        if self.path.rstrip("/") == "/status": self._reply(200, self.server.coordinator.status())
+        else: self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self._authorized(): return
+        coordinator = self.server.coordinator
+        handler = {"/join": coordinator.join, "/lease": coordinator.lease,
+                   "/heartbeat": coordinator.heartbeat}.get(self.path)
+        if handler is None: return self._reply(404, {"error": "not found"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            reply = handler(request)
+        except (ValueError, KeyError, TypeError) as e:
+            return self._reply(400, {"error": f"{e.__class__.__name__}: {e}"})
+        self._reply(200, reply)
+
+    def _authorized(self):
+        token = self.server.token
+        if not token or hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), token): return True
+        self._reply(403, {"error": "wrong token"})
+        return False
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(coordinator, bind="127.0.0.1", port=DEFAULT_PORT, token="", stop=None):
+    """
+    Answers workers until the batch is finished (or `stop`, a callable, says
+    so and the leases are given back) and returns the summary. Requests are
+    handled one at a time on this thread; each one is a few dict operations.
+    """
+    server = http.server.HTTPServer((bind, port), _Handler)
+    server.coordinator = coordinator
+    server.token = token
+    server.timeout = 0.25
+    coordinator.emit("listening", address=f"http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        while not coordinator.finished:
+            if stop is not None and stop(): coordinator.stop()
+            server.handle_request()
+            coordinator.housekeeping()
+        summary = coordinator.close()
+        until = time.monotonic() + LINGER
+        while time.monotonic() < until and coordinator.workers:
+            server.handle_request()
+    finally:
+        server.server_close()
+    return summary
+
+
+# --- Worker ---
+class CoordinatorClient:
+    def __init__(self, base, token="", timeout=10.0):
+        self.base = base.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))  # LAN: never via a proxy
+
+    def call(self, path, payload=None):
+        """POSTs (or with no payload GETs) one request; raises OSError when the coordinator can't be reached."""
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(f"{self.base}/{path}", data=data,
+                                         headers={"Content-Type": "application/json", TOKEN_HEADER: self.token})
+        with self.opener.open(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+
+class ClusterWorker:
+    """
+    Runs leased URLs in a local BatchEngine. `options` are this machine's
+    batch options; the coordinator's shared ones override them. Lease
+    requests, renewals and results all happen on the engine's loop thread.
+    """
+    def __init__(self, coordinator, options, name=None, token="", on_event=None):
+        self.client = CoordinatorClient(coordinator, token)
+        self.options = options
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.on_event = on_event
+        self.engine = None
+        self.ttl = LEASE_TTL
+        self.leases = {}  # url -> lease id
+        self.results = []  # waiting for the next heartbeat
+        self.metrics = {}
+        self.fenced = None  # why this worker killed its downloads
+        self._room = None
+        self._last_ok = 0.0
+
+    def run(self):
+        return asyncio.run(self.run_async())
+
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
+        hello = await loop.run_in_executor(None, self.client.call, "join", {"worker": self.name})
+        self.ttl = float(hello["ttl"])
+        self.client.timeout = min(self.client.timeout, self.ttl * REQUEST_TIMEOUT)
+        options = BatchOptions(**dict(self.options.to_dict(), **hello["options"]))
+        self.engine = BatchEngine(options, on_event=self._on_event)
+        self._room = asyncio.Event()
+        self._last_ok = time.monotonic()
+        tasks = [asyncio.ensure_future(self._heartbeat()), asyncio.ensure_future(self._watchdog())]
+        try:
+            summary = await self.engine.run_async(self._leased())
+        finally:
+            for task in tasks: task.cancel()
+        for lease_id in self.leases.values(): self.results.append({"lease": lease_id, "state": RELEASED})
+        self.leases.clear()
+        if self.fenced is None: await self._send(leaving=True)
+        summary["worker"] = self.name
+        summary["fenced"] = self.fenced
+        return summary
+
+    def stop(self, hard=False):
+        if self.engine is not None: self.engine.stop(hard)
+
+    async def _leased(self):
+        """The engine's input: URLs leased as the engine has room for them, until the coordinator is done."""
+        loop = asyncio.get_running_loop()
+        slots = self.engine.options.max_workers + PREFETCH
+        while not self.engine.stop_requested:
+            room = slots - len(self.leases)
+            if room <= 0:
+                self._room.clear()
+                await self._room.wait()
+                continue
+            try:
+                reply = await loop.run_in_executor(None, self.client.call, "lease", {"worker": self.name, "count": room})
+            except OSError as e:
+                self._emit("error", message=f"Coordinator unreachable: {e}")
+                await asyncio.sleep(IDLE_WAIT)  # the heartbeat fences us if this goes on
+                continue
+            if self.engine.stop_requested:
+                for lease in reply["leases"]: self.results.append({"lease": lease["id"], "state": RELEASED})
+                return
+            if reply["leases"]:
+                for lease in reply["leases"]: self.leases[lease["url"]] = lease["id"]
+                yield [lease["url"] for lease in reply["leases"]]
+            elif reply["done"]:
+                return
+            else:
+                await asyncio.sleep(reply["wait"])
+
+    def _on_event(self, event):
+        kind = event["event"]
+        if kind == "url_done":
+            lease_id = self.leases.pop(event["url"], None)
+            if lease_id is not None:
+                self.results.append({"lease": lease_id, "state": event["state"], "returncode": event["returncode"],
+                                     "message": event["message"], "files": event["files"]})
+            self._room.set()
+        elif kind == "url_interrupted":
+            lease_id = self.leases.pop(event["url"], None)
+            if lease_id is not None: self.results.append({"lease": lease_id, "state": RELEASED})
+            self._room.set()
+        elif kind == "metrics":
+            self.metrics = {key: event[key] for key in ("files", "bytes", "files_per_sec", "bytes_per_sec")}
+        if self.on_event is not None: self.on_event(event)
+
+    def _emit(self, kind, **fields):
+        self._on_event(dict({"event": kind, "ts": round(time.time(), 3)}, **fields))
+
+    async def _heartbeat(self):
+        interval = self.ttl / 4
+        while True:
+            await asyncio.sleep(interval)
+            await self._send()
+
+    async def _watchdog(self):
+        """
+        Fences FENCE x ttl after the last heartbeat that got through (counted
+        from when it was sent, so before the coordinator renewed the leases),
+        however long the current request hangs.
+        """
+        while self.fenced is None:
+            left = self._last_ok + self.ttl * FENCE - time.monotonic()
+            if left <= 0:
+                self._fence("no contact with the coordinator")
+                return
+            await asyncio.sleep(left)
+
+    async def _send(self, leaving=False):
+        results, self.results = self.results, []
+        payload = {"worker": self.name, "leases": list(self.leases.values()), "results": results,
+                   "metrics": self.metrics, "leaving": leaving}
+        sent = time.monotonic()
+        try:
+            reply = await asyncio.get_running_loop().run_in_executor(None, self.client.call, "heartbeat", payload)
+        except OSError as e:
+            self.results[:0] = results
+            self._emit("error", message=f"Heartbeat failed: {e}")
+            return
+        if self.fenced is not None: return
+        self._last_ok = sent
+        if reply["expired"]: self._fence(f"{len(reply['expired'])} leases expired")
+        elif reply["stop"] and not self.engine.stop_requested: self.engine.stop()
+
+    def _fence(self, reason):
+        """Our leases may be someone else's by now: kill everything rather than run a URL twice."""
+        self.fenced = reason
+        self._emit("error", message=f"Stopping all downloads: {reason}")
+        self.leases.clear()
+        self.engine.stop(hard=True)
+
+
+# --- Command Line ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="gallery_dl_cluster",
+        description="Spread one batch over several machines: a coordinator leases URLs to workers, "
+                    "which download them with their own gallery-dl. Events are written to stdout as JSON lines.")
+    parser.add_argument("--token", default=os.environ.get("GALLERY_DL_CLUSTER_TOKEN", ""),
+                        help="shared secret of coordinator and workers (default: $GALLERY_DL_CLUSTER_TOKEN)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    coordinator = commands.add_parser("coordinator", help="own a batch and lease its URLs to workers")
+    coordinator.add_argument("urls", nargs="*", help="URLs to download")
+    coordinator.add_argument("-i", "--input-file", action="append", default=[], metavar="FILE",
+                             help="read URLs from FILE, one per line ('-' for stdin); may be repeated")
+    coordinator.add_argument("--bind", default="127.0.0.1",
+                             help="address to listen on; 0.0.0.0 for the whole network (default: %(default)s)")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_PORT, help="(default: %(default)s)")
+    coordinator.add_argument("--lease-ttl", type=float, default=LEASE_TTL, metavar="SECONDS",
+                             help=f"how long a lease outlives its worker's last heartbeat, at least {MIN_TTL:g} "
+                                  "(default: %(default)s)")
+    coordinator.add_argument("--per-host", type=int, default=0, metavar="N",
+                             help="max URLs of one host leased across all workers, 0 = no cap (default: 0)")
+    coordinator.add_argument("--archive", action="store_true", help="workers track history in <dest>/archive.sqlite")
+    coordinator.add_argument("--no-flatten", action="store_true", help="let gallery-dl create its own subfolders")
+    coordinator.add_argument("--extra-args", default="", help="raw flags passed to gallery-dl")
+    coordinator.add_argument("--retries", type=int, default=3, metavar="N",
+                             help="times a worker retries a transient failure (default: 3)")
+    coordinator.add_argument("--abort", type=int, default=0, metavar="N",
+                             help="stop a gallery after N files in a row that were downloaded before")
+    coordinator.add_argument("--journal", default=JOURNAL_FILE, metavar="PATH",
+                             help="job journal database (default: %(default)s)")
+    coordinator.add_argument("--no-journal", action="store_true", help="do not record the batch in the journal")
+    coordinator.add_argument("--resume", nargs="?", const="last", metavar="BATCH_ID",
+                             help="resume an unfinished batch (default: the newest one)")
+
+    worker = commands.add_parser("worker", help="download URLs leased from a coordinator")
+    worker.add_argument("coordinator", help=f"coordinator address, e.g. http://host:{DEFAULT_PORT}")
+    worker.add_argument("-d", "--dest", default=os.getcwd(), help="save directory (default: current directory)")
+    worker.add_argument("-w", "--workers", type=int, default=4,
+                        help=f"parallel gallery-dl processes on this machine (default: 4, max: {MAX_WORKERS_LIMIT})")
+    worker.add_argument("--per-host", type=int, default=2, metavar="N",
+                        help="max parallel downloads per host on this machine, 0 = no cap (default: 2)")
+    worker.add_argument("-c", "--cookies", default="", help="cookies.txt file")
+    worker.add_argument("--limit-total", default="", metavar="RATE", help="bandwidth budget of this machine, e.g. 4M")
+    worker.add_argument("--gallery-dl", default=GALLERY_DL, metavar="PATH", help="gallery-dl executable")
+    worker.add_argument("--persistent", action="store_true",
+                        help="run URLs in long-lived Python workers that import gallery-dl once")
+    worker.add_argument("--python", default=sys.executable, metavar="PATH", help="interpreter for --persistent")
+    worker.add_argument("--name", default=None, help="worker name (default: host-pid)")
+    worker.add_argument("--no-output", action="store_true",
+                        help="do not emit gallery-dl's own output lines and per-file events")
+    return parser.parse_args(argv)
+
+
+def write_event(event):
+    sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def run_coordinator(args):
+    journal_path = None if args.no_journal else args.journal
+    resume = None
+    try:
+        if args.resume:
+            if journal_path is None: raise ValueError("--resume needs the journal")
+            journal = JobJournal(journal_path)
+            try:
+                resume = journal.unfinished_batch() if args.resume == "last" else int(args.resume)
+            finally:
+                journal.close()
+            if resume is None: raise ValueError("no unfinished batch to resume")
+        elif not args.urls and not args.input_file:
+            raise ValueError("no URLs given")
+        if args.lease_ttl < MIN_TTL: raise ValueError(f"--lease-ttl must be at least {MIN_TTL:g} seconds")
+        options = {"flatten": not args.no_flatten, "use_archive": args.archive, "extra_args": args.extra_args,
+                   "max_retries": args.retries, "abort_after": args.abort}
+        coordinator = Coordinator(() if resume is not None else iter_urls(args), options, args.lease_ttl,
+                                  args.per_host, journal_path, resume, on_event=write_event)
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    signalled = []
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: signalled.append(signum))
+    try:
+        summary = serve(coordinator, args.bind, args.port, args.token, stop=lambda: bool(signalled))
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    if signalled: return 130
+    return 1 if summary["failed"] else 0
+
+
+def run_worker(args):
+    options = BatchOptions(dest=args.dest, cookies=args.cookies, max_workers=args.workers, executable=args.gallery_dl,
+                           per_host_workers=args.per_host, bandwidth_limit=args.limit_total,
+                           persistent=args.persistent, python=args.python,
+                           window=0)  # as small as allowed: the coordinator holds the queue, workers lease as they go
+
+    def on_event(event):
+        if args.no_output and event["event"] in ("output", "file_started", "file_finished", "file_skipped"): return
+        write_event(event)
+
+    worker = ClusterWorker(args.coordinator, options, args.name, args.token, on_event=on_event)
+    signalled = []
+
+    def on_signal(signum, frame):
+        worker.stop(hard=bool(signalled))
+        signalled.append(signum)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, on_signal)
+    try:
+        summary = worker.run()
+    except OSError as e:
+        print(f"error: cannot reach the coordinator: {e}", file=sys.stderr)
+        return 2
+    if signalled: return 130
+    if summary["fenced"]: return 3
+    return 1 if summary["failed"] else 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "coordinator": return run_coordinator(args)
+    return run_worker(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+"""
+Paths and limits shared by the gallery-dl GUI, the batch engine and its helpers.
+
+Kept free of heavy imports: the GUI reads it before its window is up.
+"""
+import os
+import sys
+
+APP_NAME = "gallery-dl-gui"
+MAX_WORKERS_LIMIT = 256
+if sys.platform == 'win32':
+    CONFIG_DIR = os.path.join(os.environ.get('APPDATA', os.path.expanduser('~')), APP_NAME)
+else:
+    CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".config", APP_NAME)
+
+if not os.path.exists(CONFIG_DIR):
+    try:
+        os.makedirs(CONFIG_DIR)
+    except OSError:
+        CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SETTINGS_FILE = os.path.join(CONFIG_DIR, "settings.json")
+JOURNAL_FILE = os.path.join(CONFIG_DIR, "jobs.sqlite")
@@ -0,0 +1,378 @@
+"""
+Duplicate detection for the library folder.
+
+LibraryIndex keeps one row per file of the library in an SQLite database
+in INDEX_DIR, outside the watched folder: size, mtime, SHA-256 and, for
+still images when Pillow is installed, a 64-bit difference hash (dHash),
+which stays (nearly) the same when an image is re-encoded or resized.
+Rows are refreshed only for files whose size or mtime changed, so keeping
+the index current is cheap.
+
+Exact duplicates are one lookup on the indexed sha256 column. Near
+duplicates use multi-index hashing: the dHash is split into BANDS 16-bit
+bands, each in its own indexed column. Two hashes at most MAX_DISTANCE
+bits apart differ in at most one bit of some band (pigeonhole), so the
+candidates come from looking up every band's value and its 16 one-bit
+neighbours - a handful of rows, compared bit by bit, never every pair.
+Flat and plain-gradient images have near-empty hashes that would all
+match each other, so they are only ever found as exact duplicates.
+
+Run as a script for a dry-run report, or to hardlink (exact duplicates)
+or move duplicates aside:
+
+    python gallery_dl_dedup.py D:\\Wallpapers --near 6 --move
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from gallery_dl_config import CONFIG_DIR
+from gallery_dl_publish import MANIFEST_NAME
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+INDEX_DIR = os.path.join(CONFIG_DIR, "library-index")  # one database per library folder
+IMAGE_TYPES = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".gif")
+BANDS = 4
+BAND_BITS = 16
+MAX_DISTANCE = 2 * BANDS - 1  # every band searched within 1 bit
+DEFAULT_DISTANCE = 6
+MIN_HASH_BITS = 8  # dHashes with fewer set (or clear) bits are never near-matched, see informative()
+HASH_BLOCK = 1024 * 1024
+BATCH = 500  # rows per transaction while scanning
+LINK, MOVE = "link", "move"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path   TEXT PRIMARY KEY,  -- relative to the library, '/' separated
+    size   INTEGER NOT NULL,
+    mtime  REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    dhash  INTEGER,           -- signed 64-bit; NULL for non-images
+    pixels INTEGER,
+    {bands}
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+{band_indexes}
+""".format(bands=",\n    ".join(f"b{i} INTEGER" for i in range(BANDS)),
+           band_indexes="\n".join(f"CREATE INDEX IF NOT EXISTS files_b{i} ON files (b{i});"
+                                  for i in range(BANDS)))
+
+
+def default_aside_dir(library):
+    """Where --move puts duplicates: D:\\Wallpapers -> D:\\Wallpapers.duplicates"""
+    library = os.path.abspath(library)
+    return os.path.join(os.path.dirname(library), os.path.basename(library) + ".duplicates")
+
+
+def default_index_path(library):
+    """INDEX_DIR/Wallpapers-<hash of the full path>.sqlite, so every library folder (even D:\\) gets its own."""
+    library = os.path.normcase(os.path.abspath(library))
+    name = os.path.basename(library) or "root"
+    return os.path.join(INDEX_DIR, f"{name}-{hashlib.sha1(library.encode()).hexdigest()[:12]}.sqlite")
+
+
+def bands(value):
+    return [(value >> (BAND_BITS * i)) & 0xFFFF for i in range(BANDS)]
+
+
+def probes(band, radius):
+    """The band value and, for radius 1, every value one bit away."""
+    return [band] + ([band ^ (1 << bit) for bit in range(BAND_BITS)] if radius else [])
+
+
+def distance(a, b):
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+def informative(value):
+    """
+    False for the dHash of a (nearly) flat image: a solid colour or a plain
+    gradient hashes to 0, all ones or close to it, so all such wallpapers
+    would look alike.
+    """
+    return MIN_HASH_BITS <= distance(value, 0) <= 64 - MIN_HASH_BITS
+
+
+def to_signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def dhash(image):
+    """64-bit difference hash: is each pixel of a 9x8 grayscale thumbnail brighter than its right neighbour?"""
+    image.draft("L", (64, 64))
+    pixels = image.convert("L").resize((9, 8), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def fingerprint(path):
+    """(sha256, dhash or None, pixels or None) of a file, None if it can't be read; runs in a pool."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                digest.update(block)
+    except OSError:
+        return None
+    value = pixels = None
+    if HAS_PIL and path.lower().endswith(IMAGE_TYPES):
+        try:
+            with Image.open(path) as image:
+                pixels = image.width * image.height
+                value = dhash(image)
+        except Exception:
+            pass  # unreadable or truncated images still get an exact hash
+    return digest.hexdigest(), value, pixels
+
+
+class LibraryIndex:
+    """
+    The index of one library folder. Not thread-safe: use it from one
+    thread (the engine's loop thread, or a scan thread with its own
+    instance).
+    """
+    def __init__(self, library, path=None):
+        self.library = os.path.abspath(library)
+        path = path or default_index_path(self.library)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30,
+                                  isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def rel(self, path):
+        return os.path.relpath(path, self.library).replace(os.sep, "/")
+
+    def changed(self, path):
+        """os.stat() of `path` if its row is missing or out of date, else None."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        row = self.db.execute("SELECT size, mtime FROM files WHERE path = ?", (self.rel(path),)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime: return None
+        return st
+
+    def record(self, path, st, fp):
+        sha256, value, pixels = fp
+        band_values = bands(value) if value is not None else [None] * BANDS
+        self.db.execute(f"INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' * BANDS)})",
+                        (self.rel(path), st.st_size, st.st_mtime, sha256,
+                         to_signed(value) if value is not None else None, pixels, *band_values))
+
+    def forget(self, rel):
+        self.db.execute("DELETE FROM files WHERE path = ?", (rel,))
+
+    def exact(self, sha256, exclude=None):
+        """Paths with this content hash - O(1) via the sha256 index."""
+        return [row[0] for row in self.db.execute("SELECT path FROM files WHERE sha256 = ?", (sha256,))
+                if row[0] != exclude]
+
+    def near(self, value, max_distance=DEFAULT_DISTANCE, exclude=None):
+        """
+        [(path, distance)] of images whose dHash is within `max_distance`
+        bits of `value`; none for low-information hashes (see informative()).
+        """
+        if max_distance > MAX_DISTANCE: raise ValueError(f"near-duplicate distance is at most {MAX_DISTANCE}")
+        if not informative(value): return []
+        radius = max_distance // BANDS
+        where = " OR ".join(f"b{i} IN ({', '.join('?' * (1 + radius * BAND_BITS))})" for i in range(BANDS))
+        params = [v for band in bands(value) for v in probes(band, radius)]
+        matches = []
+        for path, other in self.db.execute(f"SELECT path, dhash FROM files WHERE {where}", params):
+            d = distance(value, other)
+            if d <= max_distance and path != exclude and informative(other & 0xFFFFFFFFFFFFFFFF):
+                matches.append((path, d))
+        return sorted(matches, key=lambda m: m[1])
+
+    def scan(self, workers=None, progress=None):
+        """
+        Brings the index up to date with the folder: new and changed files
+        are fingerprinted on a process pool, rows of deleted files dropped.
+        Returns (files indexed, rows removed).
+        """
+        seen, todo = set(), []
+        for root, dirs, files in os.walk(self.library):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if name.startswith(".") or name.startswith("archive.sqlite") or name.endswith((".part", ".tmp")): continue
+                path = os.path.join(root, name)
+                seen.add(self.rel(path))
+                st = self.changed(path)
+                if st is not None: todo.append((path, st))
+
+        indexed = 0
+        if todo:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                results = pool.map(fingerprint, [path for path, _ in todo], chunksize=16)
+                self.db.execute("BEGIN")
+                for (path, st), fp in zip(todo, results):
+                    if fp is None: continue
+                    self.record(path, st, fp)
+                    indexed += 1
+                    if indexed % BATCH == 0:
+                        self.db.execute("COMMIT")
+                        if progress is not None: progress(indexed, len(todo))
+                        self.db.execute("BEGIN")
+                self.db.execute("COMMIT")
+
+        gone = [row[0] for row in self.db.execute("SELECT path FROM files") if row[0] not in seen]
+        for rel in gone: self.forget(rel)
+        return indexed, len(gone)
+
+    def duplicate_groups(self, max_distance=0):
+        """
+        Groups of duplicates, best copy first (most pixels, then largest,
+        then oldest). With `max_distance` > 0 near duplicates are grouped
+        with exact ones: every group is built around its best copy, and an
+        image only joins if it is within `max_distance` bits of that copy,
+        so a chain of similar images doesn't pull in ones far apart.
+        """
+        rows = {row[0]: row[1:] for row in self.db.execute("SELECT path, size, mtime, sha256, dhash, pixels FROM files")}
+        best_first = lambda p: (-(rows[p][4] or 0), -rows[p][0], rows[p][1], len(p), p)
+        # Byte-identical files form one unit; units in best-first order.
+        units = {}
+        for path, row in rows.items(): units.setdefault(row[2], []).append(path)
+        units = sorted((sorted(paths, key=best_first) for paths in units.values()), key=lambda u: best_first(u[0]))
+        groups = [list(unit) for unit in units]
+
+        if max_distance:
+            # Same lookups as near(), against in-memory buckets instead of
+            # one query per file.
+            radius = max_distance // BANDS
+            values = {n: rows[unit[0]][3] & 0xFFFFFFFFFFFFFFFF for n, unit in enumerate(units)
+                      if rows[unit[0]][3] is not None}
+            values = {n: value for n, value in values.items() if informative(value)}
+            buckets = [{} for _ in range(BANDS)]
+            for n, value in values.items():
+                for i, band in enumerate(bands(value)): buckets[i].setdefault(band, []).append(n)
+            taken = set()
+            for n, value in values.items():  # best first, so the first unit of a group is its keeper
+                if n in taken: continue
+                candidates = set()
+                for i, band in enumerate(bands(value)):
+                    for probe in probes(band, radius): candidates.update(buckets[i].get(probe, ()))
+                for m in sorted(candidates):
+                    if m > n and m not in taken and distance(value, values[m]) <= max_distance:
+                        groups[n].extend(units[m])
+                        groups[m] = None
+                        taken.add(m)
+
+        return [[(p, rows[p][2]) for p in sorted(group, key=best_first)] for group in groups
+                if group is not None and len(group) > 1]
+
+
+def plan(groups, action=None):
+    """
+    (action, duplicate, keeper, reason) steps for the groups. Near (not
+    byte-identical) duplicates are never hardlinked, only moved or
+    reported.
+    """
+    steps = []
+    for group in groups:
+        keeper, keeper_hash = group[0]
+        for path, sha256 in group[1:]:
+            exact = sha256 == keeper_hash
+            if action == LINK and not exact: steps.append((None, path, keeper, "near"))
+            else: steps.append((action, path, keeper, "exact" if exact else "near"))
+    return steps
+
+
+def apply_plan(index, steps, aside_dir=None):
+    """Carries out a plan. Returns (files changed, bytes freed or moved)."""
+    library = index.library
+    aside_dir = aside_dir or default_aside_dir(library)
+    changed = freed = 0
+    removed = []
+    for action, rel, keeper, _ in steps:
+        if action is None: continue
+        path, target = os.path.join(library, rel), os.path.join(library, keeper)
+        try:
+            if action == LINK:
+                if os.path.samefile(path, target): continue
+                size = os.path.getsize(path)
+                tmp = f"{path}.link.tmp"
+                os.link(target, tmp)
+                os.replace(tmp, path)
+            else:
+                size = os.path.getsize(path)
+                dest = os.path.join(aside_dir, rel)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(path, dest)
+                index.forget(rel)
+                removed.append(rel)
+        except OSError as e:
+            print(f"warning: {rel}: {e}", file=sys.stderr)
+            continue
+        changed += 1
+        freed += size
+    manifest = os.path.join(library, MANIFEST_NAME)
+    if removed and os.path.exists(manifest):
+        now = round(time.time(), 3)
+        with open(manifest, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps({"op": "remove", "path": rel, "ts": now}, ensure_ascii=False) + "\n"
+                            for rel in removed))
+    return changed, freed
+
+
+def format_plan(steps):
+    """One line per step: action ("-" = report only), exact/near, duplicate == kept copy."""
+    return [f"{action or '-':<5} {reason:<5} {path}  ==  {keeper}" for action, path, keeper, reason in steps]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Find duplicate files in a library folder. Without --link/--move, only reports.")
+    parser.add_argument("library", help="library folder (the gallery-dl save folder)")
+    parser.add_argument("--near", type=int, default=0, metavar="BITS",
+                        help=f"also group images whose perceptual hashes differ in at most BITS bits "
+                             f"(needs Pillow; {DEFAULT_DISTANCE} is a good start, max {MAX_DISTANCE})")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--link", dest="action", action="store_const", const=LINK,
+                        help="replace exact duplicates by hardlinks to the kept copy (saves space)")
+    action.add_argument("--move", dest="action", action="store_const", const=MOVE,
+                        help="move duplicates to --aside-dir, keeping their subfolders")
+    parser.add_argument("--aside-dir", default="", metavar="DIR",
+                        help="where --move puts them (default: <library>.duplicates next to it)")
+    parser.add_argument("--dry-run", action="store_true", help="print what --link/--move would do")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="pool processes for hashing (default: all cores)")
+    args = parser.parse_args(argv)
+    if not 0 <= args.near <= MAX_DISTANCE: parser.error(f"--near must be between 0 and {MAX_DISTANCE}")
+    if args.near and not HAS_PIL: parser.error("--near needs Pillow (pip install pillow)")
+
+    index = LibraryIndex(args.library)
+    try:
+        indexed, removed = index.scan(args.jobs)
+        print(f"Indexed {indexed} new or changed files, dropped {removed} deleted ones.", file=sys.stderr)
+        steps = plan(index.duplicate_groups(args.near), args.action)
+        for line in format_plan(steps): print(line)
+        if args.action and not args.dry_run:
+            changed, size = apply_plan(index, steps, args.aside_dir)
+            verb = "Linked" if args.action == LINK else "Moved"
+            print(f"{verb} {changed} duplicates ({size / 1048576:.1f} MB).", file=sys.stderr)
+        else:
+            print(f"{len(steps)} duplicates found.", file=sys.stderr)
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
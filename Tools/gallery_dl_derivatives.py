@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Wallpaper-ready copies of downloaded images.
+
+For every still image that lands in the library, a process pool decodes it
+once and writes a downscaled, re-encoded copy per configured screen size
+(just large enough to cover the screen, never upscaled) plus a small
+thumbnail, into a folder next to the library:
+
+    D:\\Wallpapers.derivatives\\3840x2160\\artist\\12345.jpg
+    D:\\Wallpapers.derivatives\\thumbs\\artist\\12345.jpg
+
+A playlist can point straight at one of the size folders. An index in that
+folder remembers each source's mtime, size and SHA-256 and the settings it
+was rendered with, so unchanged files are skipped without being read, and
+touched-but-identical ones after one hash.
+
+Needs Pillow (pip install pillow). Run as a script to (re)build the
+copies for a whole library.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+try:
+    from PIL import Image, ImageOps
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+SOURCE_TYPES = (".jpg", ".jpeg", ".png", ".bmp", ".webp")  # stills only; GIFs and videos are left alone
+FORMATS = {"jpg": "JPEG", "webp": "WEBP"}
+ALPHA_FORMATS = ("webp",)  # keep transparency; the others get it flattened onto BACKGROUND
+BACKGROUND = (0, 0, 0)
+THUMBS = "thumbs"
+INDEX_NAME = "derivatives.sqlite"
+HASH_BLOCK = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path  TEXT PRIMARY KEY,  -- relative to the library
+    mtime REAL NOT NULL,
+    size  INTEGER NOT NULL,
+    hash  TEXT NOT NULL,
+    spec  TEXT NOT NULL      -- sizes/format the outputs were made with
+) WITHOUT ROWID;
+"""
+
+
+def default_derivative_dir(library):
+    library = os.path.abspath(library)
+    return os.path.join(os.path.dirname(library), os.path.basename(library) + ".derivatives")
+
+
+def parse_sizes(specs):
+    """["3840x2160", "2560x1440"] -> [(3840, 2160), (2560, 1440)]"""
+    sizes = []
+    for spec in specs:
+        width, sep, height = str(spec).lower().partition("x")
+        if not sep: raise ValueError(f"invalid size '{spec}' (expected WIDTHxHEIGHT)")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def output_name(rel, fmt):
+    """artist/1.jpg -> artist/1.jpg, artist/1.png -> artist/1.png.jpg (no clashes between formats)."""
+    return rel if rel.lower().endswith("." + fmt) else f"{rel}.{fmt}"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --- Pool side ---
+def lower_priority():
+    """Pool initializer: leave the CPU to downloads and the GUI when they need it."""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+            ctypes.windll.kernel32.SetPriorityClass(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    BELOW_NORMAL_PRIORITY_CLASS)
+        else:
+            os.nice(10)
+    except Exception:
+        pass
+
+
+def render(source, targets, thumb, fmt, quality, known_hash):
+    """
+    Runs in a pool process. `targets` maps output path -> (width, height) to
+    cover; `thumb` is (output path, edge) or None. If the file's hash equals
+    `known_hash` and all outputs exist, nothing is rendered. Returns
+    (hash, number of files written).
+    """
+    digest = file_hash(source)
+    outputs = list(targets) + ([thumb[0]] if thumb else [])
+    if digest == known_hash and all(os.path.exists(path) for path in outputs):
+        return digest, 0
+
+    with Image.open(source) as image:
+        # Let the JPEG decoder downscale by a power of two while decoding
+        # when even the largest output needs far fewer pixels. Measured
+        # against the short side, so it holds before EXIF rotation too.
+        edges = [edge for size in targets.values() for edge in size] + ([thumb[1]] if thumb else [])
+        scale = max(edges) / min(image.width, image.height)
+        if scale < 1: image.draft("RGB", (int(image.width * scale) + 1, int(image.height * scale) + 1))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+            image = image.convert("RGBA")
+            if fmt not in ALPHA_FORMATS:
+                flat = Image.new("RGB", image.size, BACKGROUND)
+                flat.paste(image, mask=image.getchannel("A"))
+                image = flat
+        elif image.mode != "RGB": image = image.convert("RGB")
+
+        written = 0
+        for path, (width, height) in sorted(targets.items(), key=lambda item: -item[1][0] * item[1][1]):
+            scale = min(1.0, max(width / image.width, height / image.height))
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            copy = image if size == image.size else image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+            _save(copy, path, fmt, quality)
+            written += 1
+        if thumb:
+            copy = image.copy()
+            copy.thumbnail((thumb[1], thumb[1]), Image.LANCZOS, reducing_gap=2.0)
+            _save(copy, thumb[0], fmt, quality)
+            written += 1
+    return digest, written
+
+
+def _save(image, path, fmt, quality):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    image.save(tmp, FORMATS[fmt], quality=quality)
+    os.replace(tmp, path)
+
+
+# --- Engine side ---
+class DerivativePipeline:
+    """
+    Feeds library files to a process pool. submit() and the result handling
+    run on the event loop thread; only render() runs in the pool.
+    """
+    def __init__(self, library, out_dir="", sizes=(), thumb_size=320, fmt="jpg", quality=88, workers=None,
+                 on_result=None):
+        if not HAS_PIL: raise RuntimeError("Pillow is not installed (pip install pillow)")
+        if fmt not in FORMATS: raise ValueError(f"unsupported format '{fmt}'")
+        self.library = os.path.abspath(library)
+        self.out_dir = os.path.abspath(out_dir or default_derivative_dir(library))
+        self.sizes = parse_sizes(sizes)
+        self.thumb_size = max(0, int(thumb_size))
+        if not self.sizes and not self.thumb_size: raise ValueError("no screen sizes and no thumbnail: nothing to make")
+        self.fmt = fmt
+        self.quality = int(quality)
+        self.spec = json.dumps([self.sizes, self.thumb_size, fmt, self.quality])
+        self.on_result = on_result
+        self.rendered = 0
+        self.cached = 0
+        self.errors = 0
+        self._pending = set()
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.out_dir, INDEX_NAME), isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.pool = concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count(), initializer=lower_priority)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, path):
+        """Queues a file that just landed in the library; returns False if there's nothing to do."""
+        if not path.lower().endswith(SOURCE_TYPES): return False
+        rel = os.path.relpath(path, self.library)
+        if rel.startswith(os.pardir): return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        row = self.db.execute("SELECT mtime, size, hash, spec FROM sources WHERE path = ?", (rel,)).fetchone()
+        if row and row[0] == st.st_mtime and row[1] == st.st_size and row[3] == self.spec:
+            self.cached += 1
+            return False
+
+        name = output_name(rel, self.fmt)
+        targets = {os.path.join(self.out_dir, f"{w}x{h}", name): (w, h) for w, h in self.sizes}
+        thumb = (os.path.join(self.out_dir, THUMBS, name), self.thumb_size) if self.thumb_size else None
+        known_hash = row[2] if row and row[3] == self.spec else None
+        future = asyncio.get_running_loop().run_in_executor(
+            self.pool, render, path, targets, thumb, self.fmt, self.quality, known_hash)
+        self._pending.add(future)
+        future.add_done_callback(lambda f: self._done(f, rel, path, st))
+        return True
+
+    def _done(self, future, rel, path, st):
+        self._pending.discard(future)
+        if future.cancelled(): return
+        try:
+            digest, written = future.result()
+        except Exception as e:
+            self.errors += 1
+            if self.on_result is not None: self.on_result(path, 0, f"{e.__class__.__name__}: {e}")
+            return
+        self.db.execute("INSERT OR REPLACE INTO sources (path, mtime, size, hash, spec) VALUES (?, ?, ?, ?, ?)",
+                        (rel, st.st_mtime, st.st_size, digest, self.spec))
+        if written: self.rendered += 1
+        else: self.cached += 1
+        if self.on_result is not None: self.on_result(path, written, None)
+
+    async def close(self, cancel=False):
+        """Waits for the queued files (or drops them with `cancel`) and shuts the pool down."""
+        loop = asyncio.get_running_loop()
+        if cancel:
+            for future in list(self._pending): future.cancel()
+        elif self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        await loop.run_in_executor(None, self.pool.shutdown, True)
+        self.db.close()
+
+    def stats(self):
+        return {"derived": self.rendered, "derivatives_cached": self.cached, "derivative_errors": self.errors}
+
+
+def iter_library(library):
+    for root, _, files in os.walk(library):
+        for name in files:
+            if name.lower().endswith(SOURCE_TYPES): yield os.path.join(root, name)
+
+
+async def build_all(args):
+    def report(path, written, error):
+        if error: print(f"error: {path}: {error}", file=sys.stderr)
+
+    pipeline = DerivativePipeline(args.library, args.out, args.size, args.thumb, args.format, args.quality,
+                                  args.jobs, on_result=report)
+    try:
+        for path in iter_library(pipeline.library):
+            pipeline.submit(path)
+            if len(pipeline) >= 4 * (args.jobs or os.cpu_count()):
+                await asyncio.wait(set(pipeline._pending), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        await pipeline.close()
+    return pipeline.stats()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build resized wallpaper copies and thumbnails for a library folder; "
+                    "files that haven't changed since the last run are skipped.")
+    parser.add_argument("library", help="library folder (the gallery-dl save folder)")
+    parser.add_argument("-s", "--size", action="append", default=[], metavar="WxH",
+                        help="screen size to make copies for; may be repeated")
+    parser.add_argument("--thumb", type=int, default=320, metavar="PX", help="thumbnail edge, 0 = none (default: 320)")
+    parser.add_argument("-o", "--out", default="", help="output folder (default: <library>.derivatives next to it)")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="jpg")
+    parser.add_argument("--quality", type=int, default=88)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="pool processes (default: all cores)")
+    args = parser.parse_args(argv)
+    try:
+        stats = asyncio.run(build_all(args))
+    except (RuntimeError, ValueError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    print(json.dumps(stats))
+    return 1 if stats["derivative_errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
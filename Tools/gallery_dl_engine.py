@@ -0,0 +1,1476 @@
+#!/usr/bin/env python3
+"""
+Headless batch engine for gallery-dl.
+
+Runs a list of URLs through gallery-dl and reports everything that happens
+as events (plain dicts with an "event" key). All child processes are driven
+from a single asyncio event loop with non-blocking pipe reads, so the number
+of concurrent downloads is limited by `max_workers`, not by OS threads.
+URLs are pulled from their source in chunks and only a bounded window of
+them is queued at any time, so a batch of a million URLs starts as fast and
+needs as little memory as a batch of ten.
+The Tk window in gallery-dl-gui.py is one consumer of these events; the
+command line entry point at the bottom prints them as JSON lines so batches
+can run from cron or over SSH without a display.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import random
+import re
+import shlex
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from gallery_dl_bandwidth import BandwidthSchedule, BandwidthShaper, parse_schedule_specs
+from gallery_dl_config import MAX_WORKERS_LIMIT
+from gallery_dl_dedup import DEFAULT_DISTANCE, MAX_DISTANCE, LibraryIndex, fingerprint
+from gallery_dl_derivatives import DerivativePipeline
+from gallery_dl_journal import JOURNAL_FILE, JobJournal, DONE, FAILED, PARKED, FINISHED, STOPPED
+from gallery_dl_metrics import BatchMetrics, parse_size, write_textfile
+from gallery_dl_publish import ARCHIVE_NAME, Publisher, adopt_archive, default_staging_dir
+from gallery_dl_trace import BatchTrace, format_summary
+from gallery_dl_worker import WorkerPool, WorkerStartError
+
+# --- Configuration ---
+GALLERY_DL = "gallery-dl"
+# gallery-dl exit status is a bitmask of its exception codes.
+EXIT_ERROR = 1
+EXIT_HTTP_ERROR = 4
+EXIT_NOT_FOUND = 8
+EXIT_AUTH_ERROR = 16
+EXIT_FORMAT_ERROR = 32
+EXIT_NO_EXTRACTOR = 64
+EXIT_OS_ERROR = 128
+# Exit bits that retrying won't fix: missing content, unsupported URL,
+# bad credentials, broken filename format.
+EXIT_PERMANENT = EXIT_NOT_FOUND | EXIT_NO_EXTRACTOR | EXIT_AUTH_ERROR | EXIT_FORMAT_ERROR
+
+# Error output that means the site wants us to slow down.
+THROTTLE_PATTERN = re.compile(r"\b429\b|too many requests|rate.?limit|\b503\b", re.IGNORECASE)
+# Error output that means the URL will never work (403: private, or needs login).
+PERMANENT_PATTERN = re.compile(r"unsupported url|\b403\b|forbidden|\b404\b|not found|\b410\b|\bgone\b|"
+                               r"no suitable extractor", re.IGNORECASE)
+# Log prefixes of errors about a single file; the rest of the URL may still work.
+FILE_ERROR = ("[download]", "[downloader.")
+
+# gallery-dl can print very long lines (JSON dumps, data: URLs); the asyncio
+# default of 64 KiB would abort the read.
+PIPE_LINE_LIMIT = 1024 * 1024
+# Seconds between journal flushes while a batch runs.
+JOURNAL_FLUSH_INTERVAL = 1.0
+# URLs read from the input (and journaled) in one go.
+FEED_CHUNK = 500
+# Seconds a stopped gallery-dl process gets to exit before it is killed.
+STOP_GRACE = 10.0
+
+# Archive modes. "shared": every gallery-dl run commits each file to
+# archive.sqlite on its own, so concurrent workers queue up on the write
+# lock. "deferred": a run keeps its new entries in memory and commits them
+# in one transaction when it ends, and the archive uses WAL so lookups
+# don't wait for those commits. The file stays a normal gallery-dl archive.
+ARCHIVE_SHARED = "shared"
+ARCHIVE_DEFERRED = "deferred"
+ARCHIVE_MODES = (ARCHIVE_DEFERRED, ARCHIVE_SHARED)
+DEFERRED_ARCHIVE_ARGS = ["-o", "archive-mode=memory",
+                         "-o", 'archive-pragma=["journal_mode=WAL","synchronous=NORMAL"]']
+
+# Structured output: gallery-dl's custom output mode prints one line per
+# file event, tagged with a NUL so it can't be mistaken for a log line or a
+# path. Progress ("P downloaded rate [total]") is only printed for files
+# that take longer than gallery-dl's "progress" threshold (3 s).
+FILE_EVENT = "\x00"
+FILE_STARTED, FILE_FINISHED, FILE_SKIPPED, FILE_PROGRESS = "SFKP"
+STRUCTURED_OUTPUT_ARGS = ["-o", "output.shorten=false", "-o", "output.mode=" + json.dumps({
+    "start": FILE_EVENT + FILE_STARTED + " {}\n",
+    "success": FILE_EVENT + FILE_FINISHED + " {}\n",
+    "skip": FILE_EVENT + FILE_SKIPPED + " {}\n",
+    "progress": FILE_EVENT + FILE_PROGRESS + " {0} {1}\n",
+    "progress-total": FILE_EVENT + FILE_PROGRESS + " {0} {1} {2}\n",
+})]
+# Seconds between "metrics" events (and metrics file writes).
+METRICS_INTERVAL = 1.0
+# Seconds between checks while a download waits for bandwidth.
+BANDWIDTH_RECHECK = 1.0
+# Staged downloads are moved into the library this often, or as soon as
+# this many files are waiting.
+PUBLISH_INTERVAL = 5.0
+PUBLISH_BATCH = 200
+
+
+def get_startup_info():
+    """Hides the console window of child processes on Windows."""
+    if sys.platform == 'win32':
+        si = subprocess.STARTUPINFO()
+        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        return si
+    return None
+
+
+def get_process_group_kwargs():
+    """Starts a child in its own process group so it can be stopped together with its children."""
+    if sys.platform == 'win32':
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def terminate_tree(process, force=False):
+    """
+    Asks a gallery-dl process and everything it spawned to exit (SIGTERM,
+    Ctrl+Break on Windows), or with `force` kills them outright.
+    """
+    try:
+        if sys.platform == 'win32':
+            if force:
+                subprocess.Popen(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                 startupinfo=get_startup_info())
+            else:
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+    except OSError:
+        pass  # already gone
+
+
+class BatchOptions:
+    """
+    Everything a batch needs to know besides the URLs themselves.
+
+    Politeness: at most `per_host_workers` downloads run against one host at
+    a time (0 = no cap) and consecutive starts on a host are spaced at least
+    `host_delay` seconds apart. `host_limits` overrides both per domain, e.g.
+    {"pixiv.net": {"workers": 1, "delay": 2.0}}; an entry also covers its
+    subdomains (i.pximg.net is matched by "pximg.net").
+
+    With `adaptive` set, those caps become ceilings: each host starts at one
+    download and its concurrency is raised while downloads succeed and
+    halved when the site throttles (see AdaptiveLimit).
+
+    Failures classified as transient are retried up to `max_retries` times
+    after a jittered exponential delay starting at `retry_delay` seconds;
+    permanent ones (404, unsupported URL, ...) are parked right away.
+
+    At most `window` URLs (never fewer than `max_workers`) are queued ahead
+    of the workers; the rest stay unread in the input until there is room.
+
+    With `persistent` set, URLs run in long-lived `python` processes that
+    import gallery-dl once (see gallery_dl_worker) instead of a new
+    `executable` per URL. A worker is replaced after `recycle_jobs` URLs or
+    once it uses more than `recycle_mb` MB.
+
+    `archive_mode` (ARCHIVE_DEFERRED or ARCHIVE_SHARED) decides how the runs
+    of a batch write to the archive when `use_archive` is set.
+
+    With `structured_output` set, gallery-dl reports every file it starts,
+    finishes or skips in a machine-readable form (see STRUCTURED_OUTPUT_ARGS)
+    that feeds the batch's BatchMetrics; `metrics_file` receives a snapshot
+    of them every METRICS_INTERVAL seconds (JSON for *.json, else Prometheus
+    text format).
+
+    `bandwidth_limit` (e.g. "4M", bytes/s) caps the whole batch, and
+    `bandwidth_schedule` rules can change it by time of day (see
+    gallery_dl_bandwidth); each download gets a share via --limit-rate.
+
+    With `staging`, gallery-dl downloads into `staging_dir` (default: a
+    sibling of `dest`, see gallery_dl_publish) and finished files are moved
+    into `dest` in batches, each recorded in the library manifest. The
+    archive is then always used, since gallery-dl can't see which files
+    `dest` already has, and kept in the staging folder, out of the watched
+    library.
+
+    With `derivatives`, every still image that lands in `dest` is also
+    rendered by a process pool into a downscaled copy per screen size in
+    `derivative_sizes` (["3840x2160", ...]) and a `thumbnail_size` px
+    thumbnail (0 = none), in `derivative_format`, under `derivative_dir`
+    (default: <dest>.derivatives next to it, see gallery_dl_derivatives).
+    Files are picked up from the per-file events, so it needs
+    `structured_output` or `staging`.
+
+    With `dedup`, every file that lands in `dest` is hashed (SHA-256, plus a
+    perceptual hash for images when Pillow is there) into the library's
+    duplicate index (see gallery_dl_dedup), and a "duplicate" event names
+    the files it duplicates exactly or within `dedup_distance` bits. Nothing
+    is deleted; gallery_dl_dedup cleans up.
+
+    With a `trace_file`, every URL's phases (queue wait, spawn, startup,
+    extraction, downloads, exit) are timed and saved there as a Chrome
+    trace when the batch ends (see gallery_dl_trace).
+
+    With `skip_fresh` > 0, URLs that completed within that many hours (per
+    the journal's history) are left out of a new batch before any download
+    starts; it needs a journal.
+
+    With `abort_after` > 0, gallery-dl stops walking a gallery once that
+    many files in a row were already downloaded (--abort), so a re-run only
+    fetches what is new; subscription syncs use it (see
+    gallery_dl_subscriptions).
+    """
+    def __init__(self, dest, cookies="", flatten=True, use_archive=False,
+                 extra_args="", max_workers=4, executable=GALLERY_DL,
+                 per_host_workers=2, host_delay=0.0, host_limits=None,
+                 adaptive=False, max_retries=3, retry_delay=5.0, retry_max_delay=300.0,
+                 window=1000, persistent=False, python=sys.executable, recycle_jobs=200, recycle_mb=512,
+                 skip_fresh=0.0, archive_mode=ARCHIVE_DEFERRED, structured_output=True, metrics_file="",
+                 trace_file="", bandwidth_limit="", bandwidth_schedule=None, staging=False, staging_dir="",
+                 derivatives=False, derivative_sizes=None, thumbnail_size=320, derivative_dir="",
+                 derivative_format="jpg", dedup=False, dedup_distance=DEFAULT_DISTANCE, abort_after=0):
+        self.dest = dest
+        self.cookies = cookies
+        self.flatten = flatten
+        self.use_archive = use_archive
+        self.extra_args = extra_args
+        self.max_workers = min(MAX_WORKERS_LIMIT, max(1, int(max_workers)))
+        self.executable = executable
+        self.per_host_workers = max(0, int(per_host_workers))
+        self.host_delay = max(0.0, float(host_delay))
+        self.host_limits = dict(host_limits or {})
+        self.adaptive = bool(adaptive)
+        self.max_retries = max(0, int(max_retries))
+        self.retry_delay = max(0.0, float(retry_delay))
+        self.retry_max_delay = max(self.retry_delay, float(retry_max_delay))
+        self.window = max(self.max_workers, int(window))
+        self.persistent = bool(persistent)
+        self.python = python
+        self.recycle_jobs = max(1, int(recycle_jobs))
+        self.recycle_mb = max(1, int(recycle_mb))
+        self.skip_fresh = max(0.0, float(skip_fresh))
+        self.archive_mode = archive_mode if archive_mode in ARCHIVE_MODES else ARCHIVE_DEFERRED
+        self.structured_output = bool(structured_output)
+        self.metrics_file = metrics_file
+        self.trace_file = trace_file
+        self.bandwidth_limit = bandwidth_limit or ""
+        self.bandwidth_schedule = list(bandwidth_schedule or [])
+        self.staging = bool(staging)
+        self.staging_dir = staging_dir or ""
+        self.derivatives = bool(derivatives)
+        self.derivative_sizes = list(derivative_sizes or [])
+        self.thumbnail_size = max(0, int(thumbnail_size))
+        self.derivative_dir = derivative_dir or ""
+        self.derivative_format = derivative_format
+        self.dedup = bool(dedup)
+        self.dedup_distance = min(MAX_DISTANCE, max(0, int(dedup_distance)))
+        self.abort_after = max(0, int(abort_after))
+
+    @property
+    def download_dir(self):
+        """Where gallery-dl writes: the staging folder or `dest` itself."""
+        if not self.staging: return self.dest
+        return self.staging_dir or default_staging_dir(self.dest)
+
+    @property
+    def archive_path(self):
+        """archive.sqlite in `dest`, or in the staging folder while staging."""
+        return os.path.join(self.download_dir, ARCHIVE_NAME)
+
+    def retry_backoff(self, attempt):
+        """Jittered exponential delay before retry number `attempt` (1-based)."""
+        delay = min(self.retry_max_delay, self.retry_delay * (2 ** (attempt - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def to_dict(self):
+        """Constructor kwargs, JSON-serializable (stored with journaled batches)."""
+        return dict(vars(self))
+
+    def host_policy(self, host):
+        """Returns (max concurrent, min spacing in seconds) for a host."""
+        workers, delay = self.per_host_workers, self.host_delay
+        parts = host.split(".")
+        for i in range(len(parts)):
+            entry = self.host_limits.get(".".join(parts[i:]))
+            if entry is not None:
+                workers = int(entry.get("workers", workers))
+                delay = float(entry.get("delay", delay))
+                break
+        return (workers if workers > 0 else self.max_workers), delay
+
+    @classmethod
+    def from_settings(cls, settings, **overrides):
+        """Builds options from a GUI settings dict (see DEFAULT_SETTINGS)."""
+        kwargs = {
+            "dest": settings.get("save_dir", ""),
+            "cookies": settings.get("cookies_path", ""),
+            "flatten": settings.get("flatten_folder", True),
+            "use_archive": settings.get("use_archive", False),
+            "extra_args": settings.get("extra_args", ""),
+            "max_workers": settings.get("max_workers", 4),
+            "per_host_workers": settings.get("per_host_workers", 2),
+            "host_delay": settings.get("host_delay", 0.0),
+            "host_limits": settings.get("host_limits", {}),
+            "adaptive": settings.get("adaptive_workers", False),
+            "max_retries": settings.get("max_retries", 3),
+            "retry_delay": settings.get("retry_delay", 5.0),
+            "window": settings.get("queue_window", 1000),
+            "persistent": settings.get("persistent_workers", False),
+            "recycle_jobs": settings.get("recycle_jobs", 200),
+            "recycle_mb": settings.get("recycle_mb", 512),
+            "skip_fresh": settings.get("skip_fresh_hours", 24.0) if settings.get("use_archive") else 0.0,
+            "archive_mode": settings.get("archive_mode", ARCHIVE_DEFERRED),
+            "structured_output": settings.get("structured_output", True),
+            "metrics_file": settings.get("metrics_file", ""),
+            "trace_file": settings.get("trace_file", ""),
+            "bandwidth_limit": settings.get("bandwidth_limit", ""),
+            "bandwidth_schedule": settings.get("bandwidth_schedule", []),
+            "staging": settings.get("staged_publish", False),
+            "staging_dir": settings.get("staging_dir", ""),
+            "derivatives": settings.get("derivatives", False),
+            "derivative_sizes": settings.get("derivative_sizes", []),
+            "thumbnail_size": settings.get("thumbnail_size", 320),
+            "derivative_dir": settings.get("derivative_dir", ""),
+            "derivative_format": settings.get("derivative_format", "jpg"),
+            "dedup": settings.get("dedup_index", False),
+            "dedup_distance": settings.get("dedup_distance", DEFAULT_DISTANCE),
+        }
+        kwargs.update(overrides)
+        return cls(**kwargs)
+
+
+def build_command(url, options, rate=None):
+    """
+    Returns the gallery-dl argv for one URL, limited to `rate` bytes/s if
+    given. Raises ValueError on bad extra args.
+    """
+    cmd = [options.executable, "--dest", options.download_dir]
+    if options.flatten: cmd.extend(["--directory", "."])
+    if options.cookies and os.path.exists(options.cookies): cmd.extend(["--cookies", options.cookies])
+
+    if options.use_archive or options.staging:
+        cmd.extend(["--download-archive", options.archive_path])
+        if options.archive_mode == ARCHIVE_DEFERRED: cmd.extend(DEFERRED_ARCHIVE_ARGS)
+    if options.structured_output: cmd.extend(STRUCTURED_OUTPUT_ARGS)
+    if options.abort_after: cmd.extend(["--abort", str(options.abort_after)])
+    if rate: cmd.extend(["--limit-rate", str(rate)])
+
+    if options.extra_args:
+        cmd.extend(shlex.split(options.extra_args))
+
+    cmd.append(url)
+    return cmd
+
+
+def read_url_lines(lines):
+    """Yields stripped, non-empty, non-comment lines."""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def host_of(url):
+    """Scheduling key for a URL: its lowercase hostname without "www."."""
+    try:
+        host = urlsplit(url).hostname or ""
+    except ValueError:
+        host = ""
+    return host[4:] if host.startswith("www.") else host
+
+
+class JobResult:
+    """Outcome of one gallery-dl run, as seen by the scheduler."""
+    __slots__ = ("url", "ok", "returncode", "throttled", "gone", "unstartable", "interrupted", "rebalanced", "started",
+                 "finished", "message", "items")
+
+    def __init__(self, url, ok=False, returncode=None, throttled=False, started=0.0, finished=0.0, message=""):
+        self.url = url
+        self.ok = ok
+        self.returncode = returncode
+        self.throttled = throttled
+        self.gone = False  # output said the URL does not exist / is unsupported
+        self.unstartable = False  # the gallery-dl executable is missing or not executable
+        self.interrupted = False  # terminated by stop()
+        self.rebalanced = False  # terminated to restart under a lowered bandwidth limit
+        self.started = started
+        self.finished = finished
+        self.message = message
+        self.items = 0  # files gallery-dl reported, downloaded or already present
+
+    @property
+    def permanent(self):
+        """True if retrying this failure is pointless."""
+        if self.ok or self.throttled: return False
+        if self.unstartable: return True
+        # None: the engine failed around the run; negative: killed by a signal (OOM, crash, outside kill)
+        if self.returncode is None or self.returncode < 0: return False
+        return bool(self.returncode & EXIT_PERMANENT) or self.gone
+
+
+class AdaptiveLimit:
+    """
+    Additive-increase/multiplicative-decrease concurrency limit for one host.
+
+    Starts in slow start (+1 per success, i.e. doubling per round) until the
+    first throttle, then grows by one slot per `limit` successes. A throttle
+    halves the limit, but only once per round: results from jobs that were
+    already running when the limit was last cut are ignored, so one burst
+    of 429s doesn't collapse the limit to 1.
+    """
+    def __init__(self, ceiling, start=1, backoff=0.5):
+        self.ceiling = max(1, ceiling)
+        self.limit = float(min(start, self.ceiling))
+        self.backoff = backoff
+        self.slow_start = True
+        self.cut_at = 0.0
+
+    @property
+    def value(self):
+        return max(1, min(self.ceiling, int(self.limit)))
+
+    def record(self, result):
+        """Feeds one job result in; returns True when `value` changed."""
+        before = self.value
+        if result.throttled:
+            if result.started >= self.cut_at:
+                self.limit = max(1.0, self.limit * self.backoff)
+                self.slow_start = False
+                self.cut_at = time.monotonic()
+        elif result.ok:
+            self.limit += 1.0 if self.slow_start else 1.0 / self.limit
+            self.limit = min(self.limit, float(self.ceiling))
+        return self.value != before
+
+
+class _HostState:
+    __slots__ = ("name", "queue", "active", "cap", "delay", "next_at", "adaptive", "penalty")
+
+    def __init__(self, name, cap, delay, adaptive=False):
+        self.name = name
+        self.queue = collections.deque()
+        self.active = 0
+        self.cap = cap
+        self.delay = delay
+        self.next_at = 0.0
+        self.adaptive = AdaptiveLimit(cap) if adaptive else None
+        self.penalty = 0.0  # extra cool-off after throttling, doubles while it persists
+
+    @property
+    def limit(self):
+        return self.adaptive.value if self.adaptive is not None else self.cap
+
+
+class HostScheduler:
+    """
+    Hands out queued URLs so that no host exceeds its concurrency cap or
+    request spacing, rotating between hosts so one big site can't starve
+    the others. Only used from the event loop thread.
+
+    While `feeding` is set more URLs are on their way, so acquire() keeps
+    waiting even when the queue runs dry.
+    """
+    def __init__(self, options):
+        self.options = options
+        self.hosts = {}
+        self._ring = collections.deque()  # hosts with queued URLs, round-robin order
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()  # set when a queued URL was handed out
+        self._timers = set()  # retries waiting for their backoff to expire
+        self.queued = 0
+        self.running = 0
+        self.feeding = False
+        self.closed = False
+
+    def put(self, url):
+        host = host_of(url)
+        state = self.hosts.get(host)
+        if state is None:
+            cap, delay = self.options.host_policy(host)
+            state = self.hosts[host] = _HostState(host, cap, delay, self.options.adaptive)
+        if not state.queue: self._ring.append(state)
+        state.queue.append(url)
+        self.queued += 1
+        self._wakeup.set()
+
+    async def wait_for_room(self, window):
+        """Waits until fewer than `window` URLs are queued (or the scheduler is closed)."""
+        while self.queued >= window and not self.closed:
+            self._room.clear()
+            await self._room.wait()
+
+    def end_input(self):
+        """No more URLs will be put(), apart from retries."""
+        self.feeding = False
+        self._wakeup.set()
+
+    def put_later(self, url, delay):
+        """Queues `url` again after `delay` seconds (a retry)."""
+        def fire():
+            self._timers.discard(timer)
+            if not self.closed: self.put(url)
+        timer = asyncio.get_running_loop().call_later(delay, fire)
+        self._timers.add(timer)
+
+    def release(self, url, result=None):
+        """Frees the URL's host slot. Returns the host state if its limit changed."""
+        state = self.hosts.get(host_of(url))
+        self.running -= 1
+        self._wakeup.set()
+        if state is None: return None
+        state.active -= 1
+        if result is None or state.adaptive is None: return None
+
+        if result.throttled:
+            state.penalty = min(60.0, state.penalty * 2 or 1.0)
+            state.next_at = max(state.next_at, time.monotonic() + state.penalty)
+        elif result.ok:
+            state.penalty = 0.0
+        return state if state.adaptive.record(result) else None
+
+    def close(self):
+        """Wakes every waiting worker and makes acquire() return None."""
+        self.closed = True
+        for timer in self._timers: timer.cancel()
+        self._wakeup.set()
+        self._room.set()
+
+    def waiting_retries(self):
+        return len(self._timers)
+
+    def _pick(self):
+        """Returns (url, None) or (None, seconds until a spaced host opens up)."""
+        now = time.monotonic()
+        wait = None
+        for _ in range(len(self._ring)):
+            state = self._ring[0]
+            self._ring.rotate(-1)
+            if state.active >= state.limit: continue
+            if now < state.next_at:
+                left = state.next_at - now
+                if wait is None or left < wait: wait = left
+                continue
+            url = state.queue.popleft()
+            if not state.queue: self._ring.remove(state)
+            self.queued -= 1
+            self._room.set()
+            state.active += 1
+            self.running += 1
+            state.next_at = now + state.delay
+            return url, None
+        return None, wait
+
+    async def acquire(self):
+        """
+        Waits for the next URL that may start now. Returns None once the input
+        is exhausted, the queue is drained and nothing is running or waiting
+        to be retried.
+        """
+        while not self.closed:
+            url, wait = self._pick()
+            if url is not None: return url
+            if not self._ring and not self.running and not self._timers and not self.feeding: return None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+
+class BatchEngine:
+    """
+    Downloads a batch of URLs and reports progress through `on_event`.
+
+    `run()` blocks the calling thread while it drives an asyncio loop; every
+    event is delivered on that thread with a single dict argument, e.g.
+    {"event": "url_finished", "url": ..., "worker": "W_0", "ok": True, ...}.
+    `stop()` may be called from any thread.
+
+    With a `journal_path` every URL's state is recorded in a JobJournal;
+    `run(resume=batch_id)` picks up the queued and interrupted URLs of an
+    earlier batch instead of starting a new one.
+
+    A stop cancels everything that hasn't started and terminates the running
+    gallery-dl processes; whatever is still alive `stop_grace` seconds later
+    is killed along with its children, so run() returns within that bound.
+    """
+    def __init__(self, options, on_event=None, journal_path=None, stop_grace=STOP_GRACE):
+        self.options = options
+        self.on_event = on_event
+        self.journal_path = journal_path
+        self.stop_grace = max(0.0, float(stop_grace))
+        self.stop_requested = False
+        self.hard_stop = False
+        self.failed_urls = []
+        self.parked_urls = []
+        self.interrupted_urls = []
+        self._processes = {}  # url -> running gallery-dl process
+        self._pool = None
+        self._kill_timer = None
+        self.batch_id = None
+        self._loop = None
+        self._scheduler = None
+        self._journal = None
+        self.metrics = None
+        self.trace = None  # BatchTrace while a traced batch runs; the GUI adds its own spans
+        self._timelines = {}  # worker -> JobTimeline of its current URL
+        self._queued_at = {}  # url -> when it entered the scheduler (traced batches only)
+        self._shaper = None
+        self._rebalancing = set()  # URLs terminated to restart with a smaller bandwidth share
+        self._publisher = None
+        self._derivatives = None
+        self._index = None
+        self._indexing = set()  # fingerprints being computed
+
+    def emit(self, kind, **fields):
+        if self.on_event is None: return
+        event = {"event": kind, "ts": round(time.time(), 3)}
+        event.update(fields)
+        try:
+            self.on_event(event)
+        except Exception:
+            pass  # a broken consumer must never take down a batch
+
+    def stop(self, hard=False):
+        """
+        Stops the batch. Running downloads are terminated and get `stop_grace`
+        seconds to exit; with `hard` (or on a second call with hard=True)
+        they are killed right away.
+        """
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self._request_stop, hard)
+        else:
+            self._request_stop(hard)
+
+    def _request_stop(self, hard=False):
+        if self.hard_stop or (self.stop_requested and not hard): return
+        if not self.stop_requested:
+            self.stop_requested = True
+            if self._scheduler is not None: self._scheduler.close()
+        self.hard_stop = hard
+        self.emit("stop_requested", hard=hard, running=len(self._processes))
+
+        for process in list(self._processes.values()):
+            terminate_tree(process, force=hard)
+        if not hard and self._processes and self._loop is not None:
+            self._kill_timer = self._loop.call_later(self.stop_grace, self._request_stop, True)
+
+    def run(self, urls=(), resume=None):
+        """Runs the batch to completion (blocking) and returns a summary dict."""
+        return asyncio.run(self.run_async(urls, resume))
+
+    async def run_async(self, urls=(), resume=None):
+        """
+        `urls` may be any iterable, including a generator over a huge file;
+        it is consumed lazily on a reader thread, never all at once. It may
+        also be an async iterable of URL lists, consumed on the loop as the
+        window has room (see gallery_dl_cluster).
+        """
+        self._loop = asyncio.get_running_loop()
+        self.stop_requested = False
+        self.hard_stop = False
+        self.failed_urls = []
+        self.parked_urls = []
+        self.interrupted_urls = []
+        self._attempts = {}
+        self._total = 0
+        self._completed = 0
+        self._skipped = 0
+        self._duplicates = 0
+        self._input_done = False
+        self.metrics = BatchMetrics()
+        self.trace = BatchTrace() if self.options.trace_file else None
+        self._timelines = {}
+        self._queued_at = {}
+        self._rebalancing = set()
+        started = time.time()
+
+        journal = self._journal = JobJournal(self.journal_path) if self.journal_path else None
+        if journal is not None:
+            if resume is not None:
+                self.batch_id = resume
+                self.failed_urls = journal.failed_urls(resume)
+                self.parked_urls = journal.parked_urls(resume)
+                counts = journal.counts(resume)
+                self._total = sum(counts.values())
+                self._completed = counts.get(DONE, 0) + counts.get(FAILED, 0) + counts.get(PARKED, 0)
+                self.metrics.completed, self.metrics.total = self._completed, self._total
+            else:
+                self.batch_id = journal.create_batch((), self.options.to_dict())
+
+        workers = self.options.max_workers
+        if resume is not None: workers = min(workers, self._total - self._completed) or 1
+        batch_info = {"total": self._total if resume is not None else None, "workers": workers,
+                      "batch_id": self.batch_id, "resumed": resume is not None, "completed": self._completed}
+
+        # Validate extra args once instead of failing every URL separately.
+        try:
+            if self.options.extra_args: shlex.split(self.options.extra_args)
+        except ValueError:
+            self.emit("batch_started", **batch_info)
+            self.emit("error", message="Error: Invalid Extra Args syntax (mismatched quotes?)")
+            self.stop_requested = True  # leaves the batch resumable once the args are fixed
+            return self._finish(started)
+        try:
+            schedule = BandwidthSchedule(self.options.bandwidth_limit, self.options.bandwidth_schedule)
+        except (ValueError, KeyError, TypeError) as e:
+            self.emit("batch_started", **batch_info)
+            self.emit("error", message=f"Error: Invalid bandwidth limit or schedule: {e}")
+            self.stop_requested = True
+            return self._finish(started)
+        self._shaper = BandwidthShaper(schedule, self.options.max_workers) if schedule else None
+        if self.options.staging:
+            try:
+                self._publisher = Publisher(self.options.dest, self.options.download_dir)
+                adopt_archive(self.options.dest, self.options.download_dir)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                self.emit("batch_started", **batch_info)
+                self.emit("error", message=f"Error: Cannot use the staging folder: {e}")
+                self.stop_requested = True
+                return self._finish(started)
+        if self.options.derivatives:
+            try:
+                self._derivatives = DerivativePipeline(
+                    self.options.dest, self.options.derivative_dir, self.options.derivative_sizes,
+                    self.options.thumbnail_size, self.options.derivative_format, on_result=self._derived)
+            except (RuntimeError, ValueError, OSError, sqlite3.Error) as e:
+                self.emit("batch_started", **batch_info)
+                self.emit("error", message=f"Error: Cannot start the derivative pipeline: {e}")
+                self.stop_requested = True
+                return self._finish(started)
+        if self.options.dedup:
+            try:
+                os.makedirs(self.options.dest, exist_ok=True)
+                self._index = LibraryIndex(self.options.dest)
+            except (OSError, sqlite3.Error) as e:
+                self.emit("batch_started", **batch_info)
+                self.emit("error", message=f"Error: Cannot open the duplicate index: {e}")
+                self.stop_requested = True
+                return self._finish(started)
+
+        scheduler = self._scheduler = HostScheduler(self.options)
+        scheduler.feeding = True
+        pool = None
+        if self.options.persistent:
+            pool = self._pool = WorkerPool(
+                self.options.python, self.options.recycle_jobs, self.options.recycle_mb,
+                spawn_kwargs=dict(startupinfo=get_startup_info(), **get_process_group_kwargs()),
+                line_limit=PIPE_LINE_LIMIT)
+        self.emit("batch_started", **batch_info)
+        if self._shaper is not None: self.emit("bandwidth", limit=self._shaper.limit)
+
+        if resume is not None:
+            feeder = self._feed(scheduler, self._chunks(journal.iter_pending_urls(resume)), new=False)
+        else:
+            chunks = urls if hasattr(urls, "__aiter__") else self._read_ahead(urls)
+            feeder = self._feed(scheduler, chunks, new=True)
+        feeder = asyncio.ensure_future(feeder)
+        flusher = asyncio.ensure_future(self._flush_journal()) if journal is not None else None
+        reporter = asyncio.ensure_future(self._report_metrics())
+        publisher = self._publisher
+        derivatives = self._derivatives
+        publishing = asyncio.ensure_future(self._publish_loop()) if publisher is not None else None
+        try:
+            await asyncio.gather(*(self._worker(f"W_{n}", scheduler) for n in range(workers)))
+        finally:
+            feeder.cancel()
+            reporter.cancel()
+            if publishing is not None:
+                publishing.cancel()
+                await self._publish(sweep=True)
+                self._publisher = None
+            if derivatives is not None:
+                await derivatives.close(cancel=self.stop_requested)
+                self._derivatives = None
+            if self._index is not None:
+                if self._indexing: await asyncio.gather(*self._indexing, return_exceptions=True)
+                self._index.close()
+                self._index = None
+            self._publish_metrics()
+            if flusher is not None: flusher.cancel()
+            if self._kill_timer is not None: self._kill_timer.cancel()
+            self._kill_timer = None
+            if pool is not None: await pool.close()
+            self._loop = None
+            self._scheduler = None
+            self._pool = None
+            self._shaper = None
+        extra = {"workers_started": pool.started, "workers_retired": pool.retired} if pool is not None else {}
+        if publisher is not None: extra.update(published=publisher.published, duplicates=publisher.duplicates)
+        if derivatives is not None: extra.update(derivatives.stats())
+        if self.options.dedup: extra["library_duplicates"] = self._duplicates
+        return self._finish(started, **extra)
+
+    async def _chunks(self, urls):
+        """Chunks of an iterator that is cheap to read on the loop thread (the journal)."""
+        size = min(FEED_CHUNK, self.options.window)
+        while True:
+            chunk = list(itertools.islice(urls, size))
+            if not chunk: return
+            yield chunk
+
+    async def _read_ahead(self, urls):
+        """
+        Chunks of a caller-supplied iterable. It is read on a daemon thread
+        so a slow file or a pipe that never closes can't stall the event loop;
+        the thread stays at most one chunk ahead.
+        """
+        loop = asyncio.get_running_loop()
+        size = min(FEED_CHUNK, self.options.window)
+        chunks = asyncio.Queue(maxsize=1)
+        done = threading.Event()
+
+        def hand_over(item):
+            future = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+            while not done.is_set():
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    pass
+            future.cancel()
+            return False
+
+        def reader():
+            source = None
+            try:
+                source = iter(urls)
+                while True:
+                    chunk = list(itertools.islice(source, size))
+                    if not hand_over(chunk) or not chunk: return
+            except Exception as e:
+                if not done.is_set(): hand_over(e)
+            finally:
+                close = getattr(source, "close", None)
+                if close is not None: close()  # lets a generator close the file it reads
+
+        threading.Thread(target=reader, daemon=True).start()
+        try:
+            while True:
+                chunk = await chunks.get()
+                if isinstance(chunk, Exception): raise chunk
+                if not chunk: return
+                yield chunk
+        finally:
+            done.set()
+
+    async def _feed(self, scheduler, chunks, new):
+        """Moves URLs from `chunks` into the scheduler, keeping at most a window queued."""
+        journal = self._journal
+        seen = set() if new and journal is None else None  # the journal dedups new batches itself
+        max_age = self.options.skip_fresh * 3600 if new and journal is not None else 0
+        try:
+            async for chunk in chunks:
+                await scheduler.wait_for_room(self.options.window)
+                if scheduler.closed: return
+                if max_age:
+                    fresh = journal.completed_among(chunk, max_age)
+                    if fresh:
+                        chunk = [url for url in chunk if url not in fresh]
+                        self._skipped += len(fresh)
+                        self.emit("urls_skipped", count=len(fresh), skipped=self._skipped,
+                                  hours=self.options.skip_fresh)
+                if new:
+                    if journal is not None:
+                        chunk = journal.add_jobs(self.batch_id, chunk)
+                    else:
+                        chunk = [url for url in dict.fromkeys(chunk) if url not in seen]
+                        seen.update(chunk)
+                    self._total += len(chunk)
+                if self.trace is not None:
+                    now = self.trace.clock()
+                    for url in chunk: self._queued_at[url] = now
+                for url in chunk: scheduler.put(url)
+        except Exception as e:
+            self.emit("error", message=f"Could not read URLs: {e}")
+            self._request_stop()  # keeps what was read so far resumable
+            return
+        finally:
+            scheduler.end_input()
+        self._input_done = True
+        self.metrics.total, self.metrics.more = self._total, False
+        self.emit("input_finished", total=self._total)
+
+    async def _flush_journal(self):
+        while True:
+            await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+            try:
+                self._journal.flush()
+            except Exception as e:
+                self.emit("error", message=f"Journal write failed: {e}")
+
+    async def _publish_loop(self):
+        publisher = self._publisher
+        waited = 0.0
+        while True:
+            await asyncio.sleep(1.0)
+            waited += 1.0
+            if len(publisher) >= PUBLISH_BATCH or (waited >= PUBLISH_INTERVAL and len(publisher)):
+                waited = 0.0
+                await self._publish()
+
+    async def _publish(self, sweep=False):
+        """Moves finished files into the library on a worker thread."""
+        publisher = self._publisher
+        try:
+            entries = await asyncio.get_running_loop().run_in_executor(None, publisher.publish, sweep)
+        except OSError as e:
+            self.emit("error", message=f"Publishing to {publisher.library} failed: {e}")
+            return
+        if not entries: return
+        self.emit("published", count=len(entries), total=publisher.published, manifest=publisher.manifest)
+        for entry in entries: self._landed(os.path.join(publisher.library, entry["path"]))
+
+    def _landed(self, path):
+        """A finished file is in the library: hand it to the derivative pipeline and the duplicate index."""
+        if self._derivatives is not None: self._derivatives.submit(path)
+        index = self._index
+        if index is None: return
+        st = index.changed(path)
+        if st is None: return
+        future = asyncio.get_running_loop().run_in_executor(None, fingerprint, path)
+        self._indexing.add(future)
+        future.add_done_callback(lambda f: self._indexed(f, path, st))
+
+    def _indexed(self, future, path, st):
+        self._indexing.discard(future)
+        index = self._index
+        if index is None or future.cancelled() or future.exception() is not None: return
+        fp = future.result()
+        if fp is None: return
+        rel = index.rel(path)
+        try:
+            index.record(path, st, fp)
+            same = index.exact(fp[0], exclude=rel)
+            near = []
+            if fp[1] is not None and self.options.dedup_distance:
+                near = [(p, d) for p, d in index.near(fp[1], self.options.dedup_distance, exclude=rel) if p not in same]
+        except sqlite3.Error as e:
+            self.emit("error", message=f"Duplicate index write failed: {e}")
+            return
+        if same or near:
+            self._duplicates += 1
+            self.emit("duplicate", path=path, exact=same, near=[{"path": p, "distance": d} for p, d in near])
+
+    def _derived(self, path, written, error):
+        """Result of one file from the derivative pipeline."""
+        if error is not None:
+            self.emit("error", message=f"Could not make derivatives of {path}: {error}")
+        elif written:
+            self.emit("derived", path=path, outputs=written)
+
+    async def _report_metrics(self):
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            self._publish_metrics()
+            if self._shaper is not None: self._check_bandwidth()
+
+    def _check_bandwidth(self):
+        """
+        Re-reads the bandwidth schedule. gallery-dl can't change a running
+        download's rate, so when the limit drops below what the running ones
+        use, those over their share are terminated and queued again.
+        """
+        shaper = self._shaper
+        if not shaper.update(): return
+        self.emit("bandwidth", limit=shaper.limit)
+        if self.stop_requested: return
+        for url in shaper.over_budget():
+            process = self._processes.get(url)
+            if process is None or url in self._rebalancing: continue
+            self._rebalancing.add(url)
+            terminate_tree(process)
+
+    def _publish_metrics(self):
+        """Emits a "metrics" event and writes the metrics file, if there is one."""
+        snapshot = self.metrics.snapshot()
+        self.emit("metrics", **snapshot)
+        path = self.options.metrics_file
+        if not path: return
+        try:
+            write_textfile(path, snapshot)
+        except OSError as e:
+            self.emit("error", message=f"Could not write metrics to {path}: {e}")
+            self.options.metrics_file = ""  # don't repeat the error every second
+
+    async def _worker(self, name, scheduler):
+        journal = self._journal
+        while not self.stop_requested:
+            url = await scheduler.acquire()
+            if url is None: return
+            if self.trace is not None:
+                queued = self._queued_at.pop(url, None)
+                if queued is not None: self.trace.wait("queued", queued, self.trace.clock(), url=url)
+            if journal is not None: journal.mark_running(self.batch_id, url)
+            attempt = self._attempts[url] = self._attempts.get(url, 0) + 1
+
+            try:
+                result = await self.download_single_url(url, name)
+            except Exception as e:
+                self.emit("error", url=url, message=f"Exception for {url}: {e}")
+                result = JobResult(url, message=str(e))
+            self.metrics.job_finished(name)
+            if self._shaper is not None: self._shaper.release(url)
+            timeline = self._timelines.pop(name, None)
+            if timeline is not None: timeline.close(ok=result.ok, returncode=result.returncode, files=result.items)
+
+            if result.interrupted:
+                scheduler.release(url)
+                del self._attempts[url]
+                self.interrupted_urls.append(url)
+                if journal is not None: journal.mark_interrupted(self.batch_id, url)
+                self.emit("url_interrupted", url=url, worker=name)
+                continue
+            if result.rebalanced:
+                self._attempts[url] -= 1  # not the URL's fault
+                scheduler.put(url)  # before release(), so acquire() can't see an empty queue
+                if self.trace is not None: self._queued_at[url] = self.trace.clock()
+                scheduler.release(url)
+                if journal is not None: journal.mark_queued(self.batch_id, url)
+                self.emit("url_requeued", url=url, worker=name, reason="bandwidth")
+                continue
+
+            retry = (not result.ok and not result.permanent and not self.stop_requested
+                     and attempt <= self.options.max_retries)
+            if retry:
+                delay = self.options.retry_backoff(attempt)
+                scheduler.put_later(url, delay)  # before release(), so acquire() can't see an empty queue
+                if self.trace is not None: self._queued_at[url] = self.trace.clock()
+            changed = scheduler.release(url, result)
+            if changed is not None:
+                self.emit("concurrency", host=changed.name, limit=changed.limit,
+                          ceiling=changed.cap, throttled=result.throttled)
+
+            if retry:
+                if journal is not None: journal.mark_queued(self.batch_id, url)
+                self.emit("url_retry", url=url, attempt=attempt, delay=round(delay, 1),
+                          returncode=result.returncode, throttled=result.throttled)
+                continue
+
+            del self._attempts[url]
+            if result.ok:
+                state = DONE
+            elif result.permanent:
+                state = PARKED
+                self.parked_urls.append(url)
+                self.emit("url_parked", url=url, returncode=result.returncode, message=result.message)
+            else:
+                state = FAILED
+                self.failed_urls.append(url)
+            if journal is not None:
+                journal.mark_finished(self.batch_id, url, state, result.returncode, result.message, result.items)
+            self.emit("url_done", url=url, state=state, returncode=result.returncode, files=result.items,
+                      message=result.message)
+
+            self._completed += 1
+            self.metrics.url_completed(self._completed, self._total, not self._input_done)
+            self.emit("progress", completed=self._completed, total=self._total, more=not self._input_done)
+
+    def _finish(self, started, **extra):
+        if not self._input_done and self._total:
+            self.emit("error", message=f"Stopped before the whole input was read; only the {self._total} "
+                                       "URLs read so far are part of this batch.")
+        journal, self._journal = self._journal, None
+        if journal is not None:
+            try:
+                journal.finish_batch(self.batch_id, STOPPED if self.stop_requested else FINISHED)
+                journal.close()
+            except Exception as e:
+                self.emit("error", message=f"Journal write failed: {e}")
+
+        summary = {
+            "batch_id": self.batch_id,
+            "total": self._total,
+            "completed": self._completed,
+            "failed": list(self.failed_urls),
+            "parked": list(self.parked_urls),
+            "interrupted": list(self.interrupted_urls),
+            "skipped": self._skipped,
+            "stopped": self.stop_requested,
+            "elapsed": round(time.time() - started, 3),
+        }
+        summary.update(extra)
+        trace, self.trace = self.trace, None
+        if trace is not None:
+            try:
+                trace.write(self.options.trace_file)
+            except OSError as e:
+                self.emit("error", message=f"Could not write trace to {self.options.trace_file}: {e}")
+            self.emit("trace_summary", path=self.options.trace_file, rows=trace.summary())
+        self.emit("batch_finished", **summary)
+        return summary
+
+    async def download_single_url(self, url, worker):
+        timeline = None
+        if self.trace is not None:
+            timeline = self._timelines[worker] = self.trace.job(worker, url)
+        rate = await self._bandwidth_share(url, timeline) if self._shaper is not None else None
+        cmd = build_command(url, self.options, rate)
+        result = JobResult(url, started=time.monotonic())
+        self.emit("url_started", url=url, worker=worker, host=host_of(url), cmd=cmd)
+        self.metrics.job_started(worker, url)
+
+        pool = self._pool
+        if pool is not None:
+            try:
+                return await self._download_pooled(url, worker, cmd, result, pool)
+            except WorkerStartError as e:
+                # e.g. gallery-dl installed as a standalone executable only
+                if self._pool is pool:
+                    self.emit("error", message=f"Persistent workers unavailable, starting gallery-dl per URL: {e}")
+                    self._pool = None
+
+        if timeline is not None: timeline.phase("spawn")
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                limit=PIPE_LINE_LIMIT,
+                startupinfo=get_startup_info(),
+                **get_process_group_kwargs()
+            )
+        except Exception as e:
+            result.message = str(e)
+            result.unstartable = isinstance(e, (FileNotFoundError, PermissionError))
+            result.finished = time.monotonic()
+            self.emit("url_finished", url=url, worker=worker, ok=False, returncode=None, message=result.message)
+            return result
+
+        self._processes[url] = process
+        if self.stop_requested: terminate_tree(process, force=self.hard_stop)  # stopped while it was starting
+        try:
+            if timeline is not None: timeline.phase("startup")
+            await self._read_output(process, result, worker)
+            if timeline is not None: timeline.phase("exit")
+            result.returncode = await process.wait()
+        finally:
+            del self._processes[url]
+        return self._finish_url(result, worker)
+
+    async def _bandwidth_share(self, url, timeline):
+        """Waits until the budget has room for another download; returns its rate (None = unlimited)."""
+        shaper = self._shaper
+        while True:
+            self._check_bandwidth()
+            scheduler = self._scheduler
+            # URLs held by workers count too: after a rebalance several restart at once.
+            expected = max(len(shaper.rates) + 1, scheduler.running + scheduler.queued if scheduler is not None else 0)
+            rate = shaper.acquire(url, expected)
+            if rate is not False or self.stop_requested: return rate or None
+            if timeline is not None and timeline.phase_name != "throttle": timeline.phase("throttle")
+            await asyncio.sleep(BANDWIDTH_RECHECK)
+
+    async def _download_pooled(self, url, worker, cmd, result, pool):
+        timeline = self._timelines.get(worker)
+        if timeline is not None: timeline.phase("checkout")
+        handle = await pool.checkout()
+        if timeline is not None: timeline.phase("startup")
+        self._processes[url] = handle.process
+        if self.stop_requested: terminate_tree(handle.process, force=self.hard_stop)
+        try:
+            result.returncode = await handle.run(cmd[1:], lambda line: self._handle_line(result, worker, line))
+        finally:
+            del self._processes[url]
+            pool.checkin(handle)
+        return self._finish_url(result, worker)
+
+    def _finish_url(self, result, worker):
+        result.finished = time.monotonic()
+        result.ok = result.returncode == 0
+        result.interrupted = self.stop_requested and not result.ok
+        if result.url in self._rebalancing:
+            self._rebalancing.discard(result.url)
+            result.rebalanced = not result.ok and not self.stop_requested
+        self.emit("url_finished", url=result.url, worker=worker, ok=result.ok, returncode=result.returncode,
+                  throttled=result.throttled, interrupted=result.interrupted, rebalanced=result.rebalanced)
+        return result
+
+    async def _read_output(self, process, result, worker):
+        """Forwards gallery-dl's output until it exits."""
+        while True:
+            try:
+                raw = await process.stdout.readline()
+            except ValueError:
+                continue  # line longer than PIPE_LINE_LIMIT, the rest is dropped
+            if not raw: break
+            line = raw.decode("utf-8", errors="replace").strip()
+            if line: self._handle_line(result, worker, line)
+
+    def _handle_line(self, result, worker, line):
+        """
+        Turns file lines into file_* events and metrics, notes throttling and
+        errors in `result` and emits everything else as "output".
+        """
+        if self.trace is not None: self._trace_line(worker, line)
+        if line.startswith(FILE_EVENT):
+            self._handle_file_event(result, worker, line[1:2], line[3:])
+            return
+        # Log lines look like "[pixiv][error] ..."; without structured output
+        # plain lines are file paths ("# path" for files that were already there).
+        if line.startswith("["):
+            if "][error]" in line:
+                if THROTTLE_PATTERN.search(line): result.throttled = True
+                elif PERMANENT_PATTERN.search(line) and not line.startswith(FILE_ERROR): result.gone = True
+                result.message = line
+        elif not self.options.structured_output:
+            if line.startswith("# "):
+                self._handle_file_event(result, worker, FILE_SKIPPED, line[2:])
+            else:
+                self._handle_file_event(result, worker, FILE_FINISHED, line)
+            return
+        self.emit("output", url=result.url, worker=worker, line=line)
+
+    def _trace_line(self, worker, line):
+        """Moves the worker's timeline to the phase an output line starts."""
+        timeline = self._timelines.get(worker)
+        if timeline is None: return
+        if line.startswith(FILE_EVENT):
+            kind = line[1:2]
+            if kind == FILE_STARTED: phase = "download"
+            elif kind == FILE_PROGRESS: return
+            else: phase = "extract"
+        else:
+            # Without structured output downloads can't be told apart from
+            # extraction; it all counts as "extract".
+            phase = "extract" if timeline.phase_name == "startup" else None
+        if phase is not None and phase != timeline.phase_name: timeline.phase(phase)
+
+    def _handle_file_event(self, result, worker, kind, value):
+        metrics = self.metrics
+        if kind == FILE_PROGRESS:
+            metrics.file_progress(worker, parse_size(value.partition(" ")[0]))
+        elif kind == FILE_STARTED:
+            metrics.file_started(worker, value)
+            self.emit("file_started", url=result.url, worker=worker, path=value)
+        elif kind == FILE_FINISHED:
+            result.items += 1
+            try:
+                size = os.path.getsize(value)
+            except OSError:
+                size = 0
+            metrics.file_finished(worker, size)
+            if self._publisher is not None: self._publisher.add(value)
+            else: self._landed(value)
+            self.emit("file_finished", url=result.url, worker=worker, path=value, bytes=size)
+        elif kind == FILE_SKIPPED:
+            result.items += 1
+            metrics.file_skipped(worker)
+            self.emit("file_skipped", url=result.url, worker=worker, path=value)
+
+
+# --- Command Line ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="gallery_dl_engine",
+        description="Run gallery-dl over a batch of URLs without a GUI. "
+                    "Progress is written to stdout as one JSON event per line.")
+    parser.add_argument("urls", nargs="*", help="URLs to download")
+    parser.add_argument("-i", "--input-file", action="append", default=[], metavar="FILE",
+                        help="read URLs from FILE, one per line ('-' for stdin); may be repeated")
+    parser.add_argument("-d", "--dest", default=os.getcwd(), help="save directory (default: current directory)")
+    parser.add_argument("-c", "--cookies", default="", help="cookies.txt file")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help=f"parallel gallery-dl processes (default: 4, max: {MAX_WORKERS_LIMIT})")
+    parser.add_argument("--per-host", type=int, default=2, metavar="N",
+                        help="max parallel downloads per host, 0 = no cap (default: 2)")
+    parser.add_argument("--host-delay", type=float, default=0.0, metavar="SECONDS",
+                        help="minimum spacing between starts on the same host (default: 0)")
+    parser.add_argument("--host-limit", action="append", default=[], metavar="HOST=N[:SECONDS]",
+                        help="per-host override of --per-host/--host-delay; may be repeated")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="treat --workers/--per-host as ceilings and adjust concurrency per host "
+                             "from observed throttling (AIMD)")
+    parser.add_argument("--retries", type=int, default=3, metavar="N",
+                        help="retry transient failures up to N times with exponential backoff (default: 3)")
+    parser.add_argument("--retry-delay", type=float, default=5.0, metavar="SECONDS",
+                        help="backoff before the first retry, doubled for each further one (default: 5)")
+    parser.add_argument("--window", type=int, default=1000, metavar="N",
+                        help="URLs read ahead of the workers; input files are streamed, "
+                             "never loaded whole (default: 1000)")
+    parser.add_argument("--skip-fresh", type=float, default=0.0, metavar="HOURS",
+                        help="leave out URLs that completed within the last HOURS according to the "
+                             "journal's history, without starting gallery-dl for them (default: off)")
+    parser.add_argument("--limit-total", default="", metavar="RATE",
+                        help="bandwidth budget for the whole batch, e.g. 4M (bytes/s), split across "
+                             "the running downloads")
+    parser.add_argument("--limit-schedule", action="append", default=[], metavar="[DAYS@]HH:MM-HH:MM=RATE",
+                        help="time-of-day override of --limit-total, e.g. mon-fri@08:00-18:00=1M or "
+                             "22:00-06:00=0 (0 = unlimited); may be repeated, the first match wins")
+    parser.add_argument("--stage", nargs="?", const="", default=None, metavar="DIR",
+                        help="download into a staging folder (default: .<dest>.staging next to dest) and "
+                             "move finished files into dest in batches, recorded in dest/.library-manifest.jsonl; "
+                             "implies --archive")
+    parser.add_argument("--derivatives", action="append", default=None, metavar="WxH",
+                        help="also make a downscaled copy of every downloaded image for this screen size "
+                             "(and a thumbnail) in <dest>.derivatives, using all cores; may be repeated")
+    parser.add_argument("--thumbnail-size", type=int, default=320, metavar="PX",
+                        help="edge of the --derivatives thumbnails, 0 = none (default: 320)")
+    parser.add_argument("--derivative-dir", default="", metavar="DIR",
+                        help="where --derivatives go (default: <dest>.derivatives next to dest)")
+    parser.add_argument("--dedup", nargs="?", type=int, const=DEFAULT_DISTANCE, default=None, metavar="BITS",
+                        help="hash every downloaded file into the library's duplicate index and report exact "
+                             "duplicates and images whose perceptual hashes differ in at most BITS bits "
+                             f"(default: {DEFAULT_DISTANCE}; 0 = exact only) as 'duplicate' events")
+    parser.add_argument("--abort", type=int, default=0, metavar="N",
+                        help="stop walking a gallery after N files in a row that were downloaded before, "
+                             "so re-running a list only fetches new files (default: off)")
+    parser.add_argument("--no-flatten", action="store_true", help="let gallery-dl create its own subfolders")
+    parser.add_argument("--archive", action="store_true", help="track history in <dest>/archive.sqlite")
+    parser.add_argument("--archive-mode", choices=ARCHIVE_MODES, default=ARCHIVE_DEFERRED,
+                        help="deferred: each run commits its archive entries once at the end (no lock "
+                             "contention between workers); shared: commit every file (default: %(default)s)")
+    parser.add_argument("--extra-args", default="", help="raw flags passed to gallery-dl")
+    parser.add_argument("--gallery-dl", default=GALLERY_DL, metavar="PATH", help="gallery-dl executable")
+    parser.add_argument("--persistent", action="store_true",
+                        help="run URLs in long-lived Python workers that import gallery-dl once "
+                             "instead of starting gallery-dl per URL")
+    parser.add_argument("--python", default=sys.executable, metavar="PATH",
+                        help="interpreter for --persistent workers; must be able to import gallery_dl "
+                             "(default: this one)")
+    parser.add_argument("--recycle-after", type=int, default=200, metavar="N",
+                        help="replace a persistent worker after N URLs (default: 200)")
+    parser.add_argument("--recycle-mb", type=int, default=512, metavar="MB",
+                        help="replace a persistent worker once it uses more than MB memory (default: 512)")
+    parser.add_argument("--trace", default="", metavar="FILE",
+                        help="time every URL's phases (queue, spawn, startup, extraction, downloads, exit), "
+                             "save them as a Chrome/Perfetto trace and print a summary to stderr")
+    parser.add_argument("--no-output", action="store_true",
+                        help="do not emit gallery-dl's own output lines and per-file events")
+    parser.add_argument("--plain-output", action="store_true",
+                        help="leave gallery-dl's output format alone (no per-file start/progress events; "
+                             "for gallery-dl versions without output.mode formats)")
+    parser.add_argument("--metrics-file", default="", metavar="PATH",
+                        help="write live counters every second: JSON for *.json, otherwise the Prometheus "
+                             "text format (e.g. for node_exporter's textfile collector)")
+    parser.add_argument("--stop-grace", type=float, default=STOP_GRACE, metavar="SECONDS",
+                        help="on Ctrl+C/SIGTERM, give running downloads this long to exit before killing them "
+                             "(a second Ctrl+C kills at once; default: %(default)s)")
+    parser.add_argument("--journal", default=JOURNAL_FILE, metavar="PATH",
+                        help="job journal database (default: %(default)s)")
+    parser.add_argument("--no-journal", action="store_true", help="do not record the batch in the journal")
+    parser.add_argument("--resume", nargs="?", const="last", metavar="BATCH_ID",
+                        help="resume an unfinished batch (default: the newest one) with its original options")
+    return parser.parse_args(argv)
+
+
+def parse_host_limits(specs):
+    """Parses ["pixiv.net=1:2.5", "imgur.com=8"] into a host_limits dict."""
+    limits = {}
+    for spec in specs:
+        host, sep, value = spec.partition("=")
+        if not sep or not host: raise ValueError(f"invalid --host-limit '{spec}'")
+        workers, _, delay = value.partition(":")
+        entry = {"workers": int(workers)}
+        if delay: entry["delay"] = float(delay)
+        limits[host.strip().lower()] = entry
+    return limits
+
+
+def iter_url_file(path):
+    """Yields the URLs of a text file ('-' for stdin) one line at a time."""
+    if path == "-":
+        yield from read_url_lines(sys.stdin)
+        return
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        yield from read_url_lines(f)
+
+
+def iter_urls(args):
+    """Lazily chains the URL arguments and every --input-file."""
+    yield from args.urls
+    for path in args.input_file:
+        yield from iter_url_file(path)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    journal_path = None if args.no_journal else args.journal
+    resume = None
+
+    try:
+        host_limits = parse_host_limits(args.host_limit)
+        bandwidth_schedule = parse_schedule_specs(args.limit_schedule)
+        BandwidthSchedule(args.limit_total, bandwidth_schedule)  # fail early on bad rates
+        for path in args.input_file:
+            if path != "-" and not os.access(path, os.R_OK): raise OSError(f"cannot read '{path}'")
+        if args.skip_fresh and journal_path is None: raise ValueError("--skip-fresh needs the journal")
+        if args.resume:
+            if journal_path is None: raise ValueError("--resume needs the journal")
+            journal = JobJournal(journal_path)
+            try:
+                resume = journal.unfinished_batch() if args.resume == "last" else int(args.resume)
+                stored = journal.batch_options(resume) if resume is not None else None
+            finally:
+                journal.close()
+            if not stored: raise ValueError("no unfinished batch to resume")
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    if not args.urls and not args.input_file and resume is None:
+        print("error: no URLs given", file=sys.stderr)
+        return 2
+
+    def write_event(event):
+        if event["event"] == "trace_summary":
+            print(f"Trace written to {event['path']}", file=sys.stderr)
+            for line in format_summary(event["rows"]): print(line, file=sys.stderr)
+        if args.no_output and event["event"] in ("output", "file_started", "file_finished", "file_skipped",
+                                                     "derived"): return
+        sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    if resume is not None:
+        options = BatchOptions(**stored)
+    else:
+        options = BatchOptions(
+            dest=args.dest,
+            cookies=args.cookies,
+            flatten=not args.no_flatten,
+            use_archive=args.archive,
+            extra_args=args.extra_args,
+            max_workers=args.workers,
+            executable=args.gallery_dl,
+            per_host_workers=args.per_host,
+            host_delay=args.host_delay,
+            host_limits=host_limits,
+            adaptive=args.adaptive,
+            max_retries=args.retries,
+            retry_delay=args.retry_delay,
+            window=args.window,
+            persistent=args.persistent,
+            python=args.python,
+            recycle_jobs=args.recycle_after,
+            recycle_mb=args.recycle_mb,
+            skip_fresh=args.skip_fresh,
+            archive_mode=args.archive_mode,
+            structured_output=not args.plain_output,
+            metrics_file=args.metrics_file,
+            trace_file=args.trace,
+            bandwidth_limit=args.limit_total,
+            bandwidth_schedule=bandwidth_schedule,
+            staging=args.stage is not None,
+            staging_dir=args.stage or "",
+            derivatives=args.derivatives is not None,
+            derivative_sizes=args.derivatives,
+            thumbnail_size=args.thumbnail_size,
+            derivative_dir=args.derivative_dir,
+            dedup=args.dedup is not None,
+            dedup_distance=args.dedup or 0,
+            abort_after=args.abort,
+        )
+    engine = BatchEngine(options, on_event=write_event, journal_path=journal_path, stop_grace=args.stop_grace)
+    signalled = []
+
+    def on_signal(signum, frame):
+        # First Ctrl+C/SIGTERM stops gracefully, the second one kills.
+        engine.stop(hard=bool(signalled))
+        signalled.append(signum)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, on_signal)
+    summary = engine.run(iter_urls(args), resume=resume)
+    if signalled: return 130
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
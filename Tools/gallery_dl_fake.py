@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+A stand-in for gallery-dl, for benchmarks (see gallery_dl_bench).
+
+It accepts the command line the engine builds and pretends each URL is a
+gallery. What it does is read from the URL's query string, so a URL list
+describes a whole workload and replays the same way every time:
+
+    http://h3.fake.invalid/g/17?files=20&size=65536&delay=0.01&chatter=2
+
+    files     files in the gallery (default 1); raising it adds new ones on top
+    size      bytes per file (default 4096)
+    latency   seconds before the first output: the site's first response
+    delay     seconds per file: talking to the site between files
+    chatter   extra log lines per file
+    fail      1: exit with an HTTP error (transient) every time
+    missing   1: exit "404 Not Found" (permanent)
+    throttle  the first N attempts answer "429 Too Many Requests"
+    flaky     the first N attempts fail with a server error
+
+Per-process startup cost (interpreter plus extractor imports for the real
+thing) comes from GALLERY_DL_FAKE_STARTUP seconds. With
+GALLERY_DL_FAKE_SERVER set to a gallery_dl_bench server's address, files
+are downloaded from it over HTTP; otherwise they are generated locally.
+Either way --limit-rate and --abort are honoured, as are the engine's
+output.mode formats, so per-file events and progress lines look like the real ones.
+
+Run it as the gallery-dl executable, or import it as `gallery_dl` (it has
+main(), config and version) to stand in for persistent workers.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+__version__ = "0.0-fake"
+BLOCK = 64 * 1024
+PROGRESS_EVERY = 1024 * 1024  # bytes between progress lines, like gallery-dl's ~1/s for big files
+EXIT_HTTP_ERROR = 4
+EXIT_NOT_FOUND = 8
+
+_PAYLOAD = bytes(range(256)) * (BLOCK // 256)
+_started = False
+
+
+class version:
+    __version__ = __version__
+
+
+class config:
+    """The bits of gallery_dl.config the persistent worker touches."""
+    @staticmethod
+    def clear():
+        pass
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="gallery-dl")
+    parser.add_argument("urls", nargs="*")
+    parser.add_argument("--version", action="store_true")
+    parser.add_argument("-d", "--dest", default=".")
+    parser.add_argument("-D", "--directory", default=None)
+    parser.add_argument("-o", "--option", action="append", default=[])
+    parser.add_argument("-r", "--limit-rate", default=None)
+    parser.add_argument("-A", "--abort", type=int, default=0)
+    parser.add_argument("--download-archive", default=None)
+    parser.add_argument("-C", "--cookies", default=None)
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def output_formats(options):
+    """The output.mode formats passed with -o, if any."""
+    for option in options:
+        key, _, value = option.partition("=")
+        if key == "output.mode" and value.startswith("{"): return json.loads(value)
+    return None
+
+
+def parse_rate(text):
+    if not text: return None
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    text = text.strip().lower()
+    return float(text[:-1]) * units[text[-1]] if text[-1] in units else float(text)
+
+
+def attempts(state_dir, url):
+    """How often this URL has been tried before (kept in the destination folder)."""
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, hashlib.sha1(url.encode()).hexdigest())
+    try:
+        with open(path) as f:
+            count = int(f.read() or 0)
+    except (OSError, ValueError):
+        count = 0
+    with open(path, "w") as f:
+        f.write(str(count + 1))
+    return count
+
+
+def write_file(path, size, rate, url, emit):
+    server = os.environ.get("GALLERY_DL_FAKE_SERVER")
+    source = None
+    if server:
+        import urllib.request  # slow to import; only the HTTP scenarios need it
+        source = urllib.request.urlopen(f"{server}/bytes/{size}")
+    written, started, reported = 0, time.perf_counter(), 0
+    try:
+        with open(path + ".part", "wb") as f:
+            while written < size:
+                n = min(BLOCK, size - written)
+                block = source.read(n) if source is not None else _PAYLOAD[:n]
+                if not block: break
+                f.write(block)
+                written += len(block)
+                if rate:
+                    ahead = written / rate - (time.perf_counter() - started)
+                    if ahead > 0: time.sleep(ahead)
+                if written - reported >= PROGRESS_EVERY:
+                    reported = written
+                    emit("progress", written, round(written / max(1e-6, time.perf_counter() - started)))
+    finally:
+        if source is not None: source.close()
+    os.replace(path + ".part", path)
+
+
+def run(argv):
+    args = parse_args(argv)
+    if args.version:
+        print(__version__)
+        return 0
+    formats = output_formats(args.option)
+    out = sys.stdout
+
+    def emit(kind, *values):
+        if formats is None:
+            if kind == "success": out.write(f"{values[0]}\n")
+            elif kind == "skip": out.write(f"# {values[0]}\n")
+        else:
+            out.write(formats[kind].format(*values))
+        out.flush()
+
+    rate = parse_rate(args.limit_rate)
+    status = 0
+    for url in args.urls:
+        parts = urlsplit(url)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        number = lambda key, default: type(default)(query.get(key, default))
+        time.sleep(number("latency", 0.0))
+
+        tried = attempts(os.path.join(args.dest, ".fake-state"), url)
+        if number("missing", 0):
+            print(f"[fake][error] 404 Not Found: {url}", file=sys.stderr)
+            status |= EXIT_NOT_FOUND
+            continue
+        if tried < number("throttle", 0):
+            print(f"[fake][error] HttpError: '429 Too Many Requests' for '{url}'", file=sys.stderr)
+            status |= EXIT_HTTP_ERROR
+            continue
+        if number("fail", 0) or tried < number("flaky", 0):
+            print(f"[fake][error] HttpError: '500 Internal Server Error' for '{url}'", file=sys.stderr)
+            status |= EXIT_HTTP_ERROR
+            continue
+
+        name = f"{parts.hostname}_{parts.path.strip('/').replace('/', '_')}"
+        folder = args.dest if args.directory == "." else os.path.join(args.dest, "fake", name)
+        os.makedirs(folder, exist_ok=True)
+        size, delay, chatter = number("size", 4096), number("delay", 0.0), number("chatter", 0)
+        skipped = 0
+        for n in reversed(range(number("files", 1))):  # newest first, as most sites list them
+            if args.abort and skipped >= args.abort: break  # like gallery-dl: stop the gallery, exit 0
+            if delay: time.sleep(delay)
+            for line in range(chatter):
+                print(f"[fake][debug] {url} file {n}: metadata line {line}", file=sys.stderr)
+            path = os.path.join(folder, f"{name}_{n:05}.jpg")
+            if os.path.exists(path):
+                emit("skip", path)
+                skipped += 1
+                continue
+            skipped = 0
+            emit("start", path)
+            write_file(path, size, rate, url, emit)
+            emit("success", path)
+    sys.stderr.flush()
+    return status
+
+
+def main():
+    """gallery_dl.main() as the persistent worker calls it."""
+    global _started
+    if not _started:
+        _started = True
+        time.sleep(float(os.environ.get("GALLERY_DL_FAKE_STARTUP", 0)))
+    return run(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""
+Crash-safe job journal for the gallery-dl batch engine.
+
+Every batch and the state of each of its URLs (queued, running, done,
+failed, parked) is recorded in an SQLite database in CONFIG_DIR, so a batch that
+was stopped or died with the process can be resumed without redoing the
+URLs that already finished.
+
+State changes are buffered in memory and written in one transaction per
+flush. A crash loses at most the changes since the last flush; those URLs
+are simply run again on resume.
+
+URLs that finished successfully also go into a history table keyed by
+normalized URL (completion time, files seen), which outlives the pruned
+batches. completed_among() checks a chunk of URLs against it in one indexed
+query, so a batch can skip URLs it fetched recently without starting
+gallery-dl for them.
+"""
+import json
+import sqlite3
+import time
+
+from gallery_dl_config import JOURNAL_FILE
+from gallery_dl_urls import normalize_url
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"      # gave up after retrying transient errors
+PARKED = "parked"      # permanent failure (404, unsupported URL, ...), not worth retrying
+
+# Batch status
+ACTIVE = "active"       # running, or the process died while it was
+STOPPED = "stopped"     # stopped by the user, may be resumed
+FINISHED = "finished"
+ABANDONED = "abandoned" # the user declined to resume it
+
+KEEP_BATCHES = 20
+FLUSH_ROWS = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id       INTEGER PRIMARY KEY,
+    created  REAL NOT NULL,
+    finished REAL,
+    status   TEXT NOT NULL,
+    options  TEXT
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    batch_id   INTEGER NOT NULL,
+    seq        INTEGER NOT NULL,
+    url        TEXT NOT NULL,
+    state      TEXT NOT NULL,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    started    REAL,
+    finished   REAL,
+    returncode INTEGER,
+    message    TEXT,
+    PRIMARY KEY (batch_id, url)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (batch_id, state, seq);
+CREATE TABLE IF NOT EXISTS history (
+    url      TEXT PRIMARY KEY,  -- normalize_url() of the source URL
+    finished REAL NOT NULL,
+    items    INTEGER NOT NULL DEFAULT 0,
+    runs     INTEGER NOT NULL DEFAULT 1
+) WITHOUT ROWID;
+"""
+
+
+class JobJournal:
+    """
+    SQLite-backed record of batches. A connection belongs to the thread that
+    opened it, so the engine and the GUI each open their own JobJournal.
+    """
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self._pending = {}  # (batch_id, url) -> [state, attempts delta, started, finished, returncode, message]
+        self._next_seq = {}  # batch_id -> seq of the next URL added
+        self._history = {}  # normalized url -> (finished, items)
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    # --- Batches ---
+    def create_batch(self, urls=(), options=None):
+        """Records a new batch with all `urls` queued; returns its id."""
+        self._prune()
+        with self.db:
+            self.db.execute("BEGIN")
+            cur = self.db.execute(
+                "INSERT INTO batches (created, status, options) VALUES (?, ?, ?)",
+                (time.time(), ACTIVE, json.dumps(options or {})))
+            batch_id = cur.lastrowid
+            self._next_seq[batch_id] = 0
+        self.add_jobs(batch_id, urls)
+        return batch_id
+
+    def add_jobs(self, batch_id, urls):
+        """
+        Queues more URLs in a batch, skipping ones it already has. Returns the
+        URLs that were added, in order. Meant for chunks of a few hundred URLs
+        (see FEED_CHUNK in the engine), so a batch can be recorded as its
+        input is read.
+        """
+        urls = list(dict.fromkeys(urls))
+        if not urls: return []
+        known = set()
+        for i in range(0, len(urls), FLUSH_ROWS):
+            part = urls[i:i + FLUSH_ROWS]
+            known.update(row[0] for row in self.db.execute(
+                f"SELECT url FROM jobs WHERE batch_id = ? AND url IN ({','.join('?' * len(part))})",
+                (batch_id, *part)))
+        urls = [url for url in urls if url not in known]
+        if not urls: return []
+
+        seq = self._next_seq.get(batch_id)
+        if seq is None:
+            seq = self.db.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM jobs WHERE batch_id = ?",
+                                  (batch_id,)).fetchone()[0]
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "INSERT INTO jobs (batch_id, seq, url, state) VALUES (?, ?, ?, ?)",
+                ((batch_id, seq + i, url, QUEUED) for i, url in enumerate(urls)))
+        self._next_seq[batch_id] = seq + len(urls)
+        return urls
+
+    def finish_batch(self, batch_id, status):
+        self.flush()
+        self.db.execute("UPDATE batches SET status = ?, finished = ? WHERE id = ?",
+                        (status, time.time(), batch_id))
+
+    def latest_batch(self):
+        row = self.db.execute("SELECT id FROM batches ORDER BY id DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def unfinished_batch(self):
+        """Returns the id of the newest active/stopped batch with work left, or None."""
+        row = self.db.execute(
+            "SELECT b.id FROM batches b WHERE b.status IN (?, ?) AND EXISTS "
+            "(SELECT 1 FROM jobs j WHERE j.batch_id = b.id AND j.state IN (?, ?)) "
+            "ORDER BY b.id DESC LIMIT 1", (ACTIVE, STOPPED, QUEUED, RUNNING)).fetchone()
+        return row[0] if row else None
+
+    def batch_options(self, batch_id):
+        row = self.db.execute("SELECT options FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return json.loads(row[0] or "{}") if row else {}
+
+    def counts(self, batch_id):
+        """Returns {state: count} for a batch."""
+        self.flush()
+        return dict(self.db.execute(
+            "SELECT state, COUNT(*) FROM jobs WHERE batch_id = ? GROUP BY state", (batch_id,)))
+
+    def pending_urls(self, batch_id):
+        """URLs that still have to run: queued, plus running ones interrupted by a crash."""
+        self.flush()
+        return [row[0] for row in self.db.execute(
+            "SELECT url FROM jobs WHERE batch_id = ? AND state IN (?, ?) ORDER BY seq",
+            (batch_id, QUEUED, RUNNING))]
+
+    def iter_pending_urls(self, batch_id):
+        """Like pending_urls(), but reads them a page at a time."""
+        self.flush()
+        last = -1
+        while True:
+            rows = self.db.execute(
+                "SELECT seq, url FROM jobs WHERE batch_id = ? AND state IN (?, ?) AND seq > ? "
+                "ORDER BY seq LIMIT ?", (batch_id, QUEUED, RUNNING, last, FLUSH_ROWS)).fetchall()
+            if not rows: return
+            for _, url in rows: yield url
+            last = rows[-1][0]
+
+    def urls_in_state(self, state, batch_id=None):
+        if batch_id is None: batch_id = self.latest_batch()
+        if batch_id is None: return []
+        self.flush()
+        return [row[0] for row in self.db.execute(
+            "SELECT url FROM jobs WHERE batch_id = ? AND state = ? ORDER BY seq", (batch_id, state))]
+
+    def completed_among(self, urls, max_age=None):
+        """
+        The subset of `urls` (in any spelling) that finished successfully
+        before, or within the last `max_age` seconds.
+        """
+        self.flush()
+        keys = {}
+        for url in urls: keys.setdefault(normalize_url(url), []).append(url)
+        since = time.time() - max_age if max_age is not None else 0
+        unique = list(keys)
+        done = set()
+        for i in range(0, len(unique), FLUSH_ROWS):
+            part = unique[i:i + FLUSH_ROWS]
+            for (key,) in self.db.execute(
+                    f"SELECT url FROM history WHERE finished >= ? AND url IN ({','.join('?' * len(part))})",
+                    (since, *part)):
+                done.update(keys[key])
+        return done
+
+    def history(self, url):
+        """Returns {"finished", "items", "runs"} for a URL's last success, or None."""
+        self.flush()
+        row = self.db.execute("SELECT finished, items, runs FROM history WHERE url = ?",
+                              (normalize_url(url),)).fetchone()
+        return dict(zip(("finished", "items", "runs"), row)) if row else None
+
+    def failed_urls(self, batch_id=None):
+        return self.urls_in_state(FAILED, batch_id)
+
+    def parked_urls(self, batch_id=None):
+        return self.urls_in_state(PARKED, batch_id)
+
+    def _prune(self):
+        with self.db:
+            self.db.execute("BEGIN")
+            old = "SELECT id FROM batches ORDER BY id DESC LIMIT -1 OFFSET ?"
+            self.db.execute(f"DELETE FROM jobs WHERE batch_id IN ({old})", (KEEP_BATCHES - 1,))
+            self.db.execute(f"DELETE FROM batches WHERE id IN ({old})", (KEEP_BATCHES - 1,))
+
+    # --- Job state (buffered) ---
+    def _update(self, batch_id, url, state, attempt=0, started=None, finished=None, returncode=None, message=None):
+        entry = self._pending.get((batch_id, url))
+        if entry is None:
+            self._pending[(batch_id, url)] = [state, attempt, started, finished, returncode, message]
+        else:
+            entry[0] = state
+            entry[1] += attempt
+            for i, value in ((2, started), (3, finished), (4, returncode), (5, message)):
+                if value is not None: entry[i] = value
+        if len(self._pending) >= FLUSH_ROWS: self.flush()
+
+    def mark_running(self, batch_id, url):
+        self._update(batch_id, url, RUNNING, attempt=1, started=time.time())
+
+    def mark_finished(self, batch_id, url, state, returncode=None, message=None, items=0):
+        """Records a final state: DONE, FAILED or PARKED. DONE also goes into the history."""
+        now = time.time()
+        if state == DONE: self._history[normalize_url(url)] = (now, items)
+        self._update(batch_id, url, state, finished=now, returncode=returncode, message=message or None)
+
+    def mark_queued(self, batch_id, url):
+        self._update(batch_id, url, QUEUED)
+
+    def mark_interrupted(self, batch_id, url):
+        """A run cut short by a stop: queued again so a resume picks it up."""
+        self._update(batch_id, url, QUEUED, finished=time.time(), message="interrupted")
+
+    def flush(self):
+        """Writes all buffered state changes in a single transaction."""
+        if not self._pending and not self._history: return
+        rows = [(state, attempts, started, finished, returncode, message, batch_id, url)
+                for (batch_id, url), (state, attempts, started, finished, returncode, message)
+                in self._pending.items()]
+        history = [(url, finished, items) for url, (finished, items) in self._history.items()]
+        self._pending = {}
+        self._history = {}
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "UPDATE jobs SET state = ?, attempts = attempts + ?, "
+                "started = COALESCE(?, started), finished = COALESCE(?, finished), "
+                "returncode = COALESCE(?, returncode), message = COALESCE(?, message) "
+                "WHERE batch_id = ? AND url = ?", rows)
+            self.db.executemany(
+                "INSERT INTO history (url, finished, items) VALUES (?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET finished = excluded.finished, "
+                "items = excluded.items, runs = runs + 1", history)
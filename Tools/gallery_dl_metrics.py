@@ -0,0 +1,192 @@
+"""
+Live throughput figures for a running batch.
+
+BatchMetrics is fed by the engine (jobs starting and ending, files started,
+finished and skipped, byte progress) and turns that into counters, rolling
+files/s and bytes/s over the last ROLLING_WINDOW seconds, an ETA and the
+slowest running job. snapshot() is a plain dict; write_textfile() stores it
+as JSON or in the Prometheus text format (node_exporter's textfile
+collector picks up *.prom files).
+"""
+import collections
+import json
+import os
+import re
+import time
+
+ROLLING_WINDOW = 30.0
+# gallery-dl prints sizes like "512", "1.23M" (decimal) or "1.20Mi" (binary units).
+SIZE_PATTERN = re.compile(r"([0-9.]+)\s*([kKMGTPEZY]?)(i?)")
+SIZE_UNITS = "kMGTPEZY"
+
+
+def parse_size(text):
+    """Bytes for a size as gallery-dl formats it; 0 if it isn't one."""
+    match = SIZE_PATTERN.match(text.strip())
+    if not match: return 0
+    try:
+        value = float(match.group(1))
+    except ValueError:
+        return 0
+    unit = match.group(2).upper().replace("K", "k")
+    if unit: value *= (1024 if match.group(3) else 1000) ** (SIZE_UNITS.index(unit) + 1)
+    return int(value)
+
+
+class _Job:
+    __slots__ = ("url", "started", "last_activity", "files", "bytes", "file", "file_bytes")
+
+    def __init__(self, url, now):
+        self.url = url
+        self.started = now
+        self.last_activity = now
+        self.files = 0
+        self.bytes = 0
+        self.file = None        # path of the file being downloaded
+        self.file_bytes = 0     # bytes of it reported so far
+
+
+class BatchMetrics:
+    """Counters for one batch. Only used from the event loop thread."""
+    def __init__(self, window=ROLLING_WINDOW, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.started = clock()
+        self.files = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.completed = 0
+        self.total = 0
+        self.more = True        # the input hasn't been read to the end yet
+        self.jobs = {}          # worker -> _Job
+        self._transfers = collections.deque()   # (time, files, bytes)
+        self._completions = collections.deque()  # time of each finished URL
+
+    # --- Events ---
+    def job_started(self, worker, url):
+        self.jobs[worker] = _Job(url, self.clock())
+
+    def job_finished(self, worker):
+        self.jobs.pop(worker, None)
+
+    def url_completed(self, completed, total, more):
+        self.completed, self.total, self.more = completed, total, more
+        self._completions.append(self.clock())
+
+    def file_started(self, worker, path):
+        job = self.jobs.get(worker)
+        if job is None: return
+        job.file, job.file_bytes = path, 0
+        job.last_activity = self.clock()
+
+    def file_progress(self, worker, downloaded):
+        """`downloaded` bytes of the current file so far."""
+        job = self.jobs.get(worker)
+        if job is None or downloaded <= job.file_bytes: return
+        self._transfer(job, 0, downloaded - job.file_bytes)
+        job.file_bytes = downloaded
+
+    def file_finished(self, worker, size):
+        job = self.jobs.get(worker)
+        if job is None:
+            self.files += 1
+            self.bytes += size
+            return
+        self._transfer(job, 1, max(0, size - job.file_bytes))
+        job.file, job.file_bytes = None, 0
+
+    def file_skipped(self, worker):
+        self.skipped += 1
+        job = self.jobs.get(worker)
+        if job is not None: job.last_activity = self.clock()
+
+    def _transfer(self, job, files, size):
+        now = self.clock()
+        self.files += files
+        self.bytes += size
+        job.files += files
+        job.bytes += size
+        job.last_activity = now
+        self._transfers.append((now, files, size))
+
+    # --- Reporting ---
+    def snapshot(self):
+        now = self.clock()
+        horizon = now - self.window
+        while self._transfers and self._transfers[0][0] < horizon: self._transfers.popleft()
+        while self._completions and self._completions[0] < horizon: self._completions.popleft()
+        span = max(1.0, min(self.window, now - self.started))
+
+        urls_per_sec = len(self._completions) / span
+        remaining = self.total - self.completed
+        eta = remaining / urls_per_sec if urls_per_sec and not self.more else None
+
+        workers = {
+            worker: {"url": job.url, "running": round(now - job.started, 1),
+                     "idle": round(now - job.last_activity, 1), "files": job.files,
+                     "bytes": job.bytes, "file": job.file}
+            for worker, job in self.jobs.items()}
+        slowest = max(workers.items(), key=lambda item: item[1]["running"], default=None)
+
+        return {
+            "elapsed": round(now - self.started, 1),
+            "urls_completed": self.completed,
+            "urls_total": self.total,
+            "more": self.more,
+            "files": self.files,
+            "skipped": self.skipped,
+            "bytes": self.bytes,
+            "files_per_sec": round(sum(t[1] for t in self._transfers) / span, 2),
+            "bytes_per_sec": round(sum(t[2] for t in self._transfers) / span),
+            "eta": round(eta) if eta is not None else None,
+            "active": len(workers),
+            "slowest": dict(slowest[1], worker=slowest[0]) if slowest else None,
+            "workers": workers,
+        }
+
+
+def to_prometheus(snapshot, prefix="gallery_dl_batch"):
+    """Renders a snapshot in the Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, kind, value, help_text, labels=None):
+        if not any(line.startswith(f"# TYPE {prefix}_{name} ") for line in lines):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+        label_text = ""
+        if labels:
+            label_text = "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items()) + "}"
+        lines.append(f"{prefix}_{name}{label_text} {value}")
+
+    metric("files_total", "counter", snapshot["files"], "Files downloaded.")
+    metric("files_skipped_total", "counter", snapshot["skipped"], "Files skipped because they already existed.")
+    metric("bytes_total", "counter", snapshot["bytes"], "Bytes downloaded.")
+    metric("urls_completed", "gauge", snapshot["urls_completed"], "URLs finished (done, failed or parked).")
+    metric("urls_total", "gauge", snapshot["urls_total"], "URLs read from the input so far.")
+    metric("files_per_second", "gauge", snapshot["files_per_sec"], "Rolling download rate in files.")
+    metric("bytes_per_second", "gauge", snapshot["bytes_per_sec"], "Rolling download rate in bytes.")
+    if snapshot["eta"] is not None:
+        metric("eta_seconds", "gauge", snapshot["eta"], "Estimated time until the batch finishes.")
+    metric("active_jobs", "gauge", snapshot["active"], "URLs being downloaded right now.")
+    for worker, job in sorted(snapshot["workers"].items()):
+        metric("job_running_seconds", "gauge", job["running"], "How long the current URL has been running.",
+               {"worker": worker, "url": job["url"]})
+        metric("job_idle_seconds", "gauge", job["idle"], "Seconds since the current URL last made progress.",
+               {"worker": worker, "url": job["url"]})
+    return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def write_textfile(path, snapshot):
+    """Atomically writes a snapshot to `path`: JSON for *.json, Prometheus text otherwise."""
+    if path.lower().endswith(".json"):
+        text = json.dumps(snapshot, indent=2)
+    else:
+        text = to_prometheus(snapshot)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,182 @@
+"""
+Staged downloads for a watched library folder.
+
+gallery-dl writes into a staging folder next to the library (same parent,
+so the same volume); the engine hands every finished file to a Publisher,
+which moves them into the library in batches with os.replace() - a rename,
+so a file appears there complete or not at all - and appends one line per
+file to the library's manifest. A folder watcher such as WallpaperRotator's
+sees one burst of renames per batch instead of a stream of half-written
+files.
+
+The manifest (MANIFEST_NAME in the library root) is JSON Lines, only ever
+appended to:
+
+    {"op": "add", "path": "sub/name.jpg", "size": 123, "mtime": 1700000000.0, "type": "image", "ts": ...}
+
+A consumer remembers how many bytes it has read and picks up from there.
+When the manifest doesn't exist yet, the first publish seeds it with the
+files already in the library, so it always describes the whole folder.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+MANIFEST_NAME = ".library-manifest.jsonl"
+# gallery-dl's download archive. While staging it lives in the staging
+# folder: its -wal/-shm files come and go with every run and would wake
+# the library's watcher. Never published.
+ARCHIVE_NAME = "archive.sqlite"
+STAGING_SUFFIX = ".staging"
+# Extensions as WallpaperRotator's FileHelper knows them.
+MEDIA_TYPES = {ext: "image" for ext in (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".gif")}
+MEDIA_TYPES.update({ext: "video" for ext in (".mp4", ".webm", ".avi", ".mkv", ".m4v")})
+# Never published: downloads in progress and gallery-dl's own bookkeeping.
+PARTIAL_SUFFIXES = (".part", ".tmp", ".ytdl")
+
+
+def default_staging_dir(library):
+    """
+    Sibling of the library folder: D:\\Wallpapers -> D:\\.Wallpapers.staging.
+    A library at a drive root has no sibling; raises ValueError.
+    """
+    library = os.path.abspath(library)
+    name = os.path.basename(library)
+    if not name: raise ValueError(f"{library} is a drive root: choose a staging folder outside it")
+    return os.path.join(os.path.dirname(library), "." + name + STAGING_SUFFIX)
+
+
+def adopt_archive(library, staging):
+    """
+    Copies the library's archive into the staging folder when staging has
+    none yet, so switching to staged downloads doesn't fetch everything
+    again. Returns True if it did.
+    """
+    source, target = os.path.join(library, ARCHIVE_NAME), os.path.join(staging, ARCHIVE_NAME)
+    if not os.path.isfile(source) or os.path.exists(target): return False
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)  # consistent even with a WAL that wasn't checkpointed
+    finally:
+        dst.close()
+        src.close()
+    return True
+
+
+def media_type(path):
+    return MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "other")
+
+
+class Publisher:
+    """
+    Moves finished files from `staging` into `library`. add() is called
+    from the event loop; publish() runs on a worker thread.
+    """
+    def __init__(self, library, staging=None):
+        self.library = os.path.abspath(library)
+        self.staging = os.path.abspath(staging or default_staging_dir(library))
+        try:
+            inside = os.path.commonpath([os.path.normcase(self.library), os.path.normcase(self.staging)]) == \
+                     os.path.normcase(self.library)
+        except ValueError:
+            inside = False  # different drives
+        if inside: raise ValueError(f"the staging folder {self.staging} is inside the library")
+        self.manifest = os.path.join(self.library, MANIFEST_NAME)
+        self.published = 0
+        self.duplicates = 0
+        self._pending = []
+        self._lock = threading.Lock()      # guards _pending
+        self._publishing = threading.Lock()  # one publish() at a time
+        os.makedirs(self.staging, exist_ok=True)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, path):
+        """Queues a finished file (a path inside the staging folder)."""
+        with self._lock:
+            self._pending.append(path)
+
+    def publish(self, sweep=False):
+        """
+        Moves the queued files into the library and records them in the
+        manifest. With `sweep`, everything else left in the staging folder
+        (sidecar files, leftovers of a crashed run) goes too, except partial
+        downloads. Returns the manifest entries of the files published.
+        """
+        with self._publishing:
+            with self._lock:
+                paths, self._pending = self._pending, []
+            if sweep:
+                queued = set(paths)
+                paths += [path for path in self._walk_staging() if path not in queued]
+            if not paths: return []
+
+            entries = []
+            for path in paths:
+                entry = self._move(path)
+                if entry is not None: entries.append(entry)
+            if sweep: self._prune_staging()
+            if entries: self._append_manifest(entries)
+            self.published += len(entries)
+            return entries
+
+    def _move(self, path):
+        rel = os.path.relpath(path, self.staging)
+        if rel.startswith(os.pardir) or not os.path.isfile(path): return None
+        target = os.path.join(self.library, rel)
+        try:
+            if os.path.exists(target):
+                # gallery-dl would have skipped it had it been able to see the library.
+                os.remove(path)
+                self.duplicates += 1
+                return None
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+            st = os.stat(target)
+        except OSError:
+            return None  # still locked (e.g. by a virus scanner); a later sweep retries
+        return {"op": "add", "path": rel.replace(os.sep, "/"), "size": st.st_size,
+                "mtime": round(st.st_mtime, 3), "type": media_type(rel)}
+
+    def _walk_staging(self):
+        for root, _, files in os.walk(self.staging):
+            for name in files:
+                if not name.endswith(PARTIAL_SUFFIXES) and not name.startswith(ARCHIVE_NAME):
+                    yield os.path.join(root, name)
+
+    def _prune_staging(self):
+        """Removes empty subfolders so they don't pile up between batches."""
+        for root, dirs, files in os.walk(self.staging, topdown=False):
+            if root != self.staging and not dirs and not files:
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+
+    def _append_manifest(self, entries):
+        seed = [] if os.path.exists(self.manifest) else self._scan_library(exclude={e["path"] for e in entries})
+        now = round(time.time(), 3)
+        text = "".join(json.dumps(dict(entry, ts=now), ensure_ascii=False) + "\n" for entry in seed + entries)
+        # One write per batch, so a reader never sees half a batch.
+        with open(self.manifest, "a", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _scan_library(self, exclude):
+        entries = []
+        for root, _, files in os.walk(self.library):
+            for name in files:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, self.library).replace(os.sep, "/")
+                if rel in exclude or name.startswith((".", ARCHIVE_NAME)): continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append({"op": "add", "path": rel, "size": st.st_size,
+                                "mtime": round(st.st_mtime, 3), "type": media_type(name)})
+        return entries
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Subscriptions: saved gallery lists that are re-synced on a schedule.
+
+A subscription list ("artists", "tags", ...) is a named set of gallery URLs
+with a sync interval. Syncing runs the due URLs as an ordinary batch, but
+incrementally: the archive is always used and gallery-dl stops walking a
+gallery after `abort_after` files in a row that it already has (--abort),
+so a sync only fetches the newest page or two of each gallery.
+
+Every URL keeps its own schedule in SUBSCRIPTIONS_FILE: when it was last
+synced and what that found, its high-water mark (the newest file it
+delivered) and when it last changed. A sync that finds nothing new doubles
+the URL's interval, up to MAX_BACKOFF times the list's; one that finds new
+files resets it. Galleries that rarely change are therefore polled rarely.
+
+The GUI syncs due subscriptions while it is idle. Without it:
+
+    python gallery_dl_subscriptions.py add artists URL... --every 168
+    python gallery_dl_subscriptions.py sync --watch
+"""
+import argparse
+import collections
+import json
+import math
+import os
+import random
+import signal
+import sqlite3
+import sys
+import time
+
+from gallery_dl_config import CONFIG_DIR, SETTINGS_FILE
+from gallery_dl_engine import BatchEngine, BatchOptions, iter_url_file
+from gallery_dl_journal import JOURNAL_FILE
+from gallery_dl_urls import normalize_url
+
+SUBSCRIPTIONS_FILE = os.path.join(CONFIG_DIR, "subscriptions.sqlite")
+DEFAULT_LIST = "default"
+DEFAULT_INTERVAL = 168.0  # hours
+MIN_INTERVAL = 0.25
+DEFAULT_ABORT_AFTER = 5  # files in a row already downloaded that end a gallery's sync
+MAX_BACKOFF = 8  # an unchanged gallery is synced at most this many times less often than its list
+JITTER = 0.1  # share of an interval taken off at random, so syncs of a big list spread out
+WATCH_POLL = 900.0  # --watch looks for new subscriptions at least this often (seconds)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lists (
+    name     TEXT PRIMARY KEY,
+    interval REAL NOT NULL  -- hours between syncs while the galleries change
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS subscriptions (
+    key         TEXT PRIMARY KEY,  -- normalize_url() of the URL
+    url         TEXT NOT NULL,
+    list        TEXT NOT NULL,
+    added       REAL NOT NULL,
+    next_sync   REAL NOT NULL,
+    last_sync   REAL,              -- last successful sync
+    last_change REAL,              -- last sync that found new files
+    high_water  TEXT,              -- newest file delivered so far
+    new_files   INTEGER NOT NULL DEFAULT 0,  -- found by the last sync
+    total_files INTEGER NOT NULL DEFAULT 0,
+    syncs       INTEGER NOT NULL DEFAULT 0,
+    idle        INTEGER NOT NULL DEFAULT 0,  -- syncs in a row without new files
+    error       TEXT               -- why the last sync failed, if it did
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS subscriptions_due ON subscriptions (next_sync);
+CREATE INDEX IF NOT EXISTS subscriptions_list ON subscriptions (list);
+"""
+FIELDS = ("url", "list", "added", "next_sync", "last_sync", "last_change", "high_water", "new_files",
+          "total_files", "syncs", "idle", "error")
+
+
+def next_interval(hours, idle):
+    """Seconds until the next sync of a gallery that came up empty `idle` times in a row."""
+    return hours * 3600 * min(MAX_BACKOFF, 2 ** idle) * random.uniform(1 - JITTER, 1)
+
+
+def sync_options(options, abort_after=DEFAULT_ABORT_AFTER):
+    """A batch's options turned incremental: archive on, --abort, and no skipping of fresh URLs."""
+    return BatchOptions(**dict(options.to_dict(), use_archive=True, skip_fresh=0.0,
+                               abort_after=max(1, int(abort_after))))
+
+
+class SubscriptionStore:
+    """SQLite-backed subscriptions. Like JobJournal, a connection belongs to the thread that opened it."""
+    def __init__(self, path=SUBSCRIPTIONS_FILE):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # --- Lists ---
+    def interval(self, name):
+        """A list's interval in hours, or None if there is no such list."""
+        row = self.db.execute("SELECT interval FROM lists WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_list(self, name, interval=None):
+        """Creates a list or changes its interval; returns the interval in hours."""
+        current = self.interval(name)
+        if interval is None:
+            if current is not None: return current
+            interval = DEFAULT_INTERVAL
+        interval = max(MIN_INTERVAL, float(interval))
+        self.db.execute("INSERT OR REPLACE INTO lists (name, interval) VALUES (?, ?)", (name, interval))
+        return interval
+
+    def lists(self):
+        """[(name, interval, subscriptions, due now)] for every list."""
+        return self.db.execute(
+            "SELECT l.name, l.interval, COUNT(s.key), COALESCE(SUM(s.next_sync <= ?), 0) FROM lists l "
+            "LEFT JOIN subscriptions s ON s.list = l.name GROUP BY l.name ORDER BY l.name",
+            (time.time(),)).fetchall()
+
+    # --- Subscriptions ---
+    def add(self, name, urls, interval=None):
+        """
+        Subscribes `urls` to a list, creating it if needed; URLs already
+        subscribed elsewhere move over. New ones are due at once. Returns
+        the number of new subscriptions.
+        """
+        self.set_list(name, interval)
+        now = time.time()
+        added = 0
+        with self.db:
+            self.db.execute("BEGIN")
+            for url in urls:
+                url = url.strip()
+                if not url: continue
+                key = normalize_url(url)
+                if self.db.execute("UPDATE subscriptions SET list = ? WHERE key = ?", (name, key)).rowcount: continue
+                self.db.execute("INSERT INTO subscriptions (key, url, list, added, next_sync) VALUES (?, ?, ?, ?, ?)",
+                                (key, url, name, now, now))
+                added += 1
+        return added
+
+    def remove(self, urls=(), name=None):
+        """Unsubscribes `urls`, or with `name` a whole list. Returns how many were removed."""
+        with self.db:
+            self.db.execute("BEGIN")
+            if name is not None:
+                removed = self.db.execute("DELETE FROM subscriptions WHERE list = ?", (name,)).rowcount
+                self.db.execute("DELETE FROM lists WHERE name = ?", (name,))
+                return removed
+            return sum(self.db.execute("DELETE FROM subscriptions WHERE key = ?", (normalize_url(url),)).rowcount
+                       for url in urls)
+
+    def due(self, names=None, by=None):
+        """URLs due for a sync by `by` (default: now; math.inf for all), the longest overdue first."""
+        query = "SELECT url FROM subscriptions WHERE next_sync <= ?"
+        params = [time.time() if by is None else by]
+        if names:
+            query += f" AND list IN ({','.join('?' * len(names))})"
+            params.extend(names)
+        return [row[0] for row in self.db.execute(query + " ORDER BY next_sync", params)]
+
+    def next_due(self, names=None):
+        """When the next subscription falls due (epoch seconds), or None if there are none."""
+        query = "SELECT MIN(next_sync) FROM subscriptions"
+        params = list(names or ())
+        if names: query += f" WHERE list IN ({','.join('?' * len(names))})"
+        return self.db.execute(query, params).fetchone()[0]
+
+    def rows(self, name=None):
+        """Every subscription (of one list) as a dict, by list and URL."""
+        query = f"SELECT {', '.join(FIELDS)} FROM subscriptions"
+        params = ()
+        if name is not None:
+            query += " WHERE list = ?"
+            params = (name,)
+        return [dict(zip(FIELDS, row)) for row in self.db.execute(query + " ORDER BY list, url", params)]
+
+    def record(self, url, ok, new_files=0, newest=None, error=None, permanent=False, now=None):
+        """
+        Stores the outcome of syncing `url` and schedules the next sync.
+        A failed sync keeps the current interval; a permanent failure (the
+        gallery is gone) is tried again after the longest one. Returns the
+        next sync time, or None if the URL was unsubscribed meanwhile.
+        """
+        row = self.db.execute("SELECT s.key, s.idle, l.interval FROM subscriptions s "
+                              "JOIN lists l ON l.name = s.list WHERE s.key = ?", (normalize_url(url),)).fetchone()
+        if row is None: return None
+        key, idle, hours = row
+        now = time.time() if now is None else now
+        if not ok:
+            next_sync = now + next_interval(hours, math.log2(MAX_BACKOFF) if permanent else idle)
+            self.db.execute("UPDATE subscriptions SET next_sync = ?, error = ? WHERE key = ?",
+                            (next_sync, error or "failed", key))
+            return next_sync
+        idle = 0 if new_files else idle + 1
+        next_sync = now + next_interval(hours, idle)
+        self.db.execute(
+            "UPDATE subscriptions SET next_sync = ?, last_sync = ?, new_files = ?, total_files = total_files + ?, "
+            "syncs = syncs + 1, idle = ?, error = NULL, high_water = COALESCE(?, high_water), "
+            "last_change = CASE WHEN ? > 0 THEN ? ELSE last_change END WHERE key = ?",
+            (next_sync, now, new_files, new_files, idle, newest, new_files, now, key))
+        return next_sync
+
+
+class SyncRun:
+    """
+    Follows the events of a sync batch and records every URL's outcome once
+    the batch ends. on_event() may be called on the engine thread; finish()
+    opens its own store connection.
+    """
+    def __init__(self, urls, path=SUBSCRIPTIONS_FILE):
+        self.urls = list(urls)
+        self.path = path
+        self.new_files = collections.Counter()
+        self.newest = {}
+        self.ok = set()
+        self.errors = {}
+
+    def on_event(self, event):
+        kind = event["event"]
+        if kind == "file_finished":
+            url = event["url"]
+            self.new_files[url] += 1
+            self.newest.setdefault(url, os.path.basename(event["path"]))  # galleries list newest first
+        elif kind == "url_finished":
+            if event["ok"]: self.ok.add(event["url"])
+            elif event.get("message"): self.errors[event["url"]] = event["message"]
+        elif kind == "url_parked":
+            self.errors[event["url"]] = event.get("message") or f"exit code {event['returncode']}"
+
+    def finish(self, summary):
+        """
+        Records the URLs that finished or failed for good; interrupted and
+        unstarted ones stay due. Returns (synced, changed, new files).
+        """
+        failed, parked = set(summary.get("failed", ())), set(summary.get("parked", ()))
+        store = SubscriptionStore(self.path)
+        try:
+            for url in self.urls:
+                if url in self.ok:
+                    store.record(url, True, self.new_files[url], self.newest.get(url))
+                elif url in failed or url in parked:
+                    store.record(url, False, error=self.errors.get(url), permanent=url in parked)
+        finally:
+            store.close()
+        changed = sum(1 for url in self.ok if self.new_files[url])
+        return len(self.ok), changed, sum(self.new_files[url] for url in self.ok)
+
+
+def format_when(ts, now=None):
+    """'in 3d 4h' / '2h ago' / 'never'."""
+    if ts is None: return "never"
+    delta = ts - (time.time() if now is None else now)
+    seconds = int(abs(delta))
+    if seconds >= 86400: text = f"{seconds // 86400}d {seconds % 86400 // 3600}h"
+    elif seconds >= 3600: text = f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    else: text = f"{seconds // 60}m"
+    return f"in {text}" if delta > 0 else f"{text} ago"
+
+
+def format_rows(rows, now=None):
+    """One line per subscription: URL, last sync, what it found, its newest file, next sync."""
+    for row in rows:
+        state = f"error: {row['error']}" if row["error"] else f"+{row['new_files']} new"
+        if row["high_water"]: state += f", newest {row['high_water']}"
+        yield (f"[{row['list']}] {row['url']}  synced {format_when(row['last_sync'], now)} ({state}), "
+               f"changed {format_when(row['last_change'], now)}, next {format_when(row['next_sync'], now)}")
+
+
+# --- Command Line ---
+def load_settings(path):
+    if not os.path.exists(path): return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def sync_once(store_path, settings, args, stop):
+    """Syncs the due subscriptions in one batch; returns its summary, or None if nothing was due."""
+    store = SubscriptionStore(store_path)
+    try:
+        urls = store.due(args.list, by=math.inf if args.all else None)
+    finally:
+        store.close()
+    if not urls: return None
+
+    overrides = {"dest": args.dest} if args.dest else {}
+    if args.workers: overrides["max_workers"] = args.workers
+    if args.gallery_dl: overrides["executable"] = args.gallery_dl
+    options = BatchOptions.from_settings(settings, **overrides)
+    abort_after = args.abort_after or settings.get("subscription_abort_after", DEFAULT_ABORT_AFTER)
+    run = SyncRun(urls, store_path)
+
+    def on_event(event):
+        run.on_event(event)
+        if event["event"] in ("output", "file_started", "file_finished", "file_skipped", "derived"): return
+        sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    engine = BatchEngine(sync_options(options, abort_after), on_event=on_event,
+                         journal_path=None if args.no_journal else args.journal)
+    stop.append(engine)
+    try:
+        summary = engine.run(iter(urls))
+    finally:
+        stop.remove(engine)
+    synced, changed, files = run.finish(summary)
+    store = SubscriptionStore(store_path)
+    try:
+        next_due = store.next_due(args.list)
+    finally:
+        store.close()
+    sys.stdout.write(json.dumps({"event": "sync_finished", "ts": round(time.time(), 3), "due": len(urls),
+                                 "synced": synced, "changed": changed, "new_files": files,
+                                 "next_due": next_due}) + "\n")
+    sys.stdout.flush()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Manage gallery subscriptions and re-sync them incrementally: each sync only fetches "
+                    "files that are new since the last one.")
+    parser.add_argument("--db", default=SUBSCRIPTIONS_FILE, help="subscriptions database (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="subscribe URLs to a list (created if needed)")
+    add.add_argument("list", help="list name")
+    add.add_argument("urls", nargs="*")
+    add.add_argument("-i", "--input-file", action="append", default=[], metavar="FILE", help="read URLs from FILE")
+    add.add_argument("--every", type=float, default=None, metavar="HOURS",
+                     help=f"sync interval of the list (default for a new list: {DEFAULT_INTERVAL:g})")
+
+    remove = commands.add_parser("remove", help="unsubscribe URLs, or a whole list")
+    remove.add_argument("urls", nargs="*")
+    remove.add_argument("--list", default=None, help="remove this list and all its subscriptions")
+
+    show = commands.add_parser("list", help="show lists, or the subscriptions of one list")
+    show.add_argument("list", nargs="?")
+
+    sync = commands.add_parser("sync", help="sync the due subscriptions (settings from the GUI's settings.json)")
+    sync.add_argument("--list", action="append", default=None, help="only this list; may be repeated")
+    sync.add_argument("--all", action="store_true", help="sync everything, due or not")
+    sync.add_argument("--watch", action="store_true", help="keep running and sync whatever falls due")
+    sync.add_argument("--settings", default=SETTINGS_FILE, help="settings file (default: %(default)s)")
+    sync.add_argument("-d", "--dest", default="", help="save directory (default: save_dir from the settings)")
+    sync.add_argument("-w", "--workers", type=int, default=0, help="parallel gallery-dl processes")
+    sync.add_argument("--gallery-dl", default="", metavar="PATH", help="gallery-dl executable")
+    sync.add_argument("--abort-after", type=int, default=0, metavar="N",
+                      help="files in a row already downloaded that end a gallery's sync "
+                           f"(default: subscription_abort_after from the settings, or {DEFAULT_ABORT_AFTER})")
+    sync.add_argument("--journal", default=JOURNAL_FILE, metavar="PATH", help="job journal (default: %(default)s)")
+    sync.add_argument("--no-journal", action="store_true", help="do not record syncs in the journal")
+    args = parser.parse_args(argv)
+
+    try:
+        store = SubscriptionStore(args.db)
+    except sqlite3.Error as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    try:
+        if args.command == "add":
+            urls = list(args.urls)
+            for path in args.input_file: urls.extend(iter_url_file(path))
+            added = store.add(args.list, urls, args.every)
+            print(f"{added} new subscriptions in '{args.list}' (every {store.interval(args.list):g}h)")
+            return 0
+        if args.command == "remove":
+            if args.list is None and not args.urls: parser.error("give URLs or --list")
+            print(f"{store.remove(args.urls, args.list)} subscriptions removed")
+            return 0
+        if args.command == "list":
+            if args.list:
+                for line in format_rows(store.rows(args.list)): print(line)
+            else:
+                for name, interval, count, due in store.lists():
+                    print(f"{name}: {count} subscriptions, every {interval:g}h, {due} due")
+            return 0
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        store.close()
+
+    try:
+        settings = load_settings(args.settings)
+    except (OSError, ValueError) as e:
+        print(f"error: cannot read settings: {e}", file=sys.stderr)
+        return 2
+    if not (args.dest or settings.get("save_dir")):
+        print("error: no save directory (--dest or save_dir in the settings)", file=sys.stderr)
+        return 2
+
+    running, signalled = [], []
+
+    def on_signal(signum, frame):
+        # Like the engine: the first Ctrl+C/SIGTERM stops gracefully, the second one kills.
+        if not running: raise KeyboardInterrupt
+        for engine in running: engine.stop(hard=bool(signalled))
+        signalled.append(signum)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, on_signal)
+    failed = False
+    try:
+        while not signalled:
+            summary = sync_once(args.db, settings, args, running)
+            if summary is not None: failed = failed or bool(summary["failed"])
+            if not args.watch: break
+            args.all = False  # --all only for the first round
+            store = SubscriptionStore(args.db)
+            try:
+                next_due = store.next_due(args.list)
+            finally:
+                store.close()
+            wait = WATCH_POLL if next_due is None else next_due - time.time()
+            time.sleep(min(WATCH_POLL, max(1.0, wait)))
+    except KeyboardInterrupt:
+        return 130
+    if signalled: return 130
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
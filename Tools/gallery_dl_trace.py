@@ -0,0 +1,128 @@
+"""
+Optional timing trace for a batch.
+
+Every URL is broken into phases on its worker's track:
+
+    throttle  waiting for room in the bandwidth budget
+    spawn     starting the gallery-dl process (checkout: taking a
+              persistent worker from the pool)
+    startup   process start to gallery-dl's first output: interpreter and
+              extractor startup plus the site's first response
+    extract   between files: gallery-dl talking to the site (metadata,
+              pagination, rate-limit sleeps)
+    download  from "file started" to "file finished/skipped": the transfer
+              and writing the file
+    exit      last output line to the process exiting (archive commit,
+              post-processors, shutdown)
+
+plus the time each URL waited in the scheduler ("queued", an async span,
+since many URLs wait at once) and, in the GUI, every console refresh on
+a "GUI" track. write() saves everything as Chrome trace JSON, which
+chrome://tracing and https://ui.perfetto.dev open; summary() condenses it
+into one row per phase.
+"""
+import json
+import threading
+import time
+
+PHASES = ("queued", "throttle", "spawn", "checkout", "startup", "extract", "download", "exit", "log pump")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class JobTimeline:
+    """The phases of one URL on one worker; each phase() call ends the previous one."""
+    __slots__ = ("trace", "track", "url", "started", "phase_name", "phase_started")
+
+    def __init__(self, trace, track, url):
+        self.trace = trace
+        self.track = track
+        self.url = url
+        self.started = self.phase_started = trace.clock()
+        self.phase_name = None
+
+    def phase(self, name):
+        now = self.trace.clock()
+        if self.phase_name is not None:
+            self.trace.span(self.phase_name, self.track, self.phase_started, now, url=self.url)
+        self.phase_name, self.phase_started = name, now
+
+    def close(self, **args):
+        self.phase(None)
+        self.trace.span("url", self.track, self.started, self.phase_started, url=self.url, **args)
+
+
+class BatchTrace:
+    """
+    Collects spans; safe to feed from the engine's loop thread and the GUI
+    thread at once.
+    """
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.origin = clock()
+        self.events = []
+        self.durations = {}  # phase -> [seconds]
+        self._tracks = {}    # name -> tid
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def job(self, track, url):
+        return JobTimeline(self, track, url)
+
+    def _tid(self, track):
+        tid = self._tracks.get(track)
+        if tid is None:
+            tid = self._tracks[track] = len(self._tracks) + 1
+            self.events.append({"ph": "M", "name": "thread_name", "pid": 1, "tid": tid, "args": {"name": track}})
+        return tid
+
+    def _us(self, t):
+        return round((t - self.origin) * 1e6)
+
+    def span(self, name, track, start, end, **args):
+        with self._lock:
+            self.events.append({"ph": "X", "name": name, "cat": "phase" if name != "url" else "url",
+                                "pid": 1, "tid": self._tid(track), "ts": self._us(start),
+                                "dur": max(0, self._us(end) - self._us(start)), "args": args})
+            if name != "url": self.durations.setdefault(name, []).append(end - start)
+
+    def wait(self, name, start, end, **args):
+        """A span that overlaps others of its kind (e.g. URLs waiting in the queue)."""
+        with self._lock:
+            self._next_id += 1
+            common = {"name": name, "cat": name, "pid": 1, "id": self._next_id}
+            self.events.append(dict(common, ph="b", ts=self._us(start), args=args))
+            self.events.append(dict(common, ph="e", ts=self._us(end)))
+            self.durations.setdefault(name, []).append(end - start)
+
+    def write(self, path):
+        with self._lock:
+            data = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    def summary(self):
+        """One row per phase: count, total, mean, p50, p95 and max in seconds."""
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self.durations.items()}
+        order = {name: i for i, name in enumerate(PHASES)}
+        rows = []
+        for name in sorted(durations, key=lambda n: (order.get(n, len(order)), n)):
+            values = durations[name]
+            total = sum(values)
+            rows.append({"phase": name, "count": len(values), "total": round(total, 3),
+                         "mean": round(total / len(values), 3), "p50": round(percentile(values, 0.5), 3),
+                         "p95": round(percentile(values, 0.95), 3), "max": round(values[-1], 3)})
+        return rows
+
+
+def format_summary(rows):
+    """The summary as aligned text lines."""
+    lines = [f"{'phase':<10} {'count':>7} {'total s':>10} {'mean s':>8} {'p50 s':>8} {'p95 s':>8} {'max s':>8}"]
+    for r in rows:
+        lines.append(f"{r['phase']:<10} {r['count']:>7} {r['total']:>10.2f} {r['mean']:>8.3f} "
+                     f"{r['p50']:>8.3f} {r['p95']:>8.3f} {r['max']:>8.3f}")
+    return lines
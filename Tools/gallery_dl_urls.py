@@ -0,0 +1,125 @@
+"""
+URL bookkeeping for the gallery-dl GUI's queue box.
+
+normalize_url() maps trivially different spellings of a URL (http vs https,
+upper-case host, trailing slash, tracking parameters, parameter order) to
+one key. UrlQueue indexes the box's lines by that key, so adding a paste or
+a clipboard hit costs time proportional to the new lines, not to the
+thousands already queued.
+
+extract_urls() and iter_file_urls() pull http(s) URLs out of arbitrary
+text: plain lists, browser bookmark exports (HTML or JSON), saved pages.
+Files are read in fixed-size blocks, so a 50 MB export (even one without
+line breaks) never has to fit in memory.
+"""
+import html
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only say where a link was clicked.
+TRACKING_PARAMS = frozenset((
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "igshid", "igsh",
+    "mc_cid", "mc_eid", "_ga", "_gl", "ref_src", "ref_url", "spm",
+))
+TRACKING_PREFIXES = ("utm_",)
+
+URL_PATTERN = re.compile(r"""https?://[^\s"'<>`\\{}|^\[\]]+""", re.IGNORECASE)
+# Characters a URL may be followed by in text; a file is split after the last one in a block.
+DELIMITER_PATTERN = re.compile(r"""[\s"'<>]""")
+TRAILING_PUNCTUATION = ".,;:!?"
+READ_BLOCK = 1024 * 1024
+MAX_URL_LENGTH = 8192
+
+
+def extract_urls(text):
+    """Yields every http(s) URL in `text`, with HTML entities and JSON escapes undone."""
+    if "\\/" in text: text = text.replace("\\/", "/")  # JSON exports may escape slashes
+    for match in URL_PATTERN.finditer(text):
+        url = match.group().rstrip(TRAILING_PUNCTUATION)
+        # Drop a closing parenthesis that belongs to the sentence, keep one
+        # that belongs to the URL (https://en.wikipedia.org/wiki/Foo_(bar)).
+        while url.endswith(")") and url.count(")") > url.count("("):
+            url = url[:-1].rstrip(TRAILING_PUNCTUATION)
+        if "&" in url: url = html.unescape(url)
+        if len(url) > 10: yield url
+
+
+def iter_file_urls(path):
+    """Yields the URLs found in a file of any text format, reading it a block at a time."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        carry = ""
+        while True:
+            block = f.read(READ_BLOCK)
+            if not block: break
+            text = carry + block
+            # Keep the last, possibly cut-off token for the next block.
+            cut = len(text)
+            for cut_match in DELIMITER_PATTERN.finditer(text, max(0, len(text) - MAX_URL_LENGTH)):
+                cut = cut_match.end()
+            carry = text[cut:]
+            yield from extract_urls(text[:cut])
+        yield from extract_urls(carry)
+
+
+def normalize_url(url):
+    """Dedup key for a URL. Anything that doesn't parse as http(s) is returned stripped."""
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname: return url
+
+    host = parts.hostname
+    if port is not None and port not in (80, 443): host = f"{host}:{port}"
+    path = parts.path.rstrip("/")
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k not in TRACKING_PARAMS and not k.startswith(TRACKING_PREFIXES))
+    return urlunsplit(("https", host, path, urlencode(query), parts.fragment))
+
+
+def is_url_line(line):
+    return bool(line) and not line.startswith("#")
+
+
+def unique_urls(lines):
+    """Yields the URL lines of `lines`, dropping later spellings of a URL already seen."""
+    seen = UrlQueue()
+    for line in lines:
+        yield from seen.add((line,))
+
+
+class UrlQueue:
+    """
+    Index of the URLs in the queue box. `add()` is incremental; `reset()`
+    rebuilds from the full text and is only needed after free-form edits.
+    """
+    def __init__(self):
+        self._keys = set()  # normalized URLs
+
+    def __len__(self):
+        """Number of distinct URLs."""
+        return len(self._keys)
+
+    def __contains__(self, url):
+        return normalize_url(url) in self._keys
+
+    def add(self, lines):
+        """Indexes the URLs among `lines` that aren't queued yet; returns them, in order."""
+        added = []
+        for line in lines:
+            line = line.strip()
+            if not is_url_line(line): continue
+            key = normalize_url(line)
+            if key in self._keys: continue
+            self._keys.add(key)
+            added.append(line)
+        return added
+
+    def reset(self, text):
+        self._keys = {normalize_url(line) for line in map(str.strip, text.splitlines()) if is_url_line(line)}
+
+    def clear(self):
+        self._keys.clear()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Persistent gallery-dl workers for the batch engine.
+
+Spawning the gallery-dl executable for every URL pays interpreter startup,
+extractor imports and config parsing each time, which dominates batches of
+many small galleries. Run as a script, this module imports gallery-dl once
+and then executes one job per line read from stdin, each with the same argv
+the executable would get. Output goes to stdout as usual; the end of a job
+is marked by a line starting with MARKER that carries the exit status and
+the worker's resident memory.
+
+WorkerPool is the engine side: it hands out idle workers, starts new ones
+on demand and retires them after `recycle_jobs` jobs or once they grow past
+`recycle_mb` megabytes, so leaks in extractors can't pile up.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+
+# NUL + tag; gallery-dl itself never prints this, and unlike control
+# characters such as \x1e, str.strip() leaves it alone.
+MARKER = "\x00GALLERY-DL-WORKER"
+# Seconds an idle worker gets to exit after its stdin is closed.
+EXIT_TIMEOUT = 5.0
+
+
+class WorkerStartError(Exception):
+    """A worker could not be started, e.g. gallery-dl is not importable."""
+
+
+# --- Worker process ---
+def rss_bytes(peak=False):
+    """Resident memory of this process (its high-water mark with `peak`), or 0 if the platform won't say."""
+    try:
+        if not peak:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+            return counters.PeakWorkingSetSize if peak else counters.WorkingSetSize
+        except Exception:
+            return 0
+    try:
+        import resource
+    except ImportError:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # peak, the best macOS offers
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def run_job(gallery_dl, argv):
+    """Runs gallery-dl's command line entry point in this interpreter; returns its exit status."""
+    # main() loads the config files and adds its logging handlers every
+    # time, so start each job from the state a fresh process would have.
+    gallery_dl.config.clear()
+    for name in (None, "unsupported", "errorfile"):
+        logger = logging.getLogger(name)
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+    sys.argv = ["gallery-dl", *argv]
+    try:
+        return gallery_dl.main() or 0
+    except SystemExit as e:  # argparse errors, KeyboardInterrupt
+        if isinstance(e.code, int): return e.code
+        if e.code: print(e.code)
+        return 1
+    except Exception as e:
+        print(f"[worker][error] {e.__class__.__name__}: {e}")
+        return 1
+
+
+def serve():
+    # gallery-dl reconfigures the standard streams on every run, which
+    # fails on a stream that has been read from; jobs get their own handle.
+    jobs = sys.stdin
+    sys.stdin = open(os.devnull, "r")
+    try:
+        import gallery_dl
+    except ImportError as e:
+        print(f"gallery-dl is not importable by {sys.executable}: {e}", flush=True)
+        return 1
+    out = sys.stdout  # gallery-dl may replace sys.stdout; keep the pipe
+    out.write(f"{MARKER} ready {gallery_dl.version.__version__}\n")
+    out.flush()
+    for line in jobs:
+        if not line.strip(): continue
+        status = run_job(gallery_dl, json.loads(line)["argv"])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        out.write(f"\n{MARKER} done {status} {rss_bytes()}\n")
+        out.flush()
+    return 0
+
+
+# --- Engine side ---
+class PooledWorker:
+    """One running worker process. Only used from the event loop thread."""
+    def __init__(self, process, version):
+        self.process = process
+        self.version = version
+        self.jobs = 0
+        self.rss = 0
+        self.dead = False
+
+    async def run(self, argv, on_line):
+        """
+        Runs one job, passing every output line to `on_line`. Returns the
+        exit status; if the worker dies halfway, its own exit code.
+        """
+        self.jobs += 1
+        self.process.stdin.write((json.dumps({"argv": argv}) + "\n").encode("utf-8"))
+        try:
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # it died; reading below finds out why
+        while True:
+            try:
+                raw = await self.process.stdout.readline()
+            except ValueError:
+                continue  # overlong line, the rest is dropped
+            if not raw: break
+            line = raw.decode("utf-8", errors="replace").strip()
+            if line.startswith(MARKER):
+                _, _, status, rss = line.split()
+                self.rss = int(rss)
+                return int(status)
+            if line: on_line(line)
+        self.dead = True
+        return await self.process.wait()
+
+    async def close(self):
+        if self.process.returncode is None:
+            try:
+                self.process.stdin.close()
+                await asyncio.wait_for(self.process.wait(), EXIT_TIMEOUT)
+            except (asyncio.TimeoutError, OSError):
+                self.process.kill()
+                await self.process.wait()
+
+
+class WorkerPool:
+    """
+    Idle persistent workers plus the means to start more. `spawn_kwargs`
+    are passed to asyncio.create_subprocess_exec (process group, startup
+    info). checkout() raises WorkerStartError if a worker can't start.
+    """
+    def __init__(self, python=sys.executable, recycle_jobs=200, recycle_mb=512, spawn_kwargs=None,
+                 line_limit=2 ** 16):
+        self.python = python
+        self.recycle_jobs = max(1, int(recycle_jobs))
+        self.recycle_bytes = max(1, int(recycle_mb)) * 1024 * 1024
+        self.spawn_kwargs = dict(spawn_kwargs or {})
+        self.line_limit = line_limit
+        self.idle = []
+        self.started = 0
+        self.retired = 0
+        self._closing = set()
+
+    async def checkout(self):
+        if self.idle: return self.idle.pop()
+        return await self._spawn()
+
+    def checkin(self, worker):
+        """Returns a worker after a job; retires it if it died or is due for recycling."""
+        if worker.dead or worker.process.returncode is not None:
+            self.retired += 1
+            return
+        if worker.jobs >= self.recycle_jobs or worker.rss >= self.recycle_bytes:
+            self.retired += 1
+            task = asyncio.ensure_future(worker.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+            return
+        self.idle.append(worker)
+
+    async def close(self):
+        workers, self.idle = self.idle, []
+        await asyncio.gather(*(w.close() for w in workers), *self._closing, return_exceptions=True)
+
+    async def _spawn(self):
+        env = dict(os.environ, PYTHONIOENCODING="utf-8")
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.python, "-u", os.path.abspath(__file__),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                limit=self.line_limit,
+                env=env,
+                **self.spawn_kwargs
+            )
+        except OSError as e:
+            raise WorkerStartError(f"cannot start {self.python}: {e}") from e
+
+        first = (await process.stdout.readline()).decode("utf-8", errors="replace").strip()
+        if not first.startswith(MARKER + " ready"):
+            rest = (await process.stdout.read()).decode("utf-8", errors="replace").strip()
+            await process.wait()
+            raise WorkerStartError(first or rest or f"worker exited with {process.returncode}")
+        self.started += 1
+        return PooledWorker(process, first.split()[-1])
+
+
+if __name__ == "__main__":
+    sys.exit(serve())
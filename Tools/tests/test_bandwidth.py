@@ -0,0 +1,156 @@
+import datetime
+
+import pytest
+
+from gallery_dl_bandwidth import (MIN_RATE, BandwidthSchedule, BandwidthShaper, _expand_days, parse_rate,
+                                  parse_schedule_specs)
+
+K, M = 1024, 1024 * 1024
+MONDAY = datetime.datetime(2024, 1, 1)  # a Monday
+
+
+def at(day, clock):
+    hours, minutes = map(int, clock.split(":"))
+    return MONDAY + datetime.timedelta(days=("mon", "tue", "wed", "thu", "fri", "sat", "sun").index(day),
+                                       hours=hours, minutes=minutes)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("500k", 500 * K),
+    ("2.5M", int(2.5 * M)),
+    ("1 MB/s", M),
+    ("1MiB", M),
+    ("1G", 1024 * M),
+    ("4096", 4096),
+    ("", None),
+    ("0", None),
+    (None, None),
+])
+def test_parse_rate(text, expected):
+    assert parse_rate(text) == expected
+
+
+@pytest.mark.parametrize("text", ["fast", "1x", "-1M"])
+def test_parse_rate_rejects(text):
+    with pytest.raises(ValueError):
+        parse_rate(text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("sat", ["sat"]),
+    ("mon-fri", ["mon", "tue", "wed", "thu", "fri"]),
+    ("fri-mon", ["fri", "sat", "sun", "mon"]),
+    ("sun-sun", ["sun"]),
+    ("mon-wed,sat", ["mon", "tue", "wed", "sat"]),
+    ("Monday-Tuesday", ["mon", "tue"]),
+])
+def test_expand_days(text, expected):
+    assert _expand_days(text) == expected
+
+
+@pytest.mark.parametrize("text", ["funday", "mon-xyz"])
+def test_expand_days_rejects(text):
+    with pytest.raises(ValueError):
+        _expand_days(text)
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("22:00-06:00=0", {"from": "22:00", "to": "06:00", "limit": "0"}),
+    ("fri-mon@08:00-18:00=2M", {"from": "08:00", "to": "18:00", "limit": "2M",
+                                "days": ["fri", "sat", "sun", "mon"]}),
+    ("sat@00:00-24:00=", {"from": "00:00", "to": "24:00", "limit": "", "days": ["sat"]}),
+])
+def test_parse_schedule_specs(spec, expected):
+    assert parse_schedule_specs([spec]) == [expected]
+
+
+@pytest.mark.parametrize("spec", ["08:00-18:00", "08:00=1M", "mon@08:00=1M"])
+def test_parse_schedule_specs_rejects(spec):
+    with pytest.raises(ValueError):
+        parse_schedule_specs([spec])
+
+
+NIGHT_FRIDAY = BandwidthSchedule("1M", [{"from": "22:00", "to": "06:00", "limit": "100k", "days": ["fri"]}])
+WORK_HOURS = BandwidthSchedule(None, [
+    {"from": "08:00", "to": "18:00", "limit": "2M", "days": ["mon", "tue", "wed", "thu", "fri"]},
+    {"from": "12:00", "to": "13:00", "limit": "500k"},  # shadowed on weekdays: the first matching rule wins
+])
+
+
+@pytest.mark.parametrize("schedule, when, expected", [
+    (NIGHT_FRIDAY, at("fri", "23:00"), 100 * K),
+    (NIGHT_FRIDAY, at("sat", "02:00"), 100 * K),  # after midnight, still Friday's rule
+    (NIGHT_FRIDAY, at("sat", "06:00"), M),        # end is exclusive
+    (NIGHT_FRIDAY, at("fri", "02:00"), M),        # belongs to Thursday night
+    (NIGHT_FRIDAY, at("sat", "23:00"), M),
+    (NIGHT_FRIDAY, at("fri", "21:59"), M),
+    (WORK_HOURS, at("mon", "08:00"), 2 * M),
+    (WORK_HOURS, at("mon", "17:59"), 2 * M),
+    (WORK_HOURS, at("mon", "18:00"), None),
+    (WORK_HOURS, at("wed", "12:30"), 2 * M),
+    (WORK_HOURS, at("sat", "12:30"), 500 * K),
+    (WORK_HOURS, at("sun", "09:00"), None),
+])
+def test_schedule_limit_at(schedule, when, expected):
+    assert schedule.limit_at(when) == expected
+
+
+def test_schedule_is_false_without_any_limit():
+    assert not BandwidthSchedule(None, [{"from": "08:00", "to": "18:00", "limit": ""}])
+    assert BandwidthSchedule(None, [{"from": "08:00", "to": "18:00", "limit": "1M"}])
+
+
+def test_schedule_rejects_unknown_day():
+    with pytest.raises(ValueError):
+        BandwidthSchedule(None, [{"from": "08:00", "to": "18:00", "limit": "1M", "days": ["someday"]}])
+
+
+def shaper(limit, max_workers=4, rates=None):
+    shaper = BandwidthShaper(BandwidthSchedule(limit), max_workers)
+    shaper.rates.update(rates or {})
+    return shaper
+
+
+@pytest.mark.parametrize("limit, rates, expected, result", [
+    (None, {}, 3, None),                           # unlimited
+    ("1M", {}, 1, M),
+    ("1M", {}, 2, M // 2),
+    ("1M", {}, 10, M // 4),                        # never split wider than max_workers
+    ("1M", {"a": M // 2}, 2, M // 2),
+    ("1M", {"a": M // 2, "b": M // 2}, 3, False),  # budget used up
+    ("1M", {"a": None}, 2, False),                 # an unlimited job holds the whole budget
+    ("40k", {}, 4, MIN_RATE),                      # first job gets at least MIN_RATE
+    ("40k", {"a": MIN_RATE}, 4, False),            # the rest wait rather than crawl
+    ("40k", {"a": MIN_RATE}, 1, 24 * K),           # the remainder is still worth starting
+    ("8k", {}, 2, 8 * K),                          # a limit below MIN_RATE is the floor itself
+    ("8k", {"a": 8 * K}, 2, False),
+])
+def test_shaper_acquire(limit, rates, expected, result):
+    s = shaper(limit, rates=rates)
+    assert s.acquire("new", expected) == result
+    if result is False: assert "new" not in s.rates
+    else: assert s.rates["new"] == result
+
+
+def test_shaper_release():
+    s = shaper("1M")
+    s.acquire("a", 1)
+    assert s.acquire("b", 2) is False
+    s.release("a")
+    s.release("missing")
+    assert s.acquire("b", 1) == M
+
+
+@pytest.mark.parametrize("limit, rates, expected", [
+    (None, {"a": None, "b": M}, []),                           # unlimited: nothing to restart
+    ("1M", {"a": 600 * K, "b": 400 * K}, []),                  # uneven but within the limit
+    ("1M", {"a": 400 * K, "b": 400 * K, "c": 400 * K}, []),    # over, but nobody above the slack
+    ("1M", {"a": None, "b": 200 * K}, ["a"]),                  # unlimited jobs always go
+    ("1M", {"a": 2 * M, "b": 200 * K, "c": 200 * K}, ["a"]),
+    ("300k", {"a": 400 * K, "b": 100 * K, "c": 100 * K}, ["a"]),
+    ("300k", {"a": M, "b": M, "c": 50 * K}, ["a", "b"]),
+    # With more jobs than workers the even share is limit / max_workers.
+    ("400k", {n: 100 * K + (n == "e") * 30 * K for n in "abcde"}, ["e"]),
+])
+def test_shaper_over_budget(limit, rates, expected):
+    assert sorted(shaper(limit, max_workers=4, rates=rates).over_budget()) == expected
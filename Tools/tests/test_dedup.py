@@ -0,0 +1,126 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from gallery_dl_dedup import (BAND_BITS, BANDS, LINK, MAX_DISTANCE, MIN_HASH_BITS, MOVE, LibraryIndex, distance,
+                              informative, plan)
+
+FULL = (1 << 64) - 1
+
+
+@pytest.fixture
+def index(tmp_path):
+    library = tmp_path / "library"
+    library.mkdir()
+    index = LibraryIndex(str(library), path=str(tmp_path / "index.sqlite"))
+    yield index
+    index.close()
+
+
+def add(index, name, value, sha256=None, pixels=100, size=1000, mtime=0.0):
+    st = SimpleNamespace(st_size=size, st_mtime=mtime)
+    index.record(f"{index.library}/{name}", st, (sha256 or name, value, pixels))
+
+
+def flip(value, bits):
+    for bit in bits: value ^= 1 << bit
+    return value
+
+
+def spread(count):
+    """`count` bit positions dealt round-robin over the bands: the fewest differing bits in any one band."""
+    return [(i % BANDS) * BAND_BITS + i // BANDS for i in range(count)]
+
+
+def base_hash(rng):
+    """A random hash with about half its bits set, well inside informative()."""
+    while True:
+        value = rng.getrandbits(64)
+        if 24 <= distance(value, 0) <= 40: return value
+
+
+@pytest.mark.parametrize("max_distance", range(MAX_DISTANCE + 1))
+def test_near_finds_every_pair_within_distance(index, max_distance):
+    rng = random.Random(max_distance)
+    base = base_hash(rng)
+    expected = {}
+    for bits in range(max_distance + 1):
+        for n, positions in enumerate([spread(bits), *(rng.sample(range(64), bits) for _ in range(20))]):
+            name = f"d{bits}-{n}.jpg"
+            add(index, name, flip(base, positions))
+            expected[name] = bits
+    found = dict(index.near(base, max_distance))
+    assert found == expected
+
+
+def test_near_skips_pairs_beyond_distance(index):
+    base = base_hash(random.Random(1))
+    add(index, "close.jpg", flip(base, spread(3)))
+    add(index, "far.jpg", flip(base, spread(4)))
+    assert index.near(base, 3) == [("close.jpg", 3)]
+
+
+def test_near_rejects_distance_beyond_band_lookup(index):
+    with pytest.raises(ValueError):
+        index.near(base_hash(random.Random(2)), MAX_DISTANCE + 1)
+
+
+@pytest.mark.parametrize("value, expected", [
+    (0, False),                                   # solid colour
+    (FULL, False),
+    (0x00FF00FF00FF00FF, True),
+    ((1 << MIN_HASH_BITS) - 1, True),
+    ((1 << (MIN_HASH_BITS - 1)) - 1, False),      # a gradient with a little noise
+    (FULL ^ ((1 << (MIN_HASH_BITS - 1)) - 1), False),
+])
+def test_informative(value, expected):
+    assert informative(value) is expected
+
+
+def test_flat_hashes_are_never_near_matched(index):
+    flat = [0, FULL, 0b101, FULL ^ 0b11, 1 << 40]
+    for n, value in enumerate(flat): add(index, f"flat{n}.jpg", value)
+    for value in flat:
+        assert index.near(value, MAX_DISTANCE) == []
+    # An informative hash with only a few set bits of its own never pulls the flat ones in either.
+    edge = (1 << MIN_HASH_BITS) - 1
+    add(index, "edge.jpg", edge)
+    assert index.near(edge, MAX_DISTANCE, exclude="edge.jpg") == []
+    assert index.duplicate_groups(MAX_DISTANCE) == []
+
+
+def test_flat_images_still_group_when_identical(index):
+    add(index, "a.jpg", 0, sha256="same")
+    add(index, "b.jpg", 0, sha256="same")
+    assert [[path for path, _ in group] for group in index.duplicate_groups(MAX_DISTANCE)] == [["a.jpg", "b.jpg"]]
+
+
+def test_groups_are_built_around_the_best_copy(index):
+    base = base_hash(random.Random(3))
+    add(index, "best.jpg", base, pixels=400)
+    add(index, "near.jpg", flip(base, range(0, 4)), pixels=300)
+    # 4 bits from near.jpg but 8 from best.jpg: it must not chain into best's group.
+    add(index, "chained.jpg", flip(base, range(0, 8)), pixels=200)
+    groups = [[path for path, _ in group] for group in index.duplicate_groups(6)]
+    assert groups == [["best.jpg", "near.jpg"]]
+
+
+def test_plan_never_hardlinks_near_duplicates(index):
+    rng = random.Random(4)
+    for n in range(10):
+        base = base_hash(rng)
+        add(index, f"g{n}-keep.jpg", base, sha256=f"h{n}", pixels=1000)
+        add(index, f"g{n}-copy.jpg", base, sha256=f"h{n}", pixels=1000, mtime=1.0)
+        add(index, f"g{n}-near.jpg", flip(base, rng.sample(range(64), 1 + n % 6)), pixels=500)
+    groups = index.duplicate_groups(6)
+    assert len(groups) == 10
+    hashes = {path: sha256 for group in groups for path, sha256 in group}
+
+    steps = plan(groups, LINK)
+    assert {reason for _, _, _, reason in steps} == {"exact", "near"}
+    for action, path, keeper, reason in steps:
+        if action == LINK: assert hashes[path] == hashes[keeper] and reason == "exact"
+        else: assert action is None and reason == "near"
+
+    assert {action for action, _, _, _ in plan(groups, MOVE)} == {MOVE}
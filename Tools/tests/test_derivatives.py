@@ -0,0 +1,28 @@
+import pytest
+
+import gallery_dl_derivatives
+from gallery_dl_derivatives import DerivativePipeline, output_name, parse_sizes
+
+
+def test_parse_sizes():
+    assert parse_sizes(["3840x2160", "2560X1440"]) == [(3840, 2160), (2560, 1440)]
+    with pytest.raises(ValueError):
+        parse_sizes(["3840"])
+
+
+@pytest.mark.parametrize("rel, fmt, expected", [
+    ("artist/1.jpg", "jpg", "artist/1.jpg"),
+    ("artist/1.JPG", "jpg", "artist/1.JPG"),
+    ("artist/1.png", "jpg", "artist/1.png.jpg"),
+    ("artist/1.jpg", "webp", "artist/1.jpg.webp"),
+])
+def test_output_name(rel, fmt, expected):
+    assert output_name(rel, fmt) == expected
+
+
+def test_pipeline_needs_something_to_make(tmp_path, monkeypatch):
+    monkeypatch.setattr(gallery_dl_derivatives, "HAS_PIL", True)  # the check must not depend on Pillow
+    out = tmp_path / "out"
+    with pytest.raises(ValueError, match="nothing to make"):
+        DerivativePipeline(str(tmp_path), str(out), sizes=(), thumb_size=0)
+    assert not out.exists()
@@ -0,0 +1,169 @@
+import time
+
+import pytest
+
+import gallery_dl_journal
+from gallery_dl_journal import (DONE, FAILED, FINISHED, KEEP_BATCHES, PARKED, QUEUED, RUNNING, STOPPED,
+                                JobJournal)
+
+URLS = [f"https://example.com/g/{n}" for n in range(10)]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.sqlite")
+
+
+@pytest.fixture
+def journal(path):
+    journal = JobJournal(path)
+    yield journal
+    journal.close()
+
+
+def states(path, batch_id):
+    """What another process (or a restart after a crash) would read."""
+    other = JobJournal(path)
+    try:
+        return dict(other.db.execute("SELECT url, state FROM jobs WHERE batch_id = ?", (batch_id,)))
+    finally:
+        other.close()
+
+
+def test_create_batch_keeps_order_and_drops_repeats(journal):
+    batch = journal.create_batch(URLS[:3] + URLS[:2], {"workers": 4})
+    assert journal.pending_urls(batch) == URLS[:3]
+    assert journal.add_jobs(batch, URLS[2:5]) == URLS[3:5]
+    assert journal.pending_urls(batch) == URLS[:5]
+    assert journal.batch_options(batch) == {"workers": 4}
+    assert journal.counts(batch) == {QUEUED: 5}
+
+
+def test_add_jobs_continues_the_sequence_after_reopening(journal, path):
+    batch = journal.create_batch(URLS[:3])
+    journal.close()
+    reopened = JobJournal(path)
+    try:
+        reopened.add_jobs(batch, URLS[3:6])
+        assert reopened.pending_urls(batch) == URLS[:6]
+    finally:
+        reopened.close()
+
+
+def test_state_changes_are_buffered_until_flush(journal, path):
+    batch = journal.create_batch(URLS[:2])
+    journal.mark_running(batch, URLS[0])
+    journal.mark_finished(batch, URLS[0], DONE, returncode=0, items=3)
+    assert states(path, batch) == {URLS[0]: QUEUED, URLS[1]: QUEUED}  # a crash here loses the change
+    journal.flush()
+    assert states(path, batch) == {URLS[0]: DONE, URLS[1]: QUEUED}
+
+
+def test_buffer_flushes_itself_when_full(journal, path, monkeypatch):
+    monkeypatch.setattr(gallery_dl_journal, "FLUSH_ROWS", 3)
+    batch = journal.create_batch(URLS[:3])
+    for url in URLS[:3]: journal.mark_running(batch, url)
+    assert set(states(path, batch).values()) == {RUNNING}
+
+
+def test_merged_updates_keep_attempts_and_details(journal):
+    batch = journal.create_batch(URLS[:1])
+    journal.mark_running(batch, URLS[0])
+    journal.mark_finished(batch, URLS[0], FAILED, returncode=4, message="HttpError")
+    journal.mark_running(batch, URLS[0])
+    journal.flush()
+    journal.mark_finished(batch, URLS[0], FAILED)
+    journal.flush()
+    row = journal.db.execute("SELECT state, attempts, returncode, message FROM jobs").fetchone()
+    assert row == (FAILED, 2, 4, "HttpError")
+
+
+def test_crashed_batch_resumes_queued_and_running_urls(journal, path):
+    batch = journal.create_batch(URLS[:4])
+    journal.mark_running(batch, URLS[0])
+    journal.mark_finished(batch, URLS[0], DONE)
+    journal.mark_running(batch, URLS[1])
+    journal.mark_running(batch, URLS[2])
+    journal.mark_interrupted(batch, URLS[2])
+    journal.flush()
+    journal.db.close()  # the process dies without finish_batch()
+
+    reopened = JobJournal(path)
+    try:
+        assert reopened.unfinished_batch() == batch
+        assert reopened.pending_urls(batch) == URLS[1:4]
+        assert reopened.db.execute("SELECT message FROM jobs WHERE url = ?", (URLS[2],)).fetchone() == ("interrupted",)
+    finally:
+        reopened.close()
+
+
+@pytest.mark.parametrize("status, resumable", [(STOPPED, True), (FINISHED, False)])
+def test_unfinished_batch(journal, status, resumable):
+    batch = journal.create_batch(URLS[:2])
+    journal.finish_batch(batch, status)
+    assert journal.unfinished_batch() == (batch if resumable else None)
+
+
+def test_unfinished_batch_ignores_batches_without_work(journal):
+    batch = journal.create_batch(URLS[:1])
+    journal.mark_finished(batch, URLS[0], PARKED)
+    journal.finish_batch(batch, STOPPED)
+    assert journal.unfinished_batch() is None
+
+
+def test_iter_pending_urls_pages_through_the_batch(journal, monkeypatch):
+    monkeypatch.setattr(gallery_dl_journal, "FLUSH_ROWS", 3)
+    batch = journal.create_batch(URLS)
+    journal.mark_finished(batch, URLS[4], DONE)
+    assert list(journal.iter_pending_urls(batch)) == journal.pending_urls(batch) == URLS[:4] + URLS[5:]
+
+
+def test_failed_and_parked_urls_default_to_the_latest_batch(journal):
+    first = journal.create_batch(URLS[:2])
+    journal.mark_finished(first, URLS[0], FAILED)
+    second = journal.create_batch(URLS[2:5])
+    journal.mark_finished(second, URLS[2], FAILED)
+    journal.mark_finished(second, URLS[3], PARKED)
+    assert journal.failed_urls() == [URLS[2]]
+    assert journal.parked_urls() == [URLS[3]]
+    assert journal.failed_urls(first) == [URLS[0]]
+
+
+def test_old_batches_are_pruned(journal):
+    batches = [journal.create_batch(URLS[:1]) for _ in range(KEEP_BATCHES + 3)]
+    kept = [row[0] for row in journal.db.execute("SELECT id FROM batches ORDER BY id")]
+    assert kept == batches[-KEEP_BATCHES:]
+    assert journal.db.execute("SELECT COUNT(DISTINCT batch_id) FROM jobs").fetchone() == (KEEP_BATCHES,)
+
+
+def test_history_outlives_pruned_batches(journal):
+    batch = journal.create_batch(URLS[:1])
+    journal.mark_finished(batch, URLS[0], DONE, items=7)
+    for _ in range(KEEP_BATCHES + 1): journal.create_batch()
+    assert journal.history(URLS[0])["items"] == 7
+
+
+def test_completed_among_matches_any_spelling(journal):
+    batch = journal.create_batch(URLS[:3])
+    journal.mark_finished(batch, URLS[0], DONE, items=2)
+    journal.mark_finished(batch, URLS[1], FAILED)
+    spellings = ["http://EXAMPLE.com/g/0/", URLS[0] + "?utm_source=feed", URLS[1], URLS[2]]
+    assert journal.completed_among(spellings) == set(spellings[:2])
+
+
+def test_completed_among_honours_max_age(journal, monkeypatch):
+    batch = journal.create_batch(URLS[:2])
+    journal.mark_finished(batch, URLS[0], DONE)
+    monkeypatch.setattr(gallery_dl_journal.time, "time", lambda now=time.time(): now + 3600)
+    journal.mark_finished(batch, URLS[1], DONE)
+    assert journal.completed_among(URLS[:2], max_age=60) == {URLS[1]}
+    assert journal.completed_among(URLS[:2], max_age=7200) == set(URLS[:2])
+
+
+def test_history_counts_runs(journal):
+    for _ in range(3):
+        batch = journal.create_batch(URLS[:1])
+        journal.mark_finished(batch, URLS[0], DONE, items=1)
+        journal.flush()
+    assert journal.history(URLS[0])["runs"] == 3
+    assert journal.history(URLS[1]) is None
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+import gallery_dl_urls
+from gallery_dl_urls import UrlQueue, extract_urls, iter_file_urls, normalize_url, unique_urls
+
+
+@pytest.mark.parametrize("a, b", [
+    ("http://example.com/a", "https://example.com/a"),
+    ("https://EXAMPLE.com/a", "https://example.com/a"),
+    ("https://example.com/a/", "https://example.com/a"),
+    ("https://example.com/", "https://example.com"),
+    ("https://example.com:443/a", "https://example.com/a"),
+    ("http://example.com:80/a", "https://example.com/a"),
+    ("https://example.com/a?b=2&a=1", "https://example.com/a?a=1&b=2"),
+    ("https://example.com/a?utm_source=x&id=3&fbclid=y", "https://example.com/a?id=3"),
+    ("  https://example.com/a \n", "https://example.com/a"),
+])
+def test_normalize_url_merges_spellings(a, b):
+    assert normalize_url(a) == normalize_url(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("https://example.com/a", "https://example.com/A"),          # paths are case-sensitive
+    ("https://example.com/a", "https://example.com:8080/a"),
+    ("https://example.com/a?id=1", "https://example.com/a?id=2"),
+    ("https://example.com/a?id", "https://example.com/a"),       # a blank parameter still counts
+    ("https://example.com/a#p2", "https://example.com/a"),
+    ("https://a.example.com/x", "https://b.example.com/x"),
+])
+def test_normalize_url_keeps_distinct_urls(a, b):
+    assert normalize_url(a) != normalize_url(b)
+
+
+@pytest.mark.parametrize("text", [" ftp://example.com/a ", "not a url", "https://[bad", "https:///path"])
+def test_normalize_url_passes_through_what_it_cannot_parse(text):
+    assert normalize_url(text) == text.strip()
+
+
+def test_url_queue_add_is_incremental():
+    queue = UrlQueue()
+    assert queue.add(["https://example.com/a", "# comment", "", "http://example.com/a/"]) == ["https://example.com/a"]
+    assert queue.add(["https://example.com/b", " https://EXAMPLE.com/a "]) == ["https://example.com/b"]
+    assert len(queue) == 2
+    assert "http://example.com/b?utm_medium=x" in queue
+
+
+def test_url_queue_reset_and_clear():
+    queue = UrlQueue()
+    queue.add(["https://example.com/a"])
+    queue.reset("https://example.com/b\n# https://example.com/c\nhttp://example.com/b/\n")
+    assert len(queue) == 1
+    assert "https://example.com/b" in queue and "https://example.com/a" not in queue
+    queue.clear()
+    assert len(queue) == 0
+
+
+def test_unique_urls_keeps_the_first_spelling():
+    lines = ["http://example.com/a/", "https://example.com/a", "", "https://example.com/b"]
+    assert list(unique_urls(lines)) == ["http://example.com/a/", "https://example.com/b"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("see https://example.com/a.", ["https://example.com/a"]),
+    ("(https://example.com/a), or", ["https://example.com/a"]),
+    ("https://en.wikipedia.org/wiki/Foo_(bar)", ["https://en.wikipedia.org/wiki/Foo_(bar)"]),
+    ('<a href="https://example.com/a?x=1&amp;y=2">', ["https://example.com/a?x=1&y=2"]),
+    ('{"uri": "https:\\/\\/example.com\\/a"}', ["https://example.com/a"]),
+    ("HTTP://EXAMPLE.com/A ftp://example.com/b", ["HTTP://EXAMPLE.com/A"]),
+    ("http://a.b", []),  # too short to be a gallery
+])
+def test_extract_urls(text, expected):
+    assert list(extract_urls(text)) == expected
+
+
+def workload():
+    """URLs in the shapes bookmark exports and saved pages put them in, without line breaks."""
+    urls = [f"https://host{n % 7}.example.com/gallery/{n}?page={n % 3}" for n in range(300)]
+    parts = []
+    for n, url in enumerate(urls):
+        if n % 4 == 0: parts.append(f'<DT><A HREF="{url}" ADD_DATE="1">title {n}</A>')
+        elif n % 4 == 1: parts.append(json.dumps({"uri": url}))
+        elif n % 4 == 2: parts.append(f"'{url}'")
+        else: parts.append(f" {url}\t")
+    return urls, "".join(parts)
+
+
+@pytest.mark.parametrize("block", [64, 97, 1000, 1024 * 1024])
+def test_iter_file_urls_across_blocks(tmp_path, monkeypatch, block):
+    urls, text = workload()
+    path = tmp_path / "bookmarks.html"
+    path.write_text(text, encoding="utf-8")
+    monkeypatch.setattr(gallery_dl_urls, "READ_BLOCK", block)
+    monkeypatch.setattr(gallery_dl_urls, "MAX_URL_LENGTH", 60)  # longer than any URL above
+    assert list(iter_file_urls(str(path))) == urls
+
+
+def test_iter_file_urls_tolerates_bad_bytes(tmp_path):
+    path = tmp_path / "list.txt"
+    path.write_bytes(b"https://example.com/a\n\xff\xfe garbage\nhttps://example.com/b")
+    assert list(iter_file_urls(str(path))) == ["https://example.com/a", "https://example.com/b"]